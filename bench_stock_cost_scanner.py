@@ -0,0 +1,543 @@
+# Performance benchmarks for stock_cost_scanner.
+#
+#   python bench_stock_cost_scanner.py                         # 1k, 10k, 100k rows
+#   python bench_stock_cost_scanner.py --sizes 1000,1000000
+#   python bench_stock_cost_scanner.py --save-baseline bench_baseline.json
+#   python bench_stock_cost_scanner.py --baseline bench_baseline.json   # exit 1 on regression
+#   xvfb-run python bench_stock_cost_scanner.py --tk           # also time the window code paths
+#
+# Sheets are synthetic (fixed seed) so two runs on the same machine measure the same work.
+# Results are printed as JSON: {"meta": ..., "results": {"<rows>/<case>": {...}}}.
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import stock_cost_scanner as scs
+
+SCANS_PER_CASE = 1000
+PNG_LIMIT = 500
+NOISE_FLOOR_SECONDS = 0.005
+
+_THAI_WORDS = [
+    "สว่าน", "ไขควง", "ค้อน", "ตะปู", "น็อต", "สกรู", "เลื่อย", "กาว", "สีทาบ้าน", "แปรง",
+    "เทปพันสายไฟ", "ปลั๊กพ่วง", "หลอดไฟ", "ท่อพีวีซี", "ก๊อกน้ำ", "กรรไกร", "คีม", "ประแจ",
+    "ตลับเมตร", "ระดับน้ำ", "ถุงมือ", "บันได", "ชั้นวาง", "กล่องเครื่องมือ",
+]
+_THAI_TRAITS = [
+    "ไร้สาย", "อเนกประสงค์", "สแตนเลส", "ขนาดเล็ก", "ขนาดใหญ่", "กันน้ำ", "สีดำ", "สีแดง",
+    "แพ็ค 10", "แพ็ค 50", "เกรดช่าง", "รุ่นประหยัด",
+]
+
+
+def make_rows(n, seed=1):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        month = f"2025-{rng.randint(1, 12):02d}"
+        sku = f"DW{rng.randint(100, 999)}"
+        name = f"{rng.choice(_THAI_WORDS)} {rng.choice(_THAI_TRAITS)}"
+        qty = rng.randint(1, 500)
+        price = rng.randint(500, 250000) / 100
+        ship = rng.randint(0, 20000) / 100
+        # ~10% of rows have no barcode yet, ~30% are already scanned
+        barcode = "" if rng.random() < 0.1 else f"{sku}-{month.replace('-', '')}-{i:08d}"
+        scan = f"{month}-15 10:{i % 60:02d}:00" if barcode and rng.random() < 0.3 else ""
+        rows.append([month, str(i + 1), sku, name, str(qty), f"{price:.2f}", f"{ship:.2f}",
+                     "", "", barcode, scan])
+    return rows
+
+
+def _scan_codes(model, rng):
+    fresh, done = [], []
+    for rid in model.rids():
+        code = model.get(rid, scs.BARCODE_COL)
+        if code:
+            (done if model.get(rid, scs.SCAN_COL) else fresh).append(code)
+    k = min(SCANS_PER_CASE, len(fresh))
+    return rng.sample(fresh, k), rng.sample(done, min(SCANS_PER_CASE, len(done)))
+
+
+# ---------- Data-layer cases ----------
+# Each case does its setup and returns the zero-argument operation to time plus the
+# number of operations it performs.
+
+def _loaded_model(ctx):
+    model = scs.TableModel()
+    model.load(ctx["rows"])
+    return model
+
+
+def case_load(ctx):
+    def op():
+        scs.TableModel().load(scs.read_sheet_csv(ctx["csv"]))
+    return op, ctx["n"]
+
+
+def case_load_cache(ctx):
+    # startup path: binary session cache (worker-thread read + UI-thread load_snapshot)
+    scs.write_session_cache(ctx["csv"], ctx["rows"], scs._file_fingerprint(ctx["csv"]))
+
+    def op():
+        imp = scs.SessionCacheImport(ctx["csv"])
+        imp._run()
+        scs.TableModel().load_snapshot(imp.snapshot, imp.barcodes)
+    return op, ctx["n"]
+
+
+def case_save(ctx):
+    model = _loaded_model(ctx)
+    out = os.path.join(ctx["tmp"], "save.csv")
+    return (lambda: scs.write_sheet_csv(out, model.rows())), ctx["n"]
+
+
+def case_scan_hit(ctx):
+    model = _loaded_model(ctx)
+    hits, _ = _scan_codes(model, random.Random(2))
+
+    def op():
+        for code in hits:
+            model.apply_scan(code)
+    return op, len(hits)
+
+
+def case_scan_duplicate(ctx):
+    model = _loaded_model(ctx)
+    _, dupes = _scan_codes(model, random.Random(3))
+
+    def op():
+        for code in dupes:
+            model.apply_scan(code)
+    return op, len(dupes)
+
+
+def case_scan_miss(ctx):
+    model = _loaded_model(ctx)
+    misses = [f"NOPE-{i:08d}" for i in range(SCANS_PER_CASE)]
+
+    def op():
+        for code in misses:
+            model.apply_scan(code)
+    return op, len(misses)
+
+
+def case_recalc(ctx):
+    model = _loaded_model(ctx)
+    return (lambda: model.recalc()), ctx["n"]
+
+
+def case_paste(ctx):
+    model = _loaded_model(ctx)
+    text = "\r\n".join("\t".join(r[:scs.SCAN_COL]) for r in make_rows(ctx["n"], seed=4))
+
+    def op():
+        data = scs.parse_clipboard_table(text)
+        model.paste_block(0, 0, data, [""] * len(scs.COLUMNS))
+    return op, ctx["n"]
+
+
+def case_generate(ctx):
+    model = _loaded_model(ctx)
+
+    return (lambda: model.assign_barcodes()), ctx["n"]
+
+
+def case_generate_all(ctx):
+    model = _loaded_model(ctx)
+    return (lambda: model.assign_barcodes(overwrite=True, mode="sequence")), ctx["n"]
+
+
+def case_merge(ctx):
+    # two supplier files: half re-deliveries of existing rows, half new rows
+    rng = random.Random(7)
+    paths = []
+    for k in range(2):
+        incoming = [list(r) for r in rng.sample(ctx["rows"], ctx["n"] // 2)] + make_rows(ctx["n"] // 2, 100 + k)
+        path = os.path.join(ctx["tmp"], f"merge_{k}.csv")
+        scs.write_sheet_csv(path, incoming)
+        paths.append(path)
+
+    def op():
+        model = _loaded_model(ctx)
+        job = scs.SheetMerge.from_model(model, paths)
+        job.run()
+        job.apply(model)
+    return op, 2 * ctx["n"]
+
+
+def _scan_events(ctx):
+    rng = random.Random(11)
+    codes = [r[scs.BARCODE_COL] for r in ctx["rows"] if r[scs.BARCODE_COL]] or ["X"]
+    kinds = ["ok"] * 90 + ["duplicate"] * 7 + ["not_found"] * 3
+    t = 1.7e12
+    events = []
+    for _ in range(ctx["n"]):
+        t += rng.random() * 2000
+        events.append((t, rng.choice(kinds), rng.choice((None, "st1")), rng.choice(codes)))
+    return events
+
+
+def case_scan_events_append(ctx):
+    # one executemany per SCAN_BATCH_MAX scans, as _drain_scans does
+    events = _scan_events(ctx)
+    path = os.path.join(ctx["tmp"], "events_append.sqlite3")
+
+    def op():
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        log = scs.ScanEventLog(path)
+        for i in range(0, len(events), scs.SCAN_BATCH_MAX):
+            log.append(events[i:i + scs.SCAN_BATCH_MAX])
+        log.close()
+    return op, len(events)
+
+
+def case_scan_events_range(ctx):
+    # two-hour windows spread over the whole log, with per-kind counts
+    events = _scan_events(ctx)
+    log = scs.ScanEventLog(os.path.join(ctx["tmp"], "events_range.sqlite3"))
+    log.append(events)
+    first, last = events[0][0], events[-1][0]
+    starts = [first + (last - first) * k / 100 for k in range(100)]
+
+    def op():
+        for start in starts:
+            log.range(start, start + 7200000)
+            log.counts(start, start + 7200000)
+    return op, len(starts)
+
+
+def case_search(ctx):
+    # one search per keystroke of a product name, a SKU and a barcode tail;
+    # the first one also builds the index
+    model = _loaded_model(ctx)
+    index = scs.SearchIndex(model)
+    queries = ["ส", "สว", "สว่", "สว่า", "สว่าน", "d", "dw", "dw1", "dw12", "0", "00", "000", "0001"]
+
+    def op():
+        for q in queries:
+            index.matches(q)
+    return op, len(queries)
+
+
+def _png_codes(ctx):
+    return [r[scs.BARCODE_COL] for r in ctx["rows"] if r[scs.BARCODE_COL]][:PNG_LIMIT]
+
+
+def case_export_png_cold(ctx):
+    codes = _png_codes(ctx)
+    out = os.path.join(ctx["tmp"], "png_cold")
+    cache = os.path.join(ctx["tmp"], "png_cache_cold")
+    shutil.rmtree(out, ignore_errors=True)
+    shutil.rmtree(cache, ignore_errors=True)
+    return (lambda: scs.BarcodeExport(codes, out, cache_dir=cache).run()), len(codes)
+
+
+def case_export_png_warm(ctx):
+    codes = _png_codes(ctx)
+    out = os.path.join(ctx["tmp"], "png_warm")
+    cache = os.path.join(ctx["tmp"], "png_cache_warm")
+    scs.BarcodeExport(codes, out, cache_dir=cache).run()
+    return (lambda: scs.BarcodeExport(codes, out, cache_dir=cache).run()), len(codes)
+
+
+def case_label_sheet(ctx):
+    labels = [(r[scs.BARCODE_COL], r[scs.COL["ชื่อSKU"]], r[scs.COL["ชื่อสินค้า"]])
+              for r in ctx["rows"] if r[scs.BARCODE_COL]][:PNG_LIMIT]
+    path = os.path.join(ctx["tmp"], "labels.pdf")
+    return (lambda: scs.LabelSheet(labels, path).run()), len(labels)
+
+
+DATA_CASES = {
+    "load": case_load,
+    "load_cache": case_load_cache,
+    "save": case_save,
+    "scan_hit": case_scan_hit,
+    "scan_duplicate": case_scan_duplicate,
+    "scan_miss": case_scan_miss,
+    "recalc": case_recalc,
+    "paste": case_paste,
+    "generate": case_generate,
+    "generate_all": case_generate_all,
+    "search": case_search,
+    "merge": case_merge,
+    "scan_events_append": case_scan_events_append,
+    "scan_events_range": case_scan_events_range,
+    "export_png_cold": case_export_png_cold,
+    "export_png_warm": case_export_png_warm,
+    "label_sheet": case_label_sheet,
+}
+
+
+def _has_barcode_deps():
+    try:
+        import barcode  # noqa: F401
+        import PIL  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+# ---------- Window cases (need a display, e.g. xvfb-run) ----------
+
+@contextlib.contextmanager
+def _quiet_dialogs(tmp):
+    # message boxes, folder pickers and "open folder" would block or spawn programs
+    from tkinter import filedialog, messagebox
+    saved = [(messagebox, "showwarning"), (messagebox, "showerror"), (messagebox, "showinfo"),
+             (filedialog, "askdirectory"), (os, "system")]
+    originals = [(obj, name, getattr(obj, name)) for obj, name in saved]
+    for obj, name in saved[:3]:
+        setattr(obj, name, lambda *a, **k: None)
+    filedialog.askdirectory = lambda *a, **k: os.path.join(tmp, "tk_png")
+    os.system = lambda *a, **k: 0
+    try:
+        yield
+    finally:
+        for obj, name, value in originals:
+            setattr(obj, name, value)
+
+
+def _pump(app, until):
+    while not until():
+        app.update()
+        time.sleep(0.001)
+
+
+def make_tk_cases(app):
+    def loaded(ctx):
+        app._load_from_path(ctx["csv"])
+        app.update()
+
+    def tk_load(ctx):
+        def op():
+            app._load_from_path(ctx["csv"])
+            app.update()
+        return op, ctx["n"]
+
+    def tk_save(ctx):
+        loaded(ctx)
+        out = os.path.join(ctx["tmp"], "tk_save.csv")
+        return (lambda: app._save_to_path(out)), ctx["n"]
+
+    def scan_case(pick):
+        def case(ctx):
+            loaded(ctx)
+            hits, dupes = _scan_codes(app.model, random.Random(5))
+            codes = {"hit": hits, "duplicate": dupes,
+                     "miss": [f"NOPE-{i:08d}" for i in range(SCANS_PER_CASE)]}[pick]
+
+            def op():
+                for code in codes:
+                    app.scan_var.set(code)
+                    app.process_scan()
+                _pump(app, lambda: not app._scan_queue)
+            return op, len(codes)
+        return case
+
+    def tk_recalc(ctx):
+        loaded(ctx)
+
+        def op():
+            app.recalc_all()
+            app.update()
+        return op, ctx["n"]
+
+    def tk_paste(ctx):
+        loaded(ctx)
+        text = "\r\n".join("\t".join(r[:scs.SCAN_COL]) for r in make_rows(ctx["n"], seed=4))
+        app.clipboard_clear()
+        app.clipboard_append(text)
+        app.tree.last_anchor = ("#1", app.model.rid_at(0))
+
+        def op():
+            app.paste_from_clipboard()
+            app.update()
+        return op, ctx["n"]
+
+    def tk_generate(ctx):
+        loaded(ctx)
+        app.tree.select_rids([])
+
+        def op():
+            app.generate_barcode_for_selected_or_empty()
+            app.update()
+        return op, ctx["n"]
+
+    def tk_export_png(ctx):
+        loaded(ctx)
+        rids = [rid for rid in app.model.rids() if app.model.get(rid, scs.BARCODE_COL)][:PNG_LIMIT]
+        app.tree.select_rids(rids)
+
+        def op():
+            app.export_barcodes_png(selected_only=True)
+            _pump(app, lambda: app._barcode_export is None)
+        return op, len(rids)
+
+    return {
+        "tk_load": tk_load,
+        "tk_save": tk_save,
+        "tk_scan_hit": scan_case("hit"),
+        "tk_scan_duplicate": scan_case("duplicate"),
+        "tk_scan_miss": scan_case("miss"),
+        "tk_recalc": tk_recalc,
+        "tk_paste": tk_paste,
+        "tk_generate": tk_generate,
+        "tk_export_png": tk_export_png,
+    }
+
+
+def _open_app(tmp):
+    # Keep the benchmark away from every file the app writes next to the script
+    scs.AUTOSAVE_PATH = os.path.join(tmp, "last_session.csv")
+    scs.SETTINGS_PATH = os.path.join(tmp, "app_settings.json")
+    scs.BARCODE_CACHE_DIR = os.path.join(tmp, "tk_png_cache")
+    scs.SCAN_EVENTS_PATH = os.path.join(tmp, "scan_events.sqlite3")
+    scs.METRICS_PATH = os.path.join(tmp, "metrics.jsonl")
+    scs.PROFILE_DIR = os.path.join(tmp, "profiles")
+    scs.SESSION_DB_PATH = os.path.join(tmp, "last_session.sqlite3")
+    scs.ARCHIVE_DIR = os.path.join(tmp, "archive")
+    scs.LABEL_SHEETS_DIR = os.path.join(tmp, "label_sheets")
+    # App reads its settings in __init__, so the autosave mode has to be on disk first
+    with open(scs.SETTINGS_PATH, "w", encoding="utf-8") as f:
+        json.dump({"autosave_mode": "snapshot"}, f)
+    app = scs.App()
+    _pump(app, lambda: app._import is None)
+    return app
+
+
+# ---------- Runner ----------
+
+def measure(case, ctx, repeat, memory):
+    best = None
+    for _ in range(repeat):
+        op, ops = case(ctx)
+        gc.collect()
+        start = time.perf_counter()
+        op()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    result = {"seconds": round(best, 6), "ops": ops,
+              "us_per_op": round(best * 1e6 / ops, 3) if ops else None}
+    if memory:
+        # a separate traced run, so tracemalloc overhead does not leak into the timing
+        op, _ = case(ctx)
+        gc.collect()
+        tracemalloc.start()
+        op()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_mb"] = round(peak / 2 ** 20, 3)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, now in results.items():
+        before = baseline.get("results", {}).get(key)
+        if not before:
+            continue
+        slower = now["seconds"] - before["seconds"]
+        if now["seconds"] > before["seconds"] * (1 + tolerance) and slower > NOISE_FLOOR_SECONDS:
+            regressions.append({"case": key, "metric": "seconds",
+                                "baseline": before["seconds"], "now": now["seconds"],
+                                "ratio": round(now["seconds"] / before["seconds"], 3)})
+        if "peak_mb" in now and before.get("peak_mb"):
+            if now["peak_mb"] > before["peak_mb"] * (1 + tolerance) and now["peak_mb"] - before["peak_mb"] > 1:
+                regressions.append({"case": key, "metric": "peak_mb",
+                                    "baseline": before["peak_mb"], "now": now["peak_mb"],
+                                    "ratio": round(now["peak_mb"] / before["peak_mb"], 3)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark stock_cost_scanner table operations")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma separated row counts (default: %(default)s)")
+    parser.add_argument("--cases", help="comma separated case names (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case, best one counts")
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory run")
+    parser.add_argument("--tk", action="store_true", help="also run the window code paths (needs a display)")
+    parser.add_argument("--out", help="write the JSON results here as well as to stdout")
+    parser.add_argument("--baseline", help="compare against this results file, exit 1 on regression")
+    parser.add_argument("--save-baseline", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown before a case counts as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s.replace("_", "")) for s in args.sizes.split(",") if s.strip()]
+    wanted = set(args.cases.split(",")) if args.cases else None
+    cases = dict(DATA_CASES)
+    if not _has_barcode_deps():
+        print("python-barcode/pillow not installed: skipping PNG export and label cases", file=sys.stderr)
+        cases = {k: v for k, v in cases.items() if not k.startswith(("export_png", "label_"))}
+
+    tmp = tempfile.mkdtemp(prefix="scs_bench_")
+    app = None
+    results = {}
+    try:
+        if args.tk:
+            app = _open_app(tmp)
+            tk_cases = make_tk_cases(app)
+            if not _has_barcode_deps():
+                tk_cases.pop("tk_export_png")
+            cases.update(tk_cases)
+        if wanted:
+            cases = {k: v for k, v in cases.items() if k in wanted}
+        with _quiet_dialogs(tmp) if app is not None else contextlib.nullcontext():
+            for n in sizes:
+                rows = make_rows(n)
+                path = os.path.join(tmp, f"sheet_{n}.csv")
+                scs.write_sheet_csv(path, rows)
+                ctx = {"n": n, "rows": rows, "csv": path, "tmp": tmp}
+                for name, case in cases.items():
+                    results[f"{n}/{name}"] = r = measure(case, ctx, args.repeat, not args.no_memory)
+                    print(f"{n:>9,} {name:<18} {r['seconds']:>10.4f}s"
+                          + (f" {r['peak_mb']:>9.1f} MB" if "peak_mb" in r else ""), file=sys.stderr)
+    finally:
+        if app is not None:
+            try:
+                app.destroy()
+            except Exception:
+                pass
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": scs._numpy() is not None,
+            "repeat": args.repeat,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+    status = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+        status = 1 if regressions else 0
+        for r in regressions:
+            print(f"REGRESSION {r['case']} {r['metric']}: {r['baseline']} -> {r['now']} (x{r['ratio']})",
+                  file=sys.stderr)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    for path in filter(None, [args.out, args.save_baseline]):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
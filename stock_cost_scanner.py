@@ -1,12 +1,24 @@
 
+import array
+import collections
+import contextlib
 import csv
+import io
 import os
+import queue
 import sys
 import datetime
-import random
+import functools
+import itertools
+import operator
+import threading
+import time
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 
+# startup metrics are measured from here
+PROCESS_STARTED = time.perf_counter()
+
 COLUMNS = [
     "รอบเดือน",
     "หมายเลขรายการ",
@@ -24,22 +36,3039 @@ COLUMNS = [
 AUTOSAVE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "last_session.csv")
 SETTINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app_settings.json")
 
+# Operation timings (JSON lines) next to app_settings.json, rotated at METRICS_MAX_BYTES;
+# operations slower than settings "slow_op_ms" are flagged in the status bar.
+# Profiles captured with the status bar "Profile" button go to profiles/.
+METRICS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics.jsonl")
+METRICS_MAX_BYTES = 1024 * 1024
+METRICS_BACKUPS = 3
+SLOW_OP_MS = 1000
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+
+# Journal autosave: compact into last_session.csv once the journal grows past
+# this many bytes or has been accumulating for this many seconds.
+JOURNAL_MAX_BYTES = 4 * 1024 * 1024
+JOURNAL_MAX_AGE = 10 * 60
+
+# Binary copy of the session CSV (columns with numbers already encoded) read at startup
+# instead of parsing the CSV, as long as the CSV's size/mtime match the ones it was
+# written from. Anything else (stale, other Python version, damaged) falls back to the CSV.
+SESSION_CACHE_SUFFIX = ".snap"
+SESSION_CACHE_MAGIC = b"SCSNAP1\n"
+
+# Autosave modes (toolbar "บันทึก", settings "autosave_mode"), name -> toolbar label:
+#   journal   append changed cells/rows to last_session.csv.journal.*, compact in the background (default)
+#   snapshot  rewrite last_session.csv, at most once per AUTOSAVE_COALESCE_MS, in the background
+#   sqlite    one UPDATE/INSERT/DELETE per change in last_session.sqlite3 (WAL); suits very big
+#             sheets with frequent single-row edits. A loaded file is written in the background.
+AUTOSAVE_MODES = {"journal": "Journal", "snapshot": "CSV", "sqlite": "SQLite"}
+
+# SQLite autosave (autosave_mode "sqlite"): one table column per sheet column, in COLUMNS order
+SESSION_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "last_session.sqlite3")
+SESSION_DB_FIELDS = ("month", "item_no", "sku", "name", "qty", "price", "shipping",
+                     "total_cost", "unit_cost", "barcode", "scan")
+
+# Closed months (archive/): gzip shards, summaries and an on-disk barcode index
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive")
+
+# Snapshot autosave: requests within this window are merged into one background write.
+AUTOSAVE_COALESCE_MS = 500
+
+# Virtual table: extra rows kept in the Treeview below the viewport
+VIRTUAL_BUFFER_ROWS = 20
+
+# Streaming CSV import: the first batch is small so the first screen shows up at once,
+# and the UI applies at most IMPORT_ROWS_PER_TICK rows per after() tick.
+IMPORT_FIRST_BATCH_ROWS = 500
+IMPORT_BATCH_ROWS = 5000
+IMPORT_QUEUE_BATCHES = 64
+IMPORT_ROWS_PER_TICK = 20000
+IMPORT_POLL_MS = 10
+
+# Merge import (supplier CSVs into the current sheet). Rows match on Barcode, or on
+# (รอบเดือน, หมายเลขรายการ, ชื่อSKU) when the incoming row has no barcode. Rules per group:
+#   qty:   "sum" adds incoming quantities, "overwrite" takes the incoming one, "keep" only fills empty
+#   price: price/shipping, "overwrite" or "keep"
+#   scan:  "keep" never replaces a Scan timestamp (only fills empty), "overwrite" does
+# Any other non-empty cell that differs is a conflict: the sheet keeps its value and the
+# diff report lists it.
+MERGE_RULES = {"qty": ("sum", "overwrite", "keep"), "price": ("overwrite", "keep"), "scan": ("keep", "overwrite")}
+MERGE_DEFAULT_RULES = {"qty": "sum", "price": "overwrite", "scan": "keep"}
+MERGE_REPORT_COLUMNS = ("ผล", "ไฟล์", "แถวในไฟล์", "คีย์", "แถวในตาราง", "คอลัมน์", "ค่าเดิม", "ค่าใหม่")
+
+# Barcode PNG export: same writer options for every label, rendered once into
+# barcode_cache/ (keyed by text + options). Small jobs skip the process pool.
+BARCODE_WRITER_OPTIONS = {"font_size": 12, "text_distance": 6, "module_height": 15}
+BARCODE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "barcode_cache")
+BARCODE_POOL_MIN_JOBS = 32
+# Pruned on startup: files older than BARCODE_CACHE_MAX_AGE_DAYS go, then the oldest
+# until the folder is under BARCODE_CACHE_MAX_BYTES (a missing label is just re-rendered)
+BARCODE_CACHE_MAX_BYTES = 200 * 1024 * 1024
+BARCODE_CACHE_MAX_AGE_DAYS = 180
+
+# Label sheets: Code128 labels (same writer options) laid out N-up per page and written as
+# one PDF/TIFF that goes to the printer as a single job. Sizes are in millimetres.
+LABEL_DPI = 300
+LABEL_TEMPLATES = {
+    "a4-3x8": dict(page=(210, 297), grid=(3, 8), label=(63.5, 33.9), origin=(7.2, 12.9), gap=(2.5, 0)),
+    "a4-2x7": dict(page=(210, 297), grid=(2, 7), label=(99.1, 38.1), origin=(4.7, 15.2), gap=(2.5, 0)),
+    "a4-5x13": dict(page=(210, 297), grid=(5, 13), label=(38.1, 21.2), origin=(4.7, 10.7), gap=(2.5, 0)),
+    "roll-50x30": dict(page=(50, 30), grid=(1, 1), label=(50, 30), origin=(0, 0), gap=(0, 0)),
+}
+LABEL_DEFAULT_TEMPLATE = "a4-3x8"
+# Printed sheets go to label_sheets/; only the newest LABEL_SHEETS_KEEP are kept, since
+# the spooler (or the viewer opened as a fallback) may still be reading the last ones
+LABEL_SHEETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "label_sheets")
+LABEL_SHEETS_KEEP = 10
+LABEL_TEXT_MM = 3
+# First font that loads is used for SKU / product name (needs Thai glyphs)
+LABEL_FONTS = ("tahoma.ttf", "Tahoma.ttf", "/System/Library/Fonts/Supplemental/Tahoma.ttf",
+               "/System/Library/Fonts/Thonburi.ttc", "/usr/share/fonts/truetype/tlwg/Garuda.ttf",
+               "/usr/share/fonts/truetype/noto/NotoSansThai-Regular.ttf", "DejaVuSans.ttf")
+
+# Cost engine: batches at least this big go through NumPy when it is installed
+RECALC_NUMPY_MIN_ROWS = 2048
+
+# Batch mode: barcode PNGs are exported in chunks of this many codes
+BATCH_PNG_CHUNK = 5000
+
+# Scan box: a scanner types a whole code within a few ms per character. A burst of at
+# least SCAN_MIN_LENGTH characters followed by a pause longer than SCAN_MAX_GAP_MS is a
+# complete code even without Enter/Tab; slower typing waits for Enter.
+SCAN_MAX_GAP_MS = 50
+SCAN_MIN_LENGTH = 4
+SCAN_TERMINATORS = ("Return", "KP_Enter", "Tab")
+# queued scans applied per UI tick (one autosave per tick) and lines kept in the scan log
+SCAN_BATCH_MAX = 200
+SCAN_LOG_LINES = 500
+
+# Network scans from other stations (settings "scan_server"): default ports, and how
+# often the window picks up what arrived
+SCAN_SERVER_TCP_PORT = 8765
+SCAN_SERVER_HTTP_PORT = 8766
+SCAN_SERVER_POLL_MS = 20
+# largest HTTP POST body accepted (413 above it); TCP lines are capped by the stream limit
+SCAN_SERVER_MAX_BODY = 1024 * 1024
+
+# Scan event log: every scan attempt and Scan clear, kept in scan_events.sqlite3 with a
+# time index. Live stats are scans per minute over these windows (minutes), refreshed
+# every SCAN_STATS_REFRESH_MS; the history window shows at most SCAN_HISTORY_LIMIT events.
+SCAN_EVENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scan_events.sqlite3")
+SCAN_EVENT_KINDS = ("ok", "duplicate", "not_found", "archived", "clear")
+SCAN_EVENT_LABELS = {"ok": "สำเร็จ", "duplicate": "สแกนซ้ำ", "not_found": "ไม่พบ", "archived": "อยู่ในคลัง",
+                     "clear": "เคลียร์ Scan"}
+SCAN_STATS_WINDOWS = (1, 5, 15)
+SCAN_STATS_REFRESH_MS = 5000
+SCAN_HISTORY_LIMIT = 5000
+
+
+def iter_sheet_csv(f):
+    # Rows of an open sheet CSV as value lists in COLUMNS order
+    reader = csv.reader(f)
+    header = next(reader, None) or []
+    missing = [c for c in COLUMNS if c not in header]
+    if missing:
+        raise ValueError("คอลัมน์หายไป: " + ", ".join(missing))
+    idx = [header.index(c) for c in COLUMNS]
+    width = len(header)
+    for rec in reader:
+        if not rec:
+            continue
+        if len(rec) >= width:
+            yield [rec[i] for i in idx]
+        else:
+            yield [rec[i] if i < len(rec) else "" for i in idx]
+
+
+def read_sheet_csv(path: str):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return list(iter_sheet_csv(f))
+
+
+def parse_clipboard_table(raw: str):
+    # Excel/Sheets clipboard block: tab-separated lines; cells holding tabs, newlines or
+    # quotes come wrapped in double quotes. Blank lines are skipped as before.
+    if '"' in raw:
+        rows = list(csv.reader(io.StringIO(raw, newline=""), delimiter="\t", quotechar='"'))
+    else:
+        rows = [line.split("\t") for line in raw.splitlines()]
+    return [r for r in rows if any(cell.strip() for cell in r)]
+
+
+def write_sheet_csv(path: str, rows):
+    # Write next to the target and swap it in, so a crash never leaves a half-written sheet
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+BARCODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"  # 32 symbols: one random byte & 31 each
+BARCODE_MODES = ("random", "sequence")
+# secrets.token_bytes -> alphabet characters in one bytes.translate call
+_BARCODE_BYTE_TABLE = bytes(ord(BARCODE_ALPHABET[i & 31]) for i in range(256))
+
+
+def barcode_prefix(sku):
+    # SKU name, or the item number when there is none
+    return (sku or "ITEM").replace(" ", "").upper()
+
+
+class BarcodeGenerator:
+    # <SKU or item no.>-<YYYYMM>-<suffix>, never equal to a code in `existing` or to one
+    # handed out before. "random": 6 characters from secrets; "sequence": 000001, 000002, ...
+    # per SKU and month, continuing after the highest number already in use. `used`: where
+    # the codes in use are kept (a set by default, or a BarcodeDiskSet).
+    def __init__(self, existing=(), mode="random", suffix_length=6, used=None):
+        if mode not in BARCODE_MODES:
+            raise ValueError(f"unknown barcode mode: {mode}")
+        self.mode = mode
+        self.suffix_length = suffix_length
+        self.used = set() if used is None else used
+        self.used.update(existing)
+        self._month = datetime.datetime.now().strftime("%Y%m")
+        self._seq = None
+        self._pool = ""
+
+    def _random_suffix(self):
+        n = self.suffix_length
+        if len(self._pool) < n:
+            import secrets
+            self._pool = secrets.token_bytes(max(n * 4096, n)).translate(_BARCODE_BYTE_TABLE).decode("ascii")
+        suffix, self._pool = self._pool[:n], self._pool[n:]
+        return suffix
+
+    def _next_seq(self, head):
+        if self._seq is None:
+            # highest number per "<prefix>-<YYYYMM>" over the codes already in use
+            self._seq = {}
+            for code in self.used:
+                base, sep, tail = code.rpartition("-")
+                if sep and tail.isdigit():
+                    n = int(tail)
+                    if n > self._seq.get(base, 0):
+                        self._seq[base] = n
+        n = self._seq.get(head, 0) + 1
+        self._seq[head] = n
+        return f"{n:0{self.suffix_length}d}"
+
+    def next(self, prefix):
+        head = f"{prefix}-{self._month}"
+        while True:
+            suffix = self._random_suffix() if self.mode == "random" else self._next_seq(head)
+            code = f"{head}-{suffix}"
+            if code not in self.used:
+                self.used.add(code)
+                return code
+
+
+class BarcodeDiskSet:
+    # The set operations BarcodeGenerator needs, kept in a SQLite file instead of memory,
+    # for batch runs over sheets too big to hold every barcode
+    def __init__(self, path: str):
+        import sqlite3
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=OFF")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("CREATE TABLE IF NOT EXISTS codes (code TEXT PRIMARY KEY) WITHOUT ROWID")
+
+    def __contains__(self, code):
+        return self._db.execute("SELECT 1 FROM codes WHERE code = ?", (code,)).fetchone() is not None
+
+    def add(self, code):
+        self._db.execute("INSERT OR IGNORE INTO codes (code) VALUES (?)", (code,))
+
+    def update(self, codes):
+        self._db.executemany("INSERT OR IGNORE INTO codes (code) VALUES (?)", ((code,) for code in codes))
+
+    def __iter__(self):
+        return (code for (code,) in self._db.execute("SELECT code FROM codes"))
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM codes").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+class BarcodeIndex:
+    # Barcode -> row ids, so a scan is one dict lookup instead of a walk over the table.
+    # A barcode mapped to more than one row is a duplicate in the sheet.
+    def __init__(self):
+        self._rows = {}
+        self._codes = {}
+        self._dupes = set()
+
+    def clear(self):
+        self._rows.clear()
+        self._codes.clear()
+        self._dupes.clear()
+
+    def set(self, iid, code):
+        code = str(code or "").strip()
+        if self._codes.get(iid) == code:
+            return
+        self.discard(iid)
+        if not code:
+            return
+        self._codes[iid] = code
+        rows = self._rows.setdefault(code, [])
+        rows.append(iid)
+        if len(rows) > 1:
+            self._dupes.add(code)
+
+    def discard(self, iid):
+        code = self._codes.pop(iid, None)
+        if code is None:
+            return
+        rows = self._rows.get(code, [])
+        try:
+            rows.remove(iid)
+        except ValueError:
+            pass
+        if not rows:
+            self._rows.pop(code, None)
+        if len(rows) < 2:
+            self._dupes.discard(code)
+
+    def rebuild(self, codes):
+        # Replace everything from codes[rid] for rids 0..n-1 (bulk load)
+        self.clear()
+        rows, by_rid, dupes = self._rows, self._codes, self._dupes
+        for rid, code in enumerate(codes):
+            code = code.strip()
+            if not code:
+                continue
+            by_rid[rid] = code
+            lst = rows.get(code)
+            if lst is None:
+                rows[code] = [rid]
+            else:
+                lst.append(rid)
+                dupes.add(code)
+
+    def get(self, code):
+        return list(self._rows.get(str(code).strip(), ()))
+
+    def duplicates(self):
+        return {code: list(self._rows[code]) for code in self._dupes}
+
+    def codes(self):
+        return self._rows.keys()
+
+    def __len__(self):
+        return len(self._rows)
+
+
+# Column index lookups, so hot paths don't call COLUMNS.index per row
+COL = {name: idx for idx, name in enumerate(COLUMNS)}
+QTY_COL = COL["จำนวน (ชิ้น)"]
+PRICE_COL = COL["ราคาสินค้าต่อหน่วย (บาท)"]
+SHIP_COL = COL["ค่าส่งรวม (บาท)"]
+TOTAL_COST_COL = COL["ต้นทุนรวม (บาท)"]
+UNIT_COST_COL = COL["ต้นทุนต่อตัว (บาท)"]
+BARCODE_COL = COL["Barcode"]
+ITEM_COL = COL["หมายเลขรายการ"]
+SKU_COL = COL["ชื่อSKU"]
+SCAN_COL = COL["Scan"]
+NUMERIC_COLUMNS = (QTY_COL, PRICE_COL, SHIP_COL, TOTAL_COST_COL, UNIT_COST_COL)
+# Few distinct values repeated over many rows: stored once through sys.intern
+INTERNED_COLUMNS = (COL["รอบเดือน"], COL["ชื่อSKU"])
+
+# How a numeric cell's text is rebuilt from its float; anything that does not
+# round-trip exactly keeps its original text in TableModel._raw.
+_NUM_EMPTY, _NUM_INT, _NUM_FIXED2, _NUM_REPR, _NUM_RAW = range(5)
+
+
+def _encode_number(text: str):
+    if text == "":
+        return 0.0, _NUM_EMPTY
+    if text[0].isalpha() and text[0] not in "iInN":
+        return float("nan"), _NUM_RAW  # plain text: skip the ValueError from float()
+    try:
+        value = float(text)
+    except ValueError:
+        return float("nan"), _NUM_RAW
+    if value != value or value in (float("inf"), float("-inf")):
+        return float("nan"), _NUM_RAW
+    if value.is_integer() and abs(value) < 1e15 and str(int(value)) == text:
+        return value, _NUM_INT
+    if f"{value:.2f}" == text:
+        return value, _NUM_FIXED2
+    if repr(value) == text:
+        return value, _NUM_REPR
+    return value, _NUM_RAW
+
+
+# outcome "archived": not in the table but in a closed month (month, timestamp = its Scan)
+ScanResult = collections.namedtuple("ScanResult", "outcome code rid timestamp matches month", defaults=(None,))
+# generated: rows that got a new code; skipped: rows that kept the one they had
+BarcodeAssignResult = collections.namedtuple("BarcodeAssignResult", "generated skipped mode")
+# computed: rows with valid inputs; changed: rids whose costs were rewritten;
+# errors: (rid, col, text) for quantity/price/shipping cells that are not numbers
+RecalcResult = collections.namedtuple("RecalcResult", "computed changed errors")
+COST_INPUT_COLUMNS = (QTY_COL, PRICE_COL, SHIP_COL)
+# Filter box: columns searched by substring
+SEARCH_COLUMNS = (COL["หมายเลขรายการ"], COL["ชื่อSKU"], COL["ชื่อสินค้า"], BARCODE_COL)
+FILTER_SCAN_CHOICES = ("ทั้งหมด", "สแกนแล้ว", "ยังไม่สแกน")
+
+
+@functools.lru_cache(maxsize=None)
+def _numpy():
+    # NumPy is optional; without it the cost engine runs as a plain Python loop
+    try:
+        import numpy  # type: ignore
+        return numpy
+    except Exception:
+        return None
+
+
+class TableModel:
+    # The sheet, independent of Tk. Rows are addressed by integer row ids (rid) that stay
+    # valid until the row is deleted; display order is kept separately in _order.
+    #
+    # Storage is column-wise: the numeric columns are array("d") plus a one-byte format
+    # code per cell, text columns are plain lists (month/SKU interned).
+    #
+    # Listeners registered with subscribe() are called as listener(kind, rids, info):
+    #   "insert": rids were inserted starting at position info
+    #   "delete": rids were removed; info = their positions before removal
+    #   "update": cells in columns info (a set) changed on rids
+    #   "reset":  the whole table was replaced; rids = new rows in order
+    def __init__(self):
+        self._text = {c: [] for c in range(len(COLUMNS)) if c not in NUMERIC_COLUMNS}
+        self._num = {c: array.array("d") for c in NUMERIC_COLUMNS}
+        self._fmt = {c: array.array("b") for c in NUMERIC_COLUMNS}
+        self._raw = {}
+        self._capacity = 0
+        self._free = []
+        self._order = []
+        self._pos = {}
+        self._pos_valid = True
+        self._listeners = []
+        self.barcodes = BarcodeIndex()
+
+    # ----- listeners -----
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        try:
+            self._listeners.remove(listener)
+        except ValueError:
+            pass
+
+    def _notify(self, kind, rids, info=None):
+        for listener in list(self._listeners):
+            listener(kind, rids, info)
+
+    # ----- storage -----
+    def _alloc(self, n):
+        reused = self._free[-n:] if n <= len(self._free) else list(self._free)
+        del self._free[len(self._free) - len(reused):]
+        extra = n - len(reused)
+        if extra > 0:
+            start = self._capacity
+            self._capacity += extra
+            for lst in self._text.values():
+                lst.extend([""] * extra)
+            for arr in self._num.values():
+                arr.extend(array.array("d", bytes(8 * extra)))
+            for arr in self._fmt.values():
+                arr.extend(array.array("b", bytes(extra)))
+            reused.extend(range(start, start + extra))
+        return reused
+
+    def _store(self, rid, col, text):
+        text = "" if text is None else str(text)
+        if col in self._num:
+            value, fmt = _encode_number(text)
+            fmts = self._fmt[col]
+            if fmts[rid] == _NUM_RAW:
+                self._raw.pop((col, rid), None)
+            self._num[col][rid] = value
+            fmts[rid] = fmt
+            if fmt == _NUM_RAW:
+                self._raw[(col, rid)] = text
+            return
+        if col in INTERNED_COLUMNS:
+            text = sys.intern(text)
+        self._text[col][rid] = text
+        if col == BARCODE_COL:
+            self.barcodes.set(rid, text)
+
+    def _store_column(self, col, rids, texts):
+        # Bulk _store for one column (used by inserts and batch updates)
+        texts = [t if t.__class__ is str else ("" if t is None else str(t)) for t in texts]
+        if col in self._num:
+            values, fmts, raw = self._num[col], self._fmt[col], self._raw
+            encoded = {}  # quantities/prices repeat a lot within a batch
+            for rid, text in zip(rids, texts):
+                enc = encoded.get(text)
+                if enc is None:
+                    enc = encoded[text] = _encode_number(text)
+                if fmts[rid] == _NUM_RAW:
+                    raw.pop((col, rid), None)
+                values[rid], fmts[rid] = enc
+                if enc[1] == _NUM_RAW:
+                    raw[(col, rid)] = text
+            return
+        if col in INTERNED_COLUMNS:
+            texts = list(map(sys.intern, texts))
+        lst = self._text[col]
+        if rids and rids[-1] - rids[0] == len(rids) - 1 and rids == list(range(rids[0], rids[-1] + 1)):
+            lst[rids[0]:rids[-1] + 1] = texts
+        else:
+            for rid, text in zip(rids, texts):
+                lst[rid] = text
+        if col == BARCODE_COL:
+            index_set = self.barcodes.set
+            for rid, text in zip(rids, texts):
+                index_set(rid, text)
+
+    def _clear_slot(self, rid):
+        for col in NUMERIC_COLUMNS:
+            self._store(rid, col, "")
+        for lst in self._text.values():
+            lst[rid] = ""
+        self.barcodes.discard(rid)
+
+    def get(self, rid, col):
+        if col in self._num:
+            fmt = self._fmt[col][rid]
+            if fmt == _NUM_EMPTY:
+                return ""
+            value = self._num[col][rid]
+            if fmt == _NUM_INT:
+                return str(int(value))
+            if fmt == _NUM_FIXED2:
+                return f"{value:.2f}"
+            if fmt == _NUM_REPR:
+                return repr(value)
+            return self._raw[(col, rid)]
+        return self._text[col][rid]
+
+    def number(self, rid, col):
+        # float value of a numeric cell; None when empty, NaN when the text is not a number
+        if self._fmt[col][rid] == _NUM_EMPTY:
+            return None
+        return self._num[col][rid]
+
+    def row(self, rid):
+        return [self.get(rid, col) for col in range(len(COLUMNS))]
+
+    def column(self, col, rids=None):
+        rids = self._order if rids is None else rids
+        if col not in self._num:
+            lst = self._text[col]
+            return [lst[rid] for rid in rids]
+        values, fmts, raw = self._num[col], self._fmt[col], self._raw
+        out = []
+        append = out.append
+        for rid in rids:
+            fmt = fmts[rid]
+            if fmt == _NUM_EMPTY:
+                append("")
+            elif fmt == _NUM_INT:
+                append(str(int(values[rid])))
+            elif fmt == _NUM_FIXED2:
+                append(f"{values[rid]:.2f}")
+            elif fmt == _NUM_REPR:
+                append(repr(values[rid]))
+            else:
+                append(raw[(col, rid)])
+        return out
+
+    def rows(self, rids=None):
+        rids = self._order if rids is None else rids
+        return [list(row) for row in zip(*[self.column(col, rids) for col in range(len(COLUMNS))])]
+
+    def frozen_copy(self):
+        # Detached copy of the storage: whole-list/array copies, no per-cell work, so it is
+        # cheap on the UI thread and rows() can then be built from it on another thread.
+        # No listeners, and the barcode index is left empty.
+        copy = TableModel()
+        copy._text = {c: lst[:] for c, lst in self._text.items()}
+        copy._num = {c: arr[:] for c, arr in self._num.items()}
+        copy._fmt = {c: arr[:] for c, arr in self._fmt.items()}
+        copy._raw = dict(self._raw)
+        copy._capacity = self._capacity
+        copy._order = self._order[:]
+        copy._pos_valid = False
+        return copy
+
+    # ----- order -----
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return iter(list(self._order))
+
+    def __contains__(self, rid):
+        if not self._pos_valid:
+            self._reindex_positions()
+        return rid in self._pos
+
+    def rids(self):
+        return list(self._order)
+
+    def rid_at(self, pos):
+        return self._order[pos]
+
+    def _reindex_positions(self):
+        self._pos = {rid: idx for idx, rid in enumerate(self._order)}
+        self._pos_valid = True
+
+    def position(self, rid):
+        if not self._pos_valid:
+            self._reindex_positions()
+        return self._pos[rid]
+
+    # ----- mutations -----
+    def set(self, rid, col, text):
+        self.update_cells({rid: {col: text}})
+
+    def update_cells(self, changes):
+        # changes: {rid: {col: text}}; one "update" notification for the whole batch
+        by_col = {}
+        for rid, cells in changes.items():
+            for col, text in cells.items():
+                pair = by_col.get(col)
+                if pair is None:
+                    pair = by_col[col] = ([], [])
+                pair[0].append(rid)
+                pair[1].append(text)
+        for col, (rids, texts) in by_col.items():
+            self._store_column(col, rids, texts)
+        cols = set(by_col)
+        touched = list(changes)
+        if touched:
+            self._notify("update", touched, cols)
+        return touched
+
+    def insert_rows(self, pos, rows):
+        rows = list(rows)
+        if not rows:
+            return []
+        pos = min(max(pos, 0), len(self._order))
+        rids = self._alloc(len(rows))
+        width = len(COLUMNS)
+        for col in range(width):
+            self._store_column(col, rids, [r[col] if col < len(r) else "" for r in rows])
+        at_end = pos == len(self._order)
+        self._order[pos:pos] = rids
+        if at_end and self._pos_valid:
+            for offset, rid in enumerate(rids):
+                self._pos[rid] = pos + offset
+        else:
+            self._pos_valid = False
+        self._notify("insert", rids, pos)
+        return rids
+
+    def append_rows(self, rows):
+        return self.insert_rows(len(self._order), rows)
+
+    def paste_block(self, start_pos, start_col, data, template, protected=(SCAN_COL,)):
+        # Write a 2-D block of texts with its top-left cell at (start_pos, start_col).
+        # Rows past the end are appended (template values plus the pasted cells), cells
+        # beyond the last column or in protected columns are ignored. One "update" for
+        # the existing rows and one "insert" for the new ones.
+        width = len(COLUMNS)
+        start_pos = min(max(start_pos, 0), len(self._order))
+        existing = min(len(data), len(self._order) - start_pos)
+        span = max((len(r) for r in data), default=0)
+        targets = [(c, start_col + c) for c in range(span)
+                   if 0 <= start_col + c < width and start_col + c not in protected]
+        old_rows, new_rows = data[:existing], data[existing:]
+        rids = self._order[start_pos:start_pos + existing]
+        cols = set()
+        for c, col in targets:
+            pairs = [(rid, row[c]) for rid, row in zip(rids, old_rows) if len(row) > c]
+            if pairs:
+                cols.add(col)
+                self._store_column(col, [p[0] for p in pairs], [p[1] for p in pairs])
+        if rids and cols:
+            self._notify("update", rids, cols)
+        added = []
+        if new_rows:
+            block = []
+            for row in new_rows:
+                values = list(template)
+                for c, col in targets:
+                    if len(row) > c:
+                        values[col] = row[c]
+                block.append(values)
+            added = self.append_rows(block)
+        return rids, added
+
+    def delete(self, rids):
+        rids = [rid for rid in dict.fromkeys(rids) if rid in self]
+        if not rids:
+            return []
+        positions = [self.position(rid) for rid in rids]
+        gone = set(rids)
+        self._order = [rid for rid in self._order if rid not in gone]
+        self._pos_valid = False
+        for rid in rids:
+            self._clear_slot(rid)
+            self._free.append(rid)
+        self._notify("delete", rids, positions)
+        return rids
+
+    def load(self, rows):
+        # Replace the whole table
+        self._text = {c: [] for c in self._text}
+        self._num = {c: array.array("d") for c in NUMERIC_COLUMNS}
+        self._fmt = {c: array.array("b") for c in NUMERIC_COLUMNS}
+        self._raw = {}
+        self._capacity = 0
+        self._free = []
+        self._order = []
+        self._pos = {}
+        self._pos_valid = True
+        self.barcodes.clear()
+        listeners, self._listeners = self._listeners, []
+        try:
+            self.append_rows(rows)
+        finally:
+            self._listeners = listeners
+        self._notify("reset", list(self._order))
+
+    def load_snapshot(self, snapshot, barcodes=None):
+        # Replace the whole table from encode_session_snapshot() output; the numbers come
+        # pre-encoded, so none of load()'s per-cell parsing happens here. barcodes: an
+        # index already rebuilt from the snapshot's barcode column (e.g. on a worker thread)
+        n, texts, nums, fmts, raw = snapshot
+        self._text = {c: list(map(sys.intern, texts[c])) if c in INTERNED_COLUMNS else list(texts[c])
+                      for c in self._text}
+        self._num = {c: array.array("d", nums[c]) for c in NUMERIC_COLUMNS}
+        self._fmt = {c: array.array("b", fmts[c]) for c in NUMERIC_COLUMNS}
+        self._raw = {(col, pos): text for col, pos, text in raw}
+        self._capacity = n
+        self._free = []
+        self._order = list(range(n))
+        self._pos = dict(zip(self._order, self._order))
+        self._pos_valid = True
+        if barcodes is None:
+            self.barcodes.rebuild(self._text[BARCODE_COL])
+        else:
+            self.barcodes = barcodes
+        self._notify("reset", list(self._order))
+
+    # ----- queries -----
+    def find_barcode(self, code):
+        # rows carrying this barcode, in table order
+        rids = self.barcodes.get(code)
+        if len(rids) > 1:
+            rids.sort(key=self.position)
+        return rids
+
+    def duplicate_barcodes(self):
+        return self.barcodes.duplicates()
+
+    # ----- operations -----
+    def assign_barcodes(self, rids=None, overwrite=False, mode="random", reserved=()):
+        # New unique barcodes for `rids` (all rows by default) in one "update". Rows that
+        # already have a code are skipped unless `overwrite`. `reserved`: codes in use
+        # outside the table (closed months) that must not be handed out again.
+        rids = self._order if rids is None else list(rids)
+        gen = BarcodeGenerator(itertools.chain(self.barcodes.codes(), reserved), mode)
+        sku_col, item_col = COL["ชื่อSKU"], COL["หมายเลขรายการ"]
+        changes, skipped = {}, 0
+        for rid in rids:
+            if not overwrite and self.get(rid, BARCODE_COL).strip():
+                skipped += 1
+                continue
+            prefix = barcode_prefix(self.get(rid, sku_col) or self.get(rid, item_col))
+            changes[rid] = {BARCODE_COL: gen.next(prefix)}
+        self.update_cells(changes)
+        return BarcodeAssignResult(len(changes), skipped, mode)
+
+    def apply_scan(self, code, timestamp=None):
+        # Same rules as the scan box: first row with the barcode wins, an existing
+        # Scan value is never overwritten.
+        code = str(code).strip()
+        rids = self.find_barcode(code)
+        if not rids:
+            return ScanResult("not_found", code, None, None, 0)
+        rid = rids[0]
+        if self.get(rid, SCAN_COL).strip():
+            return ScanResult("duplicate", code, rid, self.get(rid, SCAN_COL), len(rids))
+        ts = timestamp or datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.set(rid, SCAN_COL, ts)
+        return ScanResult("ok", code, rid, ts, len(rids))
+
+    def cost_inputs_invalid(self, rid):
+        # a quantity/price/shipping cell holds text that is not a number
+        return any(self._num[c][rid] != self._num[c][rid] for c in COST_INPUT_COLUMNS)
+
+    def recalc(self, rids=None):
+        # ต้นทุนรวม = จำนวน * ราคา + ค่าส่ง, ต้นทุนต่อตัว = ต้นทุนรวม / จำนวน
+        # Works on the numeric columns directly (empty = 0, not-a-number = NaN) and only
+        # rewrites rows whose costs actually change.
+        rids = self._order if rids is None else list(rids)
+        np = _numpy() if len(rids) >= RECALC_NUMPY_MIN_ROWS else None
+        if np is not None:
+            changed, bad = self._recalc_numpy(np, rids)
+        else:
+            changed, bad = self._recalc_python(rids)
+        errors = [(rid, col, self.get(rid, col)) for rid in bad
+                  for col in COST_INPUT_COLUMNS if self._num[col][rid] != self._num[col][rid]]
+        if changed:
+            self._notify("update", changed, {TOTAL_COST_COL, UNIT_COST_COL})
+        return RecalcResult(len(rids) - len(bad), changed, errors)
+
+    def _set_cost(self, rid, total, unit):
+        for col, value in ((TOTAL_COST_COL, total), (UNIT_COST_COL, unit)):
+            if self._fmt[col][rid] == _NUM_RAW:
+                self._raw.pop((col, rid), None)
+            self._num[col][rid] = value
+            self._fmt[col][rid] = _NUM_FIXED2
+
+    def _recalc_python(self, rids):
+        qty_v, price_v, ship_v = (self._num[c] for c in COST_INPUT_COLUMNS)
+        tot_v, tot_f = self._num[TOTAL_COST_COL], self._fmt[TOTAL_COST_COL]
+        unit_v, unit_f = self._num[UNIT_COST_COL], self._fmt[UNIT_COST_COL]
+        changed, bad = [], []
+        for rid in rids:
+            qty, price, ship = qty_v[rid], price_v[rid], ship_v[rid]
+            if qty != qty or price != price or ship != ship:
+                bad.append(rid)
+                continue
+            total = qty * price + ship
+            unit = round(total / qty, 2) if qty else 0.0
+            total = round(total, 2)
+            if (tot_f[rid] == _NUM_FIXED2 and unit_f[rid] == _NUM_FIXED2
+                    and tot_v[rid] == total and unit_v[rid] == unit):
+                continue
+            self._set_cost(rid, total, unit)
+            changed.append(rid)
+        return changed, bad
+
+    @staticmethod
+    def _round2_numpy(np, values):
+        # np.round scales by 100 first and can pick the other side of a .xx5 tie; those
+        # few values are redone with round(), which matches the f"{x:.2f}" text
+        rounded = np.round(values, 2)
+        scaled = values * 100
+        frac = scaled - np.floor(scaled)
+        near_tie = np.abs(frac - 0.5) <= 1e-9 * np.maximum(1.0, np.abs(scaled))
+        for i in np.flatnonzero(near_tie).tolist():
+            rounded[i] = round(float(values[i]), 2)
+        return rounded
+
+    def _recalc_numpy(self, np, rids):
+        idx = np.fromiter(rids, dtype=np.intp, count=len(rids))
+        qty, price, ship = (np.frombuffer(self._num[c], dtype=np.float64)[idx] for c in COST_INPUT_COLUMNS)
+        tot_v = np.frombuffer(self._num[TOTAL_COST_COL], dtype=np.float64)
+        unit_v = np.frombuffer(self._num[UNIT_COST_COL], dtype=np.float64)
+        tot_f = np.frombuffer(self._fmt[TOTAL_COST_COL], dtype=np.int8)
+        unit_f = np.frombuffer(self._fmt[UNIT_COST_COL], dtype=np.int8)
+        try:
+            bad = np.isnan(qty) | np.isnan(price) | np.isnan(ship)
+            total = qty * price + ship
+            with np.errstate(divide="ignore", invalid="ignore"):
+                unit = np.where(qty != 0, total / qty, 0.0)
+            total = self._round2_numpy(np, total)
+            unit = self._round2_numpy(np, unit)
+            was_raw = (tot_f[idx] == _NUM_RAW) | (unit_f[idx] == _NUM_RAW)
+            mask = ~bad & ((tot_f[idx] != _NUM_FIXED2) | (unit_f[idx] != _NUM_FIXED2)
+                           | (tot_v[idx] != total) | (unit_v[idx] != unit))
+            for rid in idx[mask & was_raw].tolist():
+                self._raw.pop((TOTAL_COST_COL, rid), None)
+                self._raw.pop((UNIT_COST_COL, rid), None)
+            target = idx[mask]
+            tot_v[target] = total[mask]
+            unit_v[target] = unit[mask]
+            tot_f[target] = _NUM_FIXED2
+            unit_f[target] = _NUM_FIXED2
+            return target.tolist(), idx[bad].tolist()
+        finally:
+            # views must be gone before the arrays can grow again
+            del tot_v, unit_v, tot_f, unit_f
+
+
+class SheetImport:
+    # Parses a sheet CSV on a worker thread. The UI pulls parsed rows with take() from
+    # after() callbacks, so the window keeps running while a large file loads.
+    def __init__(self, path: str, first_batch_rows=IMPORT_FIRST_BATCH_ROWS, batch_rows=IMPORT_BATCH_ROWS):
+        self.path = path
+        self.first_batch_rows = first_batch_rows
+        self.batch_rows = batch_rows
+        try:
+            self.total_bytes = os.path.getsize(path)
+        except OSError:
+            self.total_bytes = 0
+        self.bytes_read = 0
+        self.rows_read = 0
+        self.error = None
+        self.finished = False
+        # a reader may hand over the whole table at once (TableModel.load_snapshot) instead
+        # of row batches
+        self.snapshot = None
+        self._batches = queue.Queue(maxsize=IMPORT_QUEUE_BATCHES)
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sheet-import", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def done(self):
+        # a snapshot handed over after the last poll still has to be loaded
+        return self.finished and self.snapshot is None and self._batches.empty()
+
+    def take(self, max_rows):
+        rows = []
+        while len(rows) < max_rows:
+            try:
+                rows.extend(self._batches.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _put(self, batch):
+        while not self._cancel.is_set():
+            try:
+                self._batches.put(batch, timeout=0.1)
+                self.rows_read += len(batch)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            with open(self.path, "rb") as raw:
+                f = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+                batch = []
+                limit = self.first_batch_rows
+                for row in iter_sheet_csv(f):
+                    batch.append(row)
+                    if len(batch) >= limit:
+                        self.bytes_read = raw.tell()
+                        if not self._put(batch):
+                            return
+                        batch = []
+                        limit = self.batch_rows
+                if batch and not self._put(batch):
+                    return
+                self.bytes_read = self.total_bytes
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+
+
+class SessionCacheImport(SheetImport):
+    # Startup load of the session CSV: from its binary cache when that is current,
+    # otherwise by parsing the CSV as usual
+    from_cache = False
+    barcodes = None
+
+    def _run(self):
+        try:
+            snapshot = read_session_cache(self.path)
+        except Exception:
+            snapshot = None
+        if snapshot is None:
+            super()._run()
+            return
+        self.barcodes = BarcodeIndex()
+        self.barcodes.rebuild(snapshot[1][BARCODE_COL])
+        self.from_cache = True
+        self.rows_read = snapshot[0]
+        self.bytes_read = self.total_bytes
+        self.snapshot = snapshot
+        self.finished = True
+
+
+def _file_fingerprint(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def session_cache_path(csv_path: str):
+    return csv_path + SESSION_CACHE_SUFFIX
+
+
+def encode_session_snapshot(rows):
+    # Sheet rows -> (n, {col: texts}, {col: float64 bytes}, {col: format bytes},
+    # [(col, pos, raw text)]), the layout TableModel.load_snapshot takes
+    texts, nums, fmts, raw = {}, {}, {}, []
+    for col in range(len(COLUMNS)):
+        column = [r[col] if col < len(r) else "" for r in rows]
+        column = [t if t.__class__ is str else ("" if t is None else str(t)) for t in column]
+        if col not in NUMERIC_COLUMNS:
+            texts[col] = column
+            continue
+        encoded = {}
+        pairs = []
+        for text in column:
+            enc = encoded.get(text)
+            if enc is None:
+                enc = encoded[text] = _encode_number(text)
+            pairs.append(enc)
+        nums[col] = array.array("d", [p[0] for p in pairs]).tobytes()
+        fmts[col] = array.array("b", [p[1] for p in pairs]).tobytes()
+        raw.extend((col, pos, text) for pos, (text, p) in enumerate(zip(column, pairs)) if p[1] == _NUM_RAW)
+    return len(rows), texts, nums, fmts, raw
+
+
+def write_session_cache(csv_path: str, rows, fingerprint):
+    # fingerprint: _file_fingerprint(csv_path) for the CSV holding exactly these rows
+    import marshal
+    path = session_cache_path(csv_path)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(SESSION_CACHE_MAGIC)
+            # marshal's format belongs to the Python version, so the version is part of the key
+            marshal.dump((tuple(sys.version_info[:2]), list(COLUMNS), list(fingerprint)), f)
+            marshal.dump(encode_session_snapshot(rows), f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def _read_session_cache_header(f, csv_path):
+    import marshal
+    if f.read(len(SESSION_CACHE_MAGIC)) != SESSION_CACHE_MAGIC:
+        return False
+    version, columns, fingerprint = marshal.load(f)
+    fp = _file_fingerprint(csv_path)
+    return fp is not None and tuple(version) == tuple(sys.version_info[:2]) and list(columns) == COLUMNS \
+        and list(fingerprint) == fp
+
+
+def session_cache_valid(csv_path: str):
+    try:
+        with open(session_cache_path(csv_path), "rb") as f:
+            return _read_session_cache_header(f, csv_path)
+    except (OSError, EOFError, ValueError, TypeError):
+        return False
+
+
+def read_session_cache(csv_path: str):
+    # The cached snapshot of csv_path, or None when missing, stale or damaged
+    import marshal
+    try:
+        with open(session_cache_path(csv_path), "rb") as f:
+            if not _read_session_cache_header(f, csv_path):
+                return None
+            # one read + loads(): marshal.load() on a file reads object by object
+            snapshot = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    try:
+        n, texts, nums, fmts, raw = snapshot
+        ok = all(len(texts[c]) == n for c in range(len(COLUMNS)) if c not in NUMERIC_COLUMNS) \
+            and all(len(nums[c]) == 8 * n and len(fmts[c]) == n for c in NUMERIC_COLUMNS)
+    except (TypeError, ValueError, KeyError):
+        ok = False
+    return snapshot if ok else None
+
+
+def merge_rules(rules=None):
+    # MERGE_DEFAULT_RULES with valid entries of rules on top
+    merged = dict(MERGE_DEFAULT_RULES)
+    for group, choice in (rules or {}).items():
+        if choice in MERGE_RULES.get(group, ()):
+            merged[group] = choice
+    return merged
+
+
+@functools.lru_cache(maxsize=65536)
+def _merge_number(text):
+    value, fmt = _encode_number(text.strip())
+    return None if fmt == _NUM_RAW else value
+
+
+def merge_plan(rules):
+    # (col, action) for every column merge_cells() looks at; action is "sum", "overwrite"
+    # or "keep". Costs are left out: they follow quantity/price/shipping through recalc.
+    plan = []
+    for col in range(len(COLUMNS)):
+        if col in (TOTAL_COST_COL, UNIT_COST_COL):
+            continue
+        if col == QTY_COL:
+            plan.append((col, rules["qty"]))
+        elif col in (PRICE_COL, SHIP_COL):
+            plan.append((col, rules["price"]))
+        elif col == SCAN_COL:
+            plan.append((col, rules["scan"]))
+        else:
+            plan.append((col, "keep"))
+    return plan
+
+
+def merge_cells(current, incoming, plan):
+    # Merge one incoming row into current (both value lists in COLUMNS order).
+    # Returns ({col: new text}, [(col, kept text, rejected text)]).
+    changes, conflicts = {}, []
+    for col, action in plan:
+        new = incoming[col]
+        if not new:
+            continue
+        old = current[col]
+        if old == new and action != "sum":
+            continue
+        new = new.strip()
+        old_text = old.strip()
+        if not new or (old_text == new and action != "sum"):
+            continue
+        if not old_text:
+            changes[col] = new
+        elif action == "sum":
+            a, b = _merge_number(old_text), _merge_number(new)
+            if a is None or b is None:
+                conflicts.append((col, old, new))
+                continue
+            total = a + b
+            changes[col] = str(int(total)) if total.is_integer() else f"{total:.2f}"
+        elif action == "overwrite":
+            changes[col] = new
+        else:
+            conflicts.append((col, old, new))
+    return changes, conflicts
+
+
+def _merge_keys(values):
+    barcode = values[BARCODE_COL].strip()
+    month, item, sku = values[0].strip(), values[ITEM_COL].strip(), values[SKU_COL].strip()
+    return barcode, ((month, item, sku) if month and item and sku else None)
+
+
+class SheetMerge:
+    # Hash join of one or more supplier CSVs into a snapshot of the sheet (its rids and
+    # column texts), run on a worker thread: one dict lookup per incoming row against
+    # barcode and (month, item, SKU) indexes, so the cost is linear in the rows read and
+    # the extra memory is the key indexes plus the changes. Incoming rows that match
+    # nothing become new rows, and later incoming rows with the same key merge into those.
+    # The UI applies the result with apply(model) on its own thread.
+    def __init__(self, paths, rids, columns, rules=None):
+        self.paths = list(paths)
+        self.rules = merge_rules(rules)
+        self._plan = merge_plan(self.rules)
+        self._rids = rids
+        self._columns = columns
+        self.total_bytes = 0
+        for path in self.paths:
+            try:
+                self.total_bytes += os.path.getsize(path)
+            except OSError:
+                pass
+        self.bytes_read = 0
+        self.rows_read = 0
+        self.changes = {}  # rid -> {col: text}
+        self.new_rows = []
+        self.report = []  # MERGE_REPORT_COLUMNS tuples
+        self.conflict_rows = set()  # (file, line)
+        self.error = None
+        self.finished = False
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self.run, name="sheet-merge", daemon=True)
+
+    @classmethod
+    def from_model(cls, model, paths, rules=None):
+        return cls(paths, model.rids(), [model.column(c) for c in range(len(COLUMNS))], rules)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def _index(self):
+        # key -> table position; None marks a key shared by several rows (ambiguous)
+        by_code, by_item = {}, {}
+        cols = self._columns
+        for pos, (code, month, item, sku) in enumerate(zip(cols[BARCODE_COL], cols[0], cols[ITEM_COL], cols[SKU_COL])):
+            code = code.strip()
+            if code:
+                by_code[code] = None if code in by_code else pos
+            month, item, sku = month.strip(), item.strip(), sku.strip()
+            if month and item and sku:
+                key = (month, item, sku)
+                by_item[key] = None if key in by_item else pos
+        return by_code, by_item
+
+    def _current(self, pos):
+        # values of an existing row including changes merged so far
+        rid = self._rids[pos]
+        values = [col[pos] for col in self._columns]
+        for col, text in self.changes.get(rid, {}).items():
+            values[col] = text
+        return values
+
+    def run(self):
+        try:
+            by_code, by_item = self._index()
+            existing = len(self._rids)
+            for path in self.paths:
+                name = os.path.basename(path)
+                with open(path, "rb") as raw:
+                    f = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+                    base = self.bytes_read
+                    for line, values in enumerate(iter_sheet_csv(f), 1):
+                        if line % 4096 == 0:
+                            if self._cancel.is_set():
+                                return
+                            self.bytes_read = base + raw.tell()
+                        self.rows_read += 1
+                        self._merge_row(name, line, values, by_code, by_item, existing)
+                    self.bytes_read = base + raw.tell()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+
+    def _merge_row(self, name, line, values, by_code, by_item, existing):
+        code, item = _merge_keys(values)
+        key_text = code or " / ".join(item or ())
+        if code and code in by_code:
+            pos = by_code[code]
+        elif item is not None and item in by_item:
+            pos = by_item[item]
+        else:
+            pos = -1
+        if pos is None:
+            self.report.append(("ขัดแย้ง", name, line, key_text, "", "", "คีย์ตรงกับหลายแถวในตาราง", ""))
+            self.conflict_rows.add((name, line))
+            return
+        if pos < 0:
+            # new row; later rows with the same key merge into it
+            pos = existing + len(self.new_rows)
+            self.new_rows.append(values)
+            if code:
+                by_code[code] = pos
+            if item is not None:
+                by_item.setdefault(item, pos)
+            self.report.append(("เพิ่ม", name, line, key_text, pos + 1, "", "", ""))
+            return
+        if pos >= existing:
+            current = self.new_rows[pos - existing]
+        else:
+            current = self._current(pos)
+        changes, conflicts = merge_cells(current, values, self._plan)
+        for col, text in changes.items():
+            self.report.append(("แก้ไข", name, line, key_text, pos + 1, COLUMNS[col], current[col], text))
+        for col, kept, rejected in conflicts:
+            self.report.append(("ขัดแย้ง", name, line, key_text, pos + 1, COLUMNS[col], kept, rejected))
+        if conflicts:
+            self.conflict_rows.add((name, line))
+        if not changes:
+            return
+        if BARCODE_COL in changes:
+            by_code.setdefault(changes[BARCODE_COL], pos)
+        if pos >= existing:
+            for col, text in changes.items():
+                current[col] = text
+        else:
+            self.changes.setdefault(self._rids[pos], {}).update(changes)
+
+    def apply(self, model):
+        # One update_cells() and one append for the whole merge; returns (updated, added) rids
+        if self.changes:
+            model.update_cells(self.changes)
+        added = model.append_rows(self.new_rows) if self.new_rows else []
+        return list(self.changes), added
+
+    def counts(self):
+        return {"rows_read": self.rows_read, "added": len(self.new_rows), "updated": len(self.changes),
+                "conflicts": len(self.conflict_rows)}
+
+
+def write_merge_report(path: str, report):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(MERGE_REPORT_COLUMNS)
+            writer.writerows(report)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def barcode_file_name(data: str):
+    safe_name = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in data)
+    return f"{safe_name}.png"
+
+
+def barcode_cache_key(data: str, options=None):
+    # Content address of a rendered label: the barcode text plus every writer option
+    import hashlib
+    import json
+    options = BARCODE_WRITER_OPTIONS if options is None else options
+    blob = json.dumps(["code128", data, sorted(options.items())], ensure_ascii=False)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+
+def render_barcode_png(data: str, options, path: str):
+    # Process-pool worker: render one Code128 PNG to path (written atomically)
+    import barcode  # type: ignore
+    from barcode.writer import ImageWriter  # type: ignore
+    code = barcode.get("code128", data, writer=ImageWriter())
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            code.write(f, dict(options))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def prune_barcode_cache(cache_dir=BARCODE_CACHE_DIR, max_bytes=BARCODE_CACHE_MAX_BYTES,
+                        max_age_days=BARCODE_CACHE_MAX_AGE_DAYS):
+    # Remove cached PNGs (and leftover .tmp files) oldest first; returns how many went
+    try:
+        entries = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in os.scandir(cache_dir) if e.is_file()]
+    except OSError:
+        return 0
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for mtime, size, path in entries:
+        if total <= max_bytes and mtime >= cutoff:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+class BarcodeExport:
+    # Exports barcode PNGs into outdir. Labels are rendered once into a content-addressed
+    # cache (barcode_cache_key) by a process pool; a re-export only copies cached files,
+    # and files already identical in outdir are left alone. Progress counters are read
+    # by the UI while run() works on its own thread.
+    def __init__(self, codes, outdir: str, options=None, cache_dir=BARCODE_CACHE_DIR, workers=None):
+        self.codes = list(dict.fromkeys(c for c in codes if c))
+        self.outdir = outdir
+        self.options = dict(BARCODE_WRITER_OPTIONS if options is None else options)
+        self.cache_dir = cache_dir
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self.total = len(self.codes)
+        self.done_count = 0
+        self.rendered = 0
+        self.reused = 0
+        self.unchanged = 0
+        self.failures = []  # (barcode, message)
+        self.finished = False
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self.run, name="barcode-export", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def _cache_path(self, data):
+        return os.path.join(self.cache_dir, barcode_cache_key(data, self.options) + ".png")
+
+    def _deliver(self, data, cache_path):
+        import filecmp
+        import shutil
+        dest = os.path.join(self.outdir, barcode_file_name(data))
+        if os.path.exists(dest) and filecmp.cmp(cache_path, dest, shallow=True):
+            self.unchanged += 1
+            return
+        shutil.copy2(cache_path, dest)
+
+    def _fail(self, data, error):
+        self.failures.append((data, f"{type(error).__name__}: {error}"))
+
+    def run(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            os.makedirs(self.outdir, exist_ok=True)
+            to_render = []
+            for data in self.codes:
+                if self._cancel.is_set():
+                    return
+                cache_path = self._cache_path(data)
+                if not os.path.exists(cache_path):
+                    to_render.append((data, cache_path))
+                    continue
+                try:
+                    self._deliver(data, cache_path)
+                    self.reused += 1
+                except Exception as e:
+                    self._fail(data, e)
+                self.done_count += 1
+            if len(to_render) >= BARCODE_POOL_MIN_JOBS and self.workers > 1:
+                try:
+                    self._render_in_pool(to_render)
+                    return
+                except Exception:
+                    # no process pool here (sandbox, frozen without freeze_support, ...)
+                    to_render = [job for job in to_render if not os.path.exists(job[1])]
+            for data, cache_path in to_render:
+                if self._cancel.is_set():
+                    return
+                self._render_one(data, cache_path)
+        except Exception as e:
+            self._fail("", e)
+        finally:
+            self.finished = True
+
+    def _render_one(self, data, cache_path):
+        try:
+            render_barcode_png(data, self.options, cache_path)
+            self._deliver(data, cache_path)
+            self.rendered += 1
+        except Exception as e:
+            self._fail(data, e)
+        self.done_count += 1
+
+    def _render_in_pool(self, jobs):
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(render_barcode_png, data, self.options, cache_path): (data, cache_path)
+                       for data, cache_path in jobs}
+            for fut in as_completed(futures):
+                data, cache_path = futures[fut]
+                if self._cancel.is_set():
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    return
+                try:
+                    fut.result()
+                    self._deliver(data, cache_path)
+                    self.rendered += 1
+                except Exception as e:
+                    self._fail(data, e)
+                self.done_count += 1
+
+
+def _label_font(size):
+    from PIL import ImageFont  # type: ignore
+    for name in LABEL_FONTS:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        return ImageFont.load_default()  # Pillow < 10.1: fixed-size bitmap font only
+
+
+def _fit_text(draw, text, font, width):
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + "…", font=font) > width:
+        text = text[:-1]
+    return text + "…"
+
+
+class LabelSheet:
+    # Renders (barcode, sku, name) labels straight into page images, N-up per the
+    # template, and saves them as one multi-page PDF (or TIFF by extension). Nothing is
+    # written per label. Progress counters are read by the UI while run() works on its
+    # own thread.
+    def __init__(self, labels, path: str, template=LABEL_DEFAULT_TEMPLATE, dpi=LABEL_DPI, options=None):
+        self.labels = [lab for lab in labels if lab[0]]
+        self.path = path
+        self.template = LABEL_TEMPLATES[template]
+        self.dpi = dpi
+        self.options = dict(BARCODE_WRITER_OPTIONS if options is None else options)
+        self.options.setdefault("dpi", dpi)
+        self.total = len(self.labels)
+        self.done_count = 0
+        self.pages = 0
+        self.failures = []  # (barcode, message)
+        self.error = None
+        self.finished = False
+        self._thread = threading.Thread(target=self.run, name="label-sheet", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _px(self, mm):
+        return int(round(mm * self.dpi / 25.4))
+
+    def _draw_label(self, page, draw, font, box, label):
+        import barcode  # type: ignore
+        from barcode.writer import ImageWriter  # type: ignore
+        from PIL import Image  # type: ignore
+        data, sku, name = label
+        x0, y0, w, h = box
+        pad = self._px(1.5)
+        line_h = self._px(LABEL_TEXT_MM + 0.5)
+        text_w = w - 2 * pad
+        y = y0 + pad
+        for text in (name, sku):
+            if text:
+                draw.text((x0 + pad, y), _fit_text(draw, text, font, text_w), fill=0, font=font)
+                y += line_h
+        img = barcode.get("code128", data, writer=ImageWriter()).render(self.options).convert("L")
+        avail_w, avail_h = text_w, y0 + h - pad - y
+        scale = min(avail_w / img.width, avail_h / img.height, 1.0)
+        if scale < 1.0:
+            img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.LANCZOS)
+        page.paste(img, (x0 + (w - img.width) // 2, y + (avail_h - img.height) // 2))
+
+    def _render_pages(self):
+        from PIL import Image, ImageDraw  # type: ignore
+        t = self.template
+        cols, rows = t["grid"]
+        per_page = cols * rows
+        page_size = (self._px(t["page"][0]), self._px(t["page"][1]))
+        label_w, label_h = self._px(t["label"][0]), self._px(t["label"][1])
+        font = _label_font(self._px(LABEL_TEXT_MM))
+        pages = []
+        for first in range(0, self.total, per_page):
+            page = Image.new("L", page_size, 255)
+            draw = ImageDraw.Draw(page)
+            for i, label in enumerate(self.labels[first:first + per_page]):
+                col, row = i % cols, i // cols
+                x0 = self._px(t["origin"][0] + col * (t["label"][0] + t["gap"][0]))
+                y0 = self._px(t["origin"][1] + row * (t["label"][1] + t["gap"][1]))
+                try:
+                    self._draw_label(page, draw, font, (x0, y0, label_w, label_h), label)
+                except Exception as e:
+                    self.failures.append((label[0], f"{type(e).__name__}: {e}"))
+                self.done_count += 1
+            # 1-bit pages: a few hundred KB each at 300 dpi instead of ~9 MB greyscale
+            pages.append(page.point(lambda v: 255 if v >= 128 else 0).convert("1", dither=Image.Dither.NONE))
+        return pages
+
+    def run(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            pages = self._render_pages()
+            if not pages:
+                return
+            self.pages = len(pages)
+            first, rest = pages[0], pages[1:]
+            if self.path.lower().endswith((".tif", ".tiff")):
+                try:
+                    first.save(tmp_path, "TIFF", save_all=True, append_images=rest,
+                               dpi=(self.dpi, self.dpi), compression="group4")
+                except (OSError, ValueError):
+                    # Pillow without libtiff
+                    first.save(tmp_path, "TIFF", save_all=True, append_images=rest, dpi=(self.dpi, self.dpi))
+            else:
+                first.save(tmp_path, "PDF", save_all=True, append_images=rest, resolution=self.dpi)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            self.error = e
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self.finished = True
+
+
+def new_label_sheet_path(keep=LABEL_SHEETS_KEEP):
+    # labels-<time>.pdf in LABEL_SHEETS_DIR, after removing all but the newest keep-1 sheets
+    os.makedirs(LABEL_SHEETS_DIR, exist_ok=True)
+    old = sorted(n for n in os.listdir(LABEL_SHEETS_DIR) if n.startswith("labels-") and n.endswith(".pdf"))
+    for name in old[:max(0, len(old) - keep + 1)]:
+        try:
+            os.remove(os.path.join(LABEL_SHEETS_DIR, name))
+        except OSError:
+            pass
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    return os.path.join(LABEL_SHEETS_DIR, f"labels-{stamp}.pdf")
+
+
+def print_document(path: str):
+    # Send one file to the default printer as a single job
+    if os.name == "nt":
+        os.startfile(path, "print")  # type: ignore
+        return
+    import shutil
+    import subprocess
+    for cmd in ("lp", "lpr"):
+        exe = shutil.which(cmd)
+        if exe:
+            subprocess.run([exe, path], check=True, capture_output=True, timeout=60)
+            return
+    raise OSError("ไม่พบคำสั่งพิมพ์ (lp/lpr)")
+
+
+class OpMetrics:
+    # One JSON line per timed operation in metrics.jsonl ({"t", "op", "ms", "rows",
+    # "bytes", "error", ...}), rotated to metrics.jsonl.1 .. .N. Safe to call from worker
+    # threads; a metrics file that cannot be written never breaks the operation.
+    def __init__(self, path: str, max_bytes=METRICS_MAX_BYTES, backups=METRICS_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+
+    def _rotate(self):
+        for n in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{n}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{n + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def record(self, op, seconds, **fields):
+        import json
+        rec = {"t": datetime.datetime.now().isoformat(timespec="milliseconds"), "op": op,
+               "ms": round(seconds * 1000, 3)}
+        rec.update((k, v) for k, v in fields.items() if v is not None)
+        line = json.dumps(rec, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            try:
+                if self.backups and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                    self._rotate()
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError:
+                pass
+        return rec
+
+    @contextlib.contextmanager
+    def measure(self, op, **fields):
+        # with metrics.measure("save", rows=n) as m: ...; m["bytes"] = size
+        start = time.perf_counter()
+        try:
+            yield fields
+        except Exception as e:
+            fields["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.record(op, time.perf_counter() - start, **fields)
+
+
+class BackgroundWriter:
+    # Runs write(payload) on a worker thread. A payload submitted while an earlier one is
+    # still waiting replaces it, so a burst of requests turns into a single write of the
+    # newest data.
+    def __init__(self, write, name="autosave-writer"):
+        self._write = write
+        self._name = name
+        self._cond = threading.Condition()
+        self._pending = None
+        self._has_pending = False
+        self._busy = False
+        self._thread = None
+        self.writes = 0
+        self.last_error = None
+
+    def submit(self, payload):
+        with self._cond:
+            self._pending = payload
+            self._has_pending = True
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def busy(self):
+        with self._cond:
+            return self._busy or self._has_pending
+
+    def flush(self, timeout=None):
+        # Block until everything submitted so far is on disk
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._busy or self._has_pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._has_pending:
+                    self._cond.wait(5.0)
+                    if not self._has_pending:
+                        self._thread = None
+                        return
+                payload = self._pending
+                self._pending = None
+                self._has_pending = False
+                self._busy = True
+            try:
+                self._write(payload)
+                self.writes += 1
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+
+class SessionJournal:
+    # Append-only change log on top of the last_session.csv snapshot.
+    #
+    # Every record carries an increasing sequence number. The journal is split into
+    # segments (<snapshot>.journal.<first seq>); compaction starts a new segment, writes
+    # the snapshot in a worker thread and then drops the segments it covers. The
+    # <snapshot>.meta file remembers which sequence number (and which file size/mtime)
+    # the snapshot contains, so replay after a crash at any point applies each record
+    # exactly once.
+    #
+    # Records (positions are row indexes at the time of the change):
+    #   {"op": "set", "i": pos, "v": {col: text}}
+    #   {"op": "ins", "i": pos, "rows": [[...], ...]}
+    #   {"op": "del", "i": [pos, ...]}            (descending)
+    def __init__(self, snapshot_path: str, max_bytes=JOURNAL_MAX_BYTES, max_age=JOURNAL_MAX_AGE):
+        self.snapshot_path = snapshot_path
+        self.meta_path = snapshot_path + ".meta"
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.seq = 0
+        self._fh = None
+        self._segment_bytes = 0
+        self._segment_started = time.monotonic()
+        self._compactor = BackgroundWriter(lambda job: self._write_snapshot(*job), name="journal-compactor")
+
+    # ----- files -----
+    def _segments(self):
+        folder = os.path.dirname(self.snapshot_path) or "."
+        prefix = os.path.basename(self.snapshot_path) + ".journal."
+        found = []
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            return []
+        for name in names:
+            tail = name[len(prefix):]
+            if name.startswith(prefix) and tail.isdigit():
+                found.append((int(tail), os.path.join(folder, name)))
+        return [path for _, path in sorted(found)]
+
+    @staticmethod
+    def _fingerprint(path):
+        return _file_fingerprint(path)
+
+    def _read_meta(self):
+        try:
+            import json
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                return json.load(f) or {}
+        except Exception:
+            return {}
+
+    def _write_meta(self, meta):
+        import json
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.meta_path)
+
+    def _snapshot_seq(self):
+        # Which sequence number the snapshot on disk already contains (None = unknown file)
+        meta = self._read_meta()
+        fp = self._fingerprint(self.snapshot_path)
+        if fp is not None and fp == meta.get("fp"):
+            return meta.get("seq", 0)
+        if fp is not None and fp == meta.get("prev_fp"):
+            return meta.get("prev_seq", 0)
+        return None
+
+    def has_baseline(self):
+        return self._snapshot_seq() is not None
+
+    # ----- replay -----
+    def unapplied_records(self):
+        # Records newer than the snapshot, in order. Also moves seq past everything on
+        # disk so new records never reuse a number.
+        import json
+        base = self._snapshot_seq()
+        records = []
+        last_seq = self._read_meta().get("seq", 0)
+        for path in self._segments():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            rec = json.loads(line)
+                        except ValueError:
+                            break  # torn tail from a crash mid-append
+                        seq = rec.get("s", 0)
+                        last_seq = max(last_seq, seq)
+                        if base is not None and seq > base:
+                            records.append(rec)
+            except OSError:
+                continue
+        self.seq = last_seq
+        return records
+
+    def replay(self, rows):
+        # Apply unapplied records to rows (list of value lists); returns how many
+        records = self.unapplied_records()
+        for rec in records:
+            self.apply(rows, rec)
+        return len(records)
+
+    @staticmethod
+    def apply(rows, rec):
+        op = rec.get("op")
+        if op == "set":
+            pos = rec["i"]
+            if 0 <= pos < len(rows):
+                row = rows[pos]
+                for col, text in rec["v"].items():
+                    row[int(col)] = text
+        elif op == "ins":
+            pos = min(max(rec["i"], 0), len(rows))
+            rows[pos:pos] = [list(r) for r in rec["rows"]]
+        elif op == "del":
+            for pos in rec["i"]:
+                if 0 <= pos < len(rows):
+                    del rows[pos]
+
+    # ----- append -----
+    def append(self, records):
+        # returns the bytes added to the journal
+        if not records:
+            return 0
+        import json
+        if self._fh is None:
+            path = f"{self.snapshot_path}.journal.{self.seq + 1:010d}"
+            self._fh = open(path, "a", encoding="utf-8")
+            self._segment_bytes = 0
+            self._segment_started = time.monotonic()
+        lines = []
+        for rec in records:
+            self.seq += 1
+            rec["s"] = self.seq
+            lines.append(json.dumps(rec, ensure_ascii=False, separators=(",", ":")))
+        data = "\n".join(lines) + "\n"
+        self._fh.write(data)
+        self._fh.flush()
+        size = len(data.encode("utf-8"))
+        self._segment_bytes += size
+        return size
+
+    def needs_compaction(self):
+        if self._fh is None:
+            return False
+        if self._segment_bytes >= self.max_bytes:
+            return True
+        return time.monotonic() - self._segment_started >= self.max_age
+
+    def compacting(self):
+        return self._compactor.busy()
+
+    def flush(self):
+        # records are on disk as soon as append() returns; this waits for the snapshot
+        self._compactor.flush()
+
+    # ----- compaction -----
+    def compact(self, rows, wait=False):
+        # rows must reflect every record appended so far; they are written in the background
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        self._compactor.submit((rows, self.seq, self._segments()))
+        if wait:
+            self._compactor.flush()
+        return True
+
+    def _write_snapshot(self, rows, seq, covered):
+        tmp_path = self.snapshot_path + ".compact.tmp"
+        try:
+            meta = self._read_meta()
+            prev_fp = self._fingerprint(self.snapshot_path)
+            prev_seq = meta.get("seq", 0) if prev_fp == meta.get("fp") else meta.get("prev_seq", 0)
+            write_sheet_csv(tmp_path, rows)
+            # rename keeps size/mtime, so the fingerprint is known before the swap
+            fp = self._fingerprint(tmp_path)
+            self._write_meta({"seq": seq, "fp": fp, "prev_seq": prev_seq, "prev_fp": prev_fp})
+            os.replace(tmp_path, self.snapshot_path)
+            try:
+                write_session_cache(self.snapshot_path, rows, fp)
+            except Exception:
+                pass  # only a startup speed-up; the CSV is what counts
+            for path in covered:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        finally:
+            if os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def close(self):
+        self._compactor.flush()
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+class SessionStore:
+    # last_session.sqlite3 for autosave_mode "sqlite": one table row per sheet row, kept in
+    # display order by `ord`. Takes the same records as SessionJournal.append, but writes
+    # each one straight into the table (a single UPDATE by primary key for an edit or a
+    # scan), so there is nothing to replay or compact later.
+    #
+    # compact() (whole table replaced) rewrites the table on a BackgroundWriter thread over
+    # its own connection. Records appended meanwhile are held in _backlog and written by
+    # that thread right after the rewrite of the newest table commits.
+    def __init__(self, path: str):
+        import sqlite3
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        fields = ", ".join(f"{name} TEXT NOT NULL DEFAULT ''" for name in SESSION_DB_FIELDS)
+        with self._db:
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS rows (id INTEGER PRIMARY KEY, ord REAL NOT NULL, {fields})")
+            self._db.execute("CREATE INDEX IF NOT EXISTS rows_ord ON rows (ord)")
+            for name in ("barcode", "sku", "month"):
+                self._db.execute(f"CREATE INDEX IF NOT EXISTS rows_{name} ON rows ({name})")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._ids = None  # display position -> row id, read on the first write
+        self._ords = None
+        self._next_id = 1
+        self._lock = threading.Lock()  # _ids/_ords/_backlog, shared with the compactor
+        self._backlog = []
+        self._generation = 0  # bumped by compact(); only the newest rewrite drains _backlog
+        self._rewriting = False
+        self._compactor = BackgroundWriter(self._write_rows, name="session-store-compactor")
+
+    def _load_order(self):
+        if self._ids is None:
+            pairs = self._db.execute("SELECT id, ord FROM rows ORDER BY ord").fetchall()
+            self._ids = [p[0] for p in pairs]
+            self._ords = [p[1] for p in pairs]
+            self._next_id = max(self._ids, default=0) + 1
+
+    def has_baseline(self):
+        return self._db.execute("SELECT 1 FROM meta WHERE key = 'baseline'").fetchone() is not None
+
+    def unapplied_records(self):
+        return []  # every append is committed
+
+    def needs_compaction(self):
+        return False
+
+    def compacting(self):
+        return self._compactor.busy()
+
+    # ----- row writes -----
+    def _ords_between(self, db, pos, count):
+        # `count` ord values that sort between the rows at pos - 1 and pos
+        lo = self._ords[pos - 1] if pos > 0 else None
+        hi = self._ords[pos] if pos < len(self._ords) else None
+        if lo is None and hi is None:
+            return [float(n) for n in range(1, count + 1)]
+        if hi is None:
+            return [lo + n for n in range(1, count + 1)]
+        if lo is None:
+            return [hi - count + n for n in range(count)]
+        step = (hi - lo) / (count + 1)
+        if step <= 1e-9 * max(1.0, abs(hi)):
+            self._renumber(db)
+            return self._ords_between(db, pos, count)
+        return [lo + step * n for n in range(1, count + 1)]
+
+    def _renumber(self, db):
+        self._ords = [float(n) for n in range(1, len(self._ids) + 1)]
+        db.executemany("UPDATE rows SET ord = ? WHERE id = ?", zip(self._ords, self._ids))
+
+    def append(self, records):
+        # returns the bytes of cell text written (the database's own overhead left out);
+        # 0 while a compaction is running and the records wait in _backlog
+        if not records:
+            return 0
+        with self._lock:
+            if self._rewriting:
+                self._backlog.extend(records)
+                return 0
+            return self._apply(self._db, records)
+
+    def _apply(self, db, records):
+        # caller holds _lock
+        self._load_order()
+        written = 0
+        placeholders = ", ".join("?" * (len(SESSION_DB_FIELDS) + 2))
+        insert = f"INSERT INTO rows (id, ord, {', '.join(SESSION_DB_FIELDS)}) VALUES ({placeholders})"
+        with db:
+            for rec in records:
+                op = rec.get("op")
+                if op == "set":
+                    pos = rec["i"]
+                    if not 0 <= pos < len(self._ids):
+                        continue
+                    cells = [(SESSION_DB_FIELDS[int(c)], text) for c, text in rec["v"].items()]
+                    sql = "UPDATE rows SET " + ", ".join(f"{name} = ?" for name, _ in cells) + " WHERE id = ?"
+                    db.execute(sql, [text for _, text in cells] + [self._ids[pos]])
+                    written += sum(len(text.encode("utf-8")) for _, text in cells)
+                elif op == "ins":
+                    pos = min(max(rec["i"], 0), len(self._ids))
+                    rows = rec["rows"]
+                    ids = list(range(self._next_id, self._next_id + len(rows)))
+                    ords = self._ords_between(db, pos, len(rows))
+                    self._next_id += len(rows)
+                    db.executemany(insert, ([i, o] + list(r) for i, o, r in zip(ids, ords, rows)))
+                    written += sum(len(text.encode("utf-8")) for r in rows for text in r)
+                    self._ids[pos:pos] = ids
+                    self._ords[pos:pos] = ords
+                elif op == "del":
+                    gone = []
+                    for pos in rec["i"]:  # descending
+                        if 0 <= pos < len(self._ids):
+                            gone.append((self._ids.pop(pos),))
+                            del self._ords[pos]
+                    db.executemany("DELETE FROM rows WHERE id = ?", gone)
+        return written
+
+    def compact(self, rows, wait=False):
+        # Whole table replaced (load, new session): rewritten in one transaction in the
+        # background. rows reflect every record so far, so the backlog starts over.
+        with self._lock:
+            self._generation += 1
+            self._rewriting = True
+            self._backlog = []
+            self._ids = list(range(1, len(rows) + 1))
+            self._ords = [float(n) for n in self._ids]
+            self._next_id = len(rows) + 1
+            self._compactor.submit((rows, self._generation))
+        if wait:
+            self._compactor.flush()
+        return True
+
+    def _write_rows(self, job):
+        # compactor thread
+        import sqlite3
+        rows, generation = job
+        placeholders = ", ".join("?" * (len(SESSION_DB_FIELDS) + 2))
+        insert = f"INSERT INTO rows (id, ord, {', '.join(SESSION_DB_FIELDS)}) VALUES ({placeholders})"
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                db.execute("DELETE FROM rows")
+                db.executemany(insert, ([n, float(n)] + list(r) for n, r in enumerate(rows, start=1)))
+                db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('baseline', ?)",
+                           (datetime.datetime.now().isoformat(timespec="seconds"),))
+            with self._lock:
+                if generation == self._generation:
+                    backlog, self._backlog = self._backlog, []
+                    self._rewriting = False
+                    self._apply(db, backlog)
+        except Exception:
+            with self._lock:
+                if generation == self._generation:
+                    # the table on disk is the old one: forget the new order, drop the backlog
+                    self._ids = None
+                    self._backlog = []
+                    self._rewriting = False
+            raise
+        finally:
+            db.close()
+
+    def flush(self):
+        # Block until a running rewrite and the records held back meanwhile are committed
+        self._compactor.flush()
+
+    def close(self):
+        self._compactor.flush()
+        try:
+            self._db.close()
+        except Exception:
+            pass
+
+
+class SessionStoreImport(SheetImport):
+    # Pages the rows of a SessionStore database into the table on the worker thread,
+    # with the same take()/progress interface as a CSV import
+    def _run(self):
+        try:
+            import sqlite3
+            db = sqlite3.connect(self.path)
+            try:
+                total = db.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+                cur = db.execute(f"SELECT {', '.join(SESSION_DB_FIELDS)} FROM rows ORDER BY ord")
+                limit = self.first_batch_rows
+                while True:
+                    batch = [list(r) for r in cur.fetchmany(limit)]
+                    if not batch:
+                        break
+                    if not self._put(batch):
+                        return
+                    self.bytes_read = self.total_bytes * self.rows_read // max(total, 1)
+                    limit = self.batch_rows
+            finally:
+                db.close()
+            self.bytes_read = self.total_bytes
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+
+
+class MonthArchive:
+    # Closed รอบเดือน live outside the session in archive/:
+    #   <YYYY-MM>.csv.gz   read-only shard of the month's rows (sheet CSV, gzip)
+    #   months.json        precomputed summary per closed month
+    #   barcodes.sqlite3   barcode -> month/Scan index, so scans can still reach them
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._db = None
+
+    def _shard_path(self, month):
+        return os.path.join(self.directory, f"{month}.csv.gz")
+
+    def _index(self):
+        if self._db is None:
+            import sqlite3
+            os.makedirs(self.directory, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(self.directory, "barcodes.sqlite3"))
+            self._db.execute("PRAGMA journal_mode=WAL")
+            with self._db:
+                self._db.execute("CREATE TABLE IF NOT EXISTS codes (barcode TEXT NOT NULL, month TEXT NOT NULL, scan TEXT NOT NULL)")
+                self._db.execute("CREATE INDEX IF NOT EXISTS codes_barcode ON codes (barcode)")
+                self._db.execute("CREATE INDEX IF NOT EXISTS codes_month ON codes (month)")
+        return self._db
+
+    def summaries(self):
+        import json
+        try:
+            with open(os.path.join(self.directory, "months.json"), "r", encoding="utf-8") as f:
+                return json.load(f) or {}
+        except (OSError, ValueError):
+            return {}
+
+    def _write_summaries(self, summaries):
+        import json
+        path = os.path.join(self.directory, "months.json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(summaries, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def months(self):
+        return sorted(self.summaries())
+
+    @staticmethod
+    def summarize(rows):
+        qty = total = 0.0
+        scanned = 0
+        for values in rows:
+            n, _ = _encode_number(values[QTY_COL])
+            if n == n:
+                qty += n
+            n, _ = _encode_number(values[TOTAL_COST_COL])
+            if n == n:
+                total += n
+            if values[SCAN_COL].strip():
+                scanned += 1
+        return {"rows": len(rows), "scanned": scanned, "qty": qty, "total_cost": round(total, 2)}
+
+    def read_month(self, month):
+        import gzip
+        with gzip.open(self._shard_path(month), "rt", encoding="utf-8", newline="") as f:
+            return list(iter_sheet_csv(f))
+
+    def close_months(self, rows):
+        # Move rows (value lists with a รอบเดือน) into their month shards; a month that is
+        # already closed gets the new rows added after its existing ones
+        import gzip
+        by_month = {}
+        for values in rows:
+            by_month.setdefault(values[0], []).append(values)
+        os.makedirs(self.directory, exist_ok=True)
+        summaries = self.summaries()
+        db = self._index()
+        for month, new_rows in sorted(by_month.items()):
+            path = self._shard_path(month)
+            month_rows = (self.read_month(month) if os.path.exists(path) else []) + new_rows
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with gzip.open(tmp_path, "wt", compresslevel=6, encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(COLUMNS)
+                writer.writerows(month_rows)
+            os.replace(tmp_path, path)
+            with db:
+                db.execute("DELETE FROM codes WHERE month = ?", (month,))
+                db.executemany("INSERT INTO codes (barcode, month, scan) VALUES (?, ?, ?)",
+                               ((v[BARCODE_COL].strip(), month, v[SCAN_COL]) for v in month_rows
+                                if v[BARCODE_COL].strip()))
+            summary = self.summarize(month_rows)
+            summary["closed_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            summaries[month] = summary
+            self._write_summaries(summaries)
+        return sorted(by_month)
+
+    def drop_month(self, month):
+        # Take a month out of the archive. Reopening reads it with read_month() and calls
+        # this only once the rows are saved in the session, so a failure in between
+        # leaves the month in both places rather than in neither.
+        summaries = self.summaries()
+        summaries.pop(month, None)
+        self._write_summaries(summaries)
+        with self._index() as db:
+            db.execute("DELETE FROM codes WHERE month = ?", (month,))
+        try:
+            os.remove(self._shard_path(month))
+        except OSError:
+            pass
+
+    def _has_index(self):
+        return self._db is not None or os.path.exists(os.path.join(self.directory, "barcodes.sqlite3"))
+
+    def lookup(self, code):
+        # [(month, scan), ...] for a barcode in a closed month; [] without touching the
+        # disk when nothing was ever archived
+        if not self._has_index():
+            return []
+        cur = self._index().execute("SELECT month, scan FROM codes WHERE barcode = ? ORDER BY month",
+                                    (str(code).strip(),))
+        return cur.fetchall()
+
+    def codes(self):
+        # every barcode in a closed month
+        if not self._has_index():
+            return set()
+        return {code for (code,) in self._index().execute("SELECT DISTINCT barcode FROM codes")}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class SearchIndex:
+    # Substring search over the SEARCH_COLUMNS of a TableModel. Each column is kept as
+    # its texts in table order, joined and casefolded into one string, so a query is a
+    # run of str.find calls in C (one per matching row) instead of a Python loop over
+    # every row. Edits patch single cells and re-join only the changed columns; inserts,
+    # deletes and loads rebuild it on the next search.
+    def __init__(self, model, columns=SEARCH_COLUMNS, short_query=2):
+        self.model = model
+        self.columns = tuple(columns)
+        self.short_query = short_query
+        self._rids = None  # table order at build time; None = rebuild on the next search
+        self._texts = []
+        self._blobs = []
+        self._starts = []
+        self._items = []
+        model.subscribe(self._on_model_change)
+
+    def _build(self):
+        self._rids = self.model.rids()
+        self._texts = [self.model.column(col) for col in self.columns]
+        self._blobs = [None] * len(self.columns)
+        self._starts = [None] * len(self.columns)
+        self._items = [None] * len(self.columns)
+
+    def _join(self, i):
+        texts = self._texts[i]
+        raw = "\x00".join(texts)
+        blob = raw.casefold()
+        if len(blob) != len(raw):
+            # a few characters (ß, ligatures) grow when casefolded: fold row by row
+            texts = [t.casefold() for t in texts]
+            blob = "\x00".join(texts)
+        self._blobs[i] = blob
+        self._items[i] = None
+        # offset of every row's text in the joined string (+1 per separator)
+        self._starts[i] = array.array("q", map(operator.add, itertools.accumulate(map(len, texts), initial=0),
+                                               range(len(texts) + 1)))
+
+    def _on_model_change(self, kind, rids, info):
+        if self._rids is None:
+            return
+        if kind in ("reset", "insert", "delete"):
+            self._rids = None
+            self._texts = self._blobs = self._starts = self._items = []
+        elif kind == "update":
+            for i, col in enumerate(self.columns):
+                if col in info:
+                    texts = self._texts[i]
+                    for rid in rids:
+                        texts[self.model.position(rid)] = self.model.get(rid, col)
+                    self._blobs[i] = None
+
+    def matches(self, query):
+        # rids with a searched cell containing query (case-insensitive), in no order
+        import bisect
+        q = query.strip().casefold()
+        if not q or "\x00" in q:
+            return set()
+        if self._rids is None:
+            self._build()
+        rids = self._rids
+        found = set()
+        for i in range(len(self.columns)):
+            if self._blobs[i] is None:
+                self._join(i)
+            blob, starts = self._blobs[i], self._starts[i]
+            if len(q) <= self.short_query:
+                # one or two characters match most rows: test every row instead
+                if self._items[i] is None:
+                    self._items[i] = blob.split("\x00")
+                found.update(itertools.compress(rids, [q in t for t in self._items[i]]))
+                continue
+            pos = blob.find(q)
+            while pos != -1:
+                row = bisect.bisect_right(starts, pos) - 1
+                found.add(rids[row])
+                pos = blob.find(q, starts[row + 1])
+        return found
+
+
+class CostSummary:
+    # Totals per (รอบเดือน, ชื่อSKU): rows, quantity, total cost, scanned rows. Every row's
+    # contribution is cached, so an edit, scan, paste or delete subtracts the old one and
+    # adds the new one instead of going over the table again. Costs are summed in satang
+    # (integers) so adding and removing never drifts. Built on first use.
+    FIELDS = (COL["รอบเดือน"], COL["ชื่อSKU"], QTY_COL, TOTAL_COST_COL, SCAN_COL)
+
+    def __init__(self, model):
+        self.model = model
+        self._built = False
+        self._rows = {}  # rid -> (month, sku, qty, cost_satang, scanned)
+        self._groups = {}  # (month, sku) -> [rows, qty, cost_satang, scanned]
+        self.version = 0  # bumped on every change, for views that poll
+        model.subscribe(self._on_model_change)
+
+    def _contribution(self, rid):
+        qty = self.model.number(rid, QTY_COL)
+        cost = self.model.number(rid, TOTAL_COST_COL)
+        return (self.model.get(rid, COL["รอบเดือน"]).strip(), self.model.get(rid, COL["ชื่อSKU"]).strip(),
+                qty if qty is not None and qty == qty else 0.0,
+                round(cost * 100) if cost is not None and cost == cost else 0,
+                1 if self.model.get(rid, SCAN_COL).strip() else 0)
+
+    def _add(self, rid):
+        c = self._rows[rid] = self._contribution(rid)
+        group = self._groups.get((c[0], c[1]))
+        if group is None:
+            group = self._groups[(c[0], c[1])] = [0, 0.0, 0, 0]
+        group[0] += 1
+        group[1] += c[2]
+        group[2] += c[3]
+        group[3] += c[4]
+
+    def _remove(self, rid):
+        c = self._rows.pop(rid, None)
+        if c is None:
+            return
+        group = self._groups[(c[0], c[1])]
+        group[0] -= 1
+        group[1] -= c[2]
+        group[2] -= c[3]
+        group[3] -= c[4]
+        if not group[0]:
+            del self._groups[(c[0], c[1])]
+
+    def _build(self):
+        self._rows.clear()
+        self._groups.clear()
+        for rid in self.model.rids():
+            self._add(rid)
+        self._built = True
+
+    def _on_model_change(self, kind, rids, info):
+        if not self._built:
+            return
+        self.version += 1
+        if kind == "reset":
+            self._built = False
+            self._rows.clear()
+            self._groups.clear()
+        elif kind == "insert":
+            for rid in rids:
+                self._add(rid)
+        elif kind == "delete":
+            for rid in rids:
+                self._remove(rid)
+        elif kind == "update" and not info.isdisjoint(self.FIELDS):
+            for rid in rids:
+                self._remove(rid)
+                self._add(rid)
+
+    def report(self):
+        # [(month, sku, rows, qty, total_cost, avg_unit_cost, scanned, unscanned)], newest
+        # month first; each month starts with its total line (sku None)
+        if not self._built:
+            self._build()
+        months = {}
+        for (month, sku), (rows, qty, cost, scanned) in self._groups.items():
+            months.setdefault(month, []).append((sku, rows, qty, cost, scanned))
+        out = []
+        for month in sorted(months, reverse=True):
+            skus = sorted(months[month])
+            total = [sum(g[i] for g in skus) for i in range(1, 5)]
+            for sku, rows, qty, cost, scanned in [(None, *total)] + skus:
+                out.append((month, sku, rows, qty, cost / 100, cost / 100 / qty if qty else 0.0,
+                            scanned, rows - scanned))
+        return out
+
+
+class ScanAssembler:
+    # Splits the scan box keystrokes into codes by timing (event.time, in ms), so two
+    # codes scanned back to back are never merged and a slow UI tick does not split one.
+    def __init__(self, max_gap_ms=SCAN_MAX_GAP_MS, min_length=SCAN_MIN_LENGTH):
+        self.max_gap_ms = max_gap_ms
+        self.min_length = min_length
+        self.reset()
+
+    def reset(self):
+        self.buffer = []
+        self.last_ms = None
+        self.burst = True  # every gap so far was scanner-fast
+
+    def _complete(self):
+        return self.burst and len(self.buffer) >= self.min_length
+
+    def _take(self):
+        code = "".join(self.buffer).strip()
+        self.reset()
+        return code
+
+    def feed(self, char, t_ms):
+        # Returns the previous code when this character starts a new one
+        done = None
+        if self.buffer and t_ms - self.last_ms > self.max_gap_ms:
+            if self._complete():
+                done = self._take()
+            else:
+                self.burst = False  # typed by hand: wait for Enter
+        self.buffer.append(char)
+        self.last_ms = t_ms
+        return done
+
+    def edit(self):
+        # backspace/paste/...: the scan box text no longer matches the burst
+        self.burst = False
+
+    def terminate(self, text):
+        # Enter/Tab: the code is whatever the scan box shows
+        self.reset()
+        return text.strip()
+
+    def flush(self):
+        # No key for a while: a finished scanner burst is a code
+        return self._take() if self._complete() else None
+
+
+class ScanEventLog:
+    # Append-only log of scan events (ts in epoch ms, kind, station, barcode). Kinds are
+    # stored as their SCAN_EVENT_KINDS index. One executemany per scan batch in WAL mode
+    # without an fsync per commit keeps appends cheap. The ts index answers time ranges
+    # and the (barcode, ts) index answers one code's history, without reading the rest.
+    def __init__(self, path: str):
+        self.path = path
+        self._db = None
+        self._codes = {kind: i for i, kind in enumerate(SCAN_EVENT_KINDS)}
+
+    def _conn(self):
+        if self._db is None:
+            import sqlite3
+            self._db = sqlite3.connect(self.path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            with self._db:
+                self._db.execute("CREATE TABLE IF NOT EXISTS events (ts INTEGER NOT NULL, kind INTEGER NOT NULL, "
+                                 "station TEXT NOT NULL, barcode TEXT NOT NULL)")
+                self._db.execute("CREATE INDEX IF NOT EXISTS events_ts ON events (ts)")
+                self._db.execute("CREATE INDEX IF NOT EXISTS events_barcode ON events (barcode, ts)")
+        return self._db
+
+    def append(self, events):
+        # events: (ts ms, kind, station or None, barcode)
+        codes = self._codes
+        rows = [(int(ts), codes[kind], station or "", code) for ts, kind, station, code in events]
+        if not rows:
+            return
+        db = self._conn()
+        with db:
+            db.executemany("INSERT INTO events VALUES (?, ?, ?, ?)", rows)
+
+    def _where(self, start_ms, end_ms, kinds=None, barcode=None):
+        sql, params = " WHERE ts >= ? AND ts < ?", [int(start_ms), int(end_ms)]
+        if barcode:
+            sql += " AND barcode = ?"
+            params.append(barcode)
+        if kinds:
+            sql += f" AND kind IN ({', '.join('?' * len(kinds))})"
+            params.extend(self._codes[k] for k in kinds)
+        return sql, params
+
+    def range(self, start_ms, end_ms, kinds=None, barcode=None, limit=None):
+        # [(ts ms, kind, station, barcode)] with start_ms <= ts < end_ms, oldest first
+        where, params = self._where(start_ms, end_ms, kinds, barcode)
+        sql = "SELECT ts, kind, station, barcode FROM events" + where + " ORDER BY ts"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        return [(ts, SCAN_EVENT_KINDS[kind], station, code)
+                for ts, kind, station, code in self._conn().execute(sql, params)]
+
+    def counts(self, start_ms, end_ms, barcode=None):
+        # {kind: events} in the range
+        where, params = self._where(start_ms, end_ms, barcode=barcode)
+        cur = self._conn().execute("SELECT kind, COUNT(*) FROM events" + where + " GROUP BY kind", params)
+        return {SCAN_EVENT_KINDS[kind]: n for kind, n in cur}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def _parse_event_time(text, end=False):
+    # "YYYY-MM-DD HH:MM[:SS]", "YYYY-MM-DD" or "HH:MM" (today) -> epoch ms; an end time
+    # without seconds covers its whole minute (whole day for a bare date). None if unreadable.
+    text = text.strip()
+    today = datetime.date.today().isoformat()
+    for fmt, step in (("%Y-%m-%d %H:%M:%S", 1), ("%Y-%m-%d %H:%M", 60), ("%Y-%m-%d", 86400)):
+        for candidate in (text, f"{today} {text}"):
+            try:
+                t = datetime.datetime.strptime(candidate, fmt).timestamp()
+            except ValueError:
+                continue
+            return int((t + (step if end else 0)) * 1000)
+    return None
+
+
+class ScanStats:
+    # Rolling scan counts in one-second buckets [second, scans, duplicates, misses] over
+    # the longest window: add() is O(1) and snapshot() walks at most that many buckets.
+    # Clears are not scans and are left out; "archived" counts as a miss.
+    def __init__(self, windows=SCAN_STATS_WINDOWS):
+        self.windows = tuple(sorted(windows))
+        self.span = self.windows[-1] * 60
+        self._buckets = collections.deque()
+
+    def _prune(self, now):
+        buckets = self._buckets
+        while buckets and buckets[0][0] <= now - self.span:
+            buckets.popleft()
+
+    def add(self, t, kind):
+        if kind == "clear":
+            return
+        sec = int(t)
+        buckets = self._buckets
+        if not buckets or sec > buckets[-1][0]:
+            buckets.append([sec, 0, 0, 0])
+            self._prune(sec)
+        bucket = buckets[-1]  # a clock step backwards lands in the newest bucket
+        bucket[1] += 1
+        if kind == "duplicate":
+            bucket[2] += 1
+        elif kind in ("not_found", "archived"):
+            bucket[3] += 1
+
+    def snapshot(self, now):
+        # ({minutes: scans per minute}, duplicate share, miss share) over the longest window
+        now = int(now)
+        self._prune(now)
+        totals = dict.fromkeys(self.windows, 0)
+        dupes = misses = 0
+        for sec, n, dup, miss in reversed(self._buckets):
+            age = now - sec
+            for minutes in self.windows:
+                if age < minutes * 60:
+                    totals[minutes] += n
+            dupes += dup
+            misses += miss
+        scans = totals[self.windows[-1]]
+        rates = {minutes: totals[minutes] / minutes for minutes in self.windows}
+        return rates, (dupes / scans if scans else 0.0), (misses / scans if scans else 0.0)
+
+
+class ScanServer:
+    # Scans from other stations, served by an asyncio loop on a background thread:
+    #   TCP   one barcode per line, optionally "barcode<TAB>station"; one reply line per
+    #         scan, in order ("OK <time>", "DUPLICATE <time>", "ARCHIVED <month>", "NOT_FOUND")
+    #   HTTP  GET /scan?code=...&station=... or POST /scan with one barcode per line;
+    #         JSON reply
+    # Each scan goes into `inbox` (a queue.Queue) as (code, timestamp, station, future).
+    # Whoever drains the inbox applies it and sets the future's result to the ScanResult,
+    # so all table writes stay on that thread. Clients may pipeline: replies are awaited
+    # in order while later lines are already queued.
+    def __init__(self, inbox, host="127.0.0.1", tcp_port=SCAN_SERVER_TCP_PORT, http_port=SCAN_SERVER_HTTP_PORT):
+        self.inbox = inbox
+        self.host = host
+        self.tcp_port = tcp_port
+        self.http_port = http_port
+        self.addresses = {}  # "tcp"/"http" -> (host, port) actually bound
+        self.error = None
+        self.received = 0
+        self._loop = None
+        self._started = threading.Event()
+        self._thread = None
+
+    def start(self, timeout=5.0):
+        self._thread = threading.Thread(target=self._run, name="scan-server", daemon=True)
+        self._thread.start()
+        self._started.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self
+
+    def stop(self, timeout=5.0):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(loop.stop)
+            except RuntimeError:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        import asyncio
+        loop = self._loop = asyncio.new_event_loop()
+        servers = []
+        try:
+            asyncio.set_event_loop(loop)
+            if self.tcp_port is not None:
+                servers.append(("tcp", loop.run_until_complete(
+                    asyncio.start_server(self._handle_tcp, self.host, self.tcp_port))))
+            if self.http_port is not None:
+                servers.append(("http", loop.run_until_complete(
+                    asyncio.start_server(self._handle_http, self.host, self.http_port))))
+            for kind, server in servers:
+                self.addresses[kind] = server.sockets[0].getsockname()[:2]
+        except Exception as e:
+            self.error = e
+        self._started.set()
+        try:
+            if self.error is None:
+                loop.run_forever()
+        finally:
+            for _, server in servers:
+                server.close()
+            # connections still open: let their handlers unwind, and the transports they
+            # closed finish closing, before the loop goes away
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
+    def _submit(self, code, station):
+        import asyncio
+        import concurrent.futures
+        future = concurrent.futures.Future()
+        self.received += 1
+        self.inbox.put((code, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), station or None, future))
+        return asyncio.wrap_future(future)
+
+    @staticmethod
+    def result_dict(result):
+        return {"code": result.code, "outcome": result.outcome, "timestamp": result.timestamp,
+                "matches": result.matches, "month": result.month}
+
+    @staticmethod
+    def result_line(result):
+        if result.outcome == "ok":
+            return f"OK {result.timestamp}"
+        if result.outcome == "duplicate":
+            return f"DUPLICATE {result.timestamp}"
+        if result.outcome == "archived":
+            return f"ARCHIVED {result.month}"
+        return "NOT_FOUND"
+
+    async def _handle_tcp(self, reader, writer):
+        import asyncio
+        pending = asyncio.Queue()
+
+        async def reply():
+            while True:
+                future = await pending.get()
+                if future is None:
+                    break
+                try:
+                    line = self.result_line(await future) if not isinstance(future, str) else future
+                except Exception as e:
+                    line = f"ERROR {e}"
+                writer.write((line + "\n").encode("utf-8"))
+                await writer.drain()
+
+        replier = asyncio.ensure_future(reply())
+        try:
+            while True:
+                try:
+                    raw = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError as e:
+                    raw = e.partial  # last line without a newline
+                    if not raw:
+                        break
+                except asyncio.LimitOverrunError:
+                    # longer than the stream limit (64 KiB): answer it and skip to the next line
+                    await pending.put("ERROR line too long")
+                    await self._discard_line(reader)
+                    continue
+                fields = raw.decode("utf-8", "replace").rstrip("\r\n").split("\t")
+                code = fields[0].strip()
+                station = fields[1].strip() if len(fields) > 1 else f"{writer.get_extra_info('peername')[0]}"
+                await pending.put(self._submit(code, station) if code else "ERROR empty barcode")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            await pending.put(None)
+            try:
+                await replier
+            except (Exception, asyncio.CancelledError):
+                pass
+            writer.close()
+
+    @staticmethod
+    async def _discard_line(reader):
+        import asyncio
+        while True:
+            try:
+                await reader.readuntil(b"\n")
+                return
+            except asyncio.LimitOverrunError as e:
+                await reader.readexactly(e.consumed)
+
+    async def _handle_http(self, reader, writer):
+        import asyncio
+        import json
+        from urllib.parse import parse_qs, urlsplit
+        status, body = "200 OK", {}
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            method, target = request_line[0], urlsplit(request_line[1])
+            query = parse_qs(target.query)
+            station = query.get("station", [None])[0] or writer.get_extra_info("peername")[0]
+            if target.path != "/scan":
+                status, body = "404 Not Found", {"error": "use /scan"}
+            elif method == "GET":
+                codes = [c.strip() for c in query.get("code", []) if c.strip()]
+            elif method == "POST":
+                length = int(headers.get("content-length", "0"))
+                if length < 0:
+                    raise ValueError("bad Content-Length")
+                if length > SCAN_SERVER_MAX_BODY:
+                    status, body = "413 Payload Too Large", {"error": f"body over {SCAN_SERVER_MAX_BODY} bytes"}
+                else:
+                    data = (await reader.readexactly(length)).decode("utf-8") if length else ""
+                    codes = [line.strip() for line in data.splitlines() if line.strip()]
+            else:
+                status, body = "405 Method Not Allowed", {"error": "GET or POST"}
+            if status.startswith("200"):
+                if not codes:
+                    status, body = "400 Bad Request", {"error": "no barcode"}
+                else:
+                    futures = [self._submit(code, station) for code in codes]
+                    body = {"results": [self.result_dict(r) for r in await asyncio.gather(*futures)]}
+        except Exception as e:
+            status, body = "400 Bad Request", {"error": str(e)}
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                     f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1") + payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+
 class EditableTreeview(ttk.Treeview):
-    def __init__(self, master=None, **kw):
+    # Virtual view over a TableModel. The Treeview only holds the rows in the viewport
+    # plus VIRTUAL_BUFFER_ROWS, refilled from the model when scrolling; item ids are
+    # str(rid). Selection is kept here as a set of rids so it survives scrolling, and
+    # edits are written to the model, whose notifications refresh the visible items.
+    def __init__(self, master=None, model=None, **kw):
         super().__init__(master, **kw)
+        self.model = model
         self._edit_widget = None
-        self.last_anchor = ("#1", None)
+        self.last_anchor = ("#1", None)  # (column id, rid)
+        self._top = 0
+        self._shown = []
+        self._shown_set = set()
+        self._selection = set()
+        self._sel_anchor = None
+        self._yscroll = None
+        self._filter = None
+        self._filter_pos = None
         self.bind("<Double-1>", self._begin_edit_cell)
         self.bind("<Button-1>", self._on_single_click)
+        self.bind("<Configure>", lambda e: self._refill())
+        self.bind("<MouseWheel>", self._on_wheel)
+        self.bind("<Button-4>", lambda e: self._scroll_rows(-3))
+        self.bind("<Button-5>", lambda e: self._scroll_rows(3))
+        self.bind("<Up>", lambda e: self._move_cursor(-1))
+        self.bind("<Down>", lambda e: self._move_cursor(1))
+        self.bind("<Prior>", lambda e: self._move_cursor(-self._page_size()))
+        self.bind("<Next>", lambda e: self._move_cursor(self._page_size()))
+        self.tag_configure("invalid", background="#ffd0d0")
+        if model is not None:
+            model.subscribe(self._on_model_change)
+
+    @staticmethod
+    def rid_of(iid):
+        return int(iid)
+
+    def _row_tags(self, rid):
+        # highlight rows whose quantity/price/shipping is not a number
+        return ("invalid",) if self.model.cost_inputs_invalid(rid) else ()
+
+    # ----- rows being viewed -----
+    # All model rows, or the rids passed to set_filter() in that order
+    def _row_count(self):
+        return len(self.model) if self._filter is None else len(self._filter)
+
+    def _rid_at(self, pos):
+        return self.model.rid_at(pos) if self._filter is None else self._filter[pos]
+
+    def _pos_of(self, rid):
+        # None when the row is filtered out
+        if self._filter is None:
+            return self.model.position(rid) if rid in self.model else None
+        if self._filter_pos is None:
+            self._filter_pos = {r: i for i, r in enumerate(self._filter)}
+        return self._filter_pos.get(rid)
+
+    def set_filter(self, rids, keep_position=False):
+        # keep_position: same query re-run after edits/scans, so the row at the top of the
+        # viewport stays there (or the viewport keeps its offset if that row dropped out)
+        top_rid = None
+        if keep_position and self._top < self._row_count():
+            top_rid = self._rid_at(self._top)
+        self._filter = None if rids is None else list(rids)
+        self._filter_pos = None
+        if self._filter is not None:
+            visible = set(self._filter)
+            self._selection &= visible
+            if self._sel_anchor not in visible:
+                self._sel_anchor = None
+        if not keep_position:
+            self._top = 0
+        elif top_rid is not None:
+            pos = self._pos_of(top_rid)
+            if pos is not None:
+                self._top = pos
+        self._shown = None
+        self._refill()
+
+    def filtered(self):
+        return self._filter is not None
+
+    def selected_rids(self):
+        return sorted(self._selection, key=self.model.position)
+
+    def select_rids(self, rids):
+        self._selection = set(rids)
+        self._apply_selection()
+
+    # ----- virtual scrolling -----
+    def set_yscroll(self, command):
+        self._yscroll = command
+        self._update_scrollbar()
+
+    def _page_size(self):
+        try:
+            row_h = int(ttk.Style(self).lookup("Treeview", "rowheight") or 20)
+        except (tk.TclError, ValueError):
+            row_h = 20
+        height = self.winfo_height()
+        if height <= 1:
+            height = int(self.cget("height") or 10) * row_h + 25
+        return max(1, (height - 25) // row_h)
+
+    def _refill(self):
+        if self._edit_widget is not None:
+            self._end_edit_cell(True)
+        total = self._row_count()
+        page = self._page_size()
+        self._top = max(0, min(self._top, total - page))
+        end = min(total, self._top + page + VIRTUAL_BUFFER_ROWS)
+        shown = [self._rid_at(pos) for pos in range(self._top, end)]
+        if shown != self._shown:
+            super().delete(*super().get_children())
+            for rid in shown:
+                self.insert("", "end", iid=str(rid), values=self.model.row(rid), tags=self._row_tags(rid))
+            self._shown = shown
+            self._shown_set = set(shown)
+            super().yview_moveto(0)
+        self._apply_selection()
+        self._update_scrollbar()
+
+    def _apply_selection(self):
+        super().selection_set([str(rid) for rid in self._shown if rid in self._selection])
+
+    def _update_scrollbar(self):
+        if self._yscroll is None:
+            return
+        total = self._row_count()
+        if total <= 0:
+            self._yscroll(0.0, 1.0)
+            return
+        page = self._page_size()
+        self._yscroll(self._top / total, min(1.0, (self._top + page) / total))
+
+    def yview(self, *args):
+        # Scrollbar protocol, translated to a window over the model
+        total = self._row_count()
+        page = self._page_size()
+        if not args:
+            if not total:
+                return (0.0, 1.0)
+            return (self._top / total, min(1.0, (self._top + page) / total))
+        if args[0] == "moveto":
+            self._scroll_to(int(float(args[1]) * total))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if str(args[2]).startswith("page"):
+                step *= page
+            self._scroll_to(self._top + step)
+
+    def _scroll_to(self, top):
+        self._top = top
+        self._refill()
+
+    def _scroll_rows(self, delta):
+        self._scroll_to(self._top + delta)
+        return "break"
+
+    def _on_wheel(self, event):
+        if abs(event.delta) >= 120:
+            steps = -int(event.delta / 120) * 3
+        else:
+            steps = -event.delta  # macOS reports small deltas
+        return self._scroll_rows(steps)
+
+    def see_rid(self, rid):
+        pos = self._pos_of(rid)
+        if pos is None:
+            return
+        page = self._page_size()
+        if pos < self._top or pos >= self._top + page:
+            self._scroll_to(pos - page // 2)
+
+    def _move_cursor(self, delta):
+        total = self._row_count()
+        if not total:
+            return "break"
+        anchor = self._pos_of(self._sel_anchor) if self._sel_anchor is not None else None
+        pos = self._top if anchor is None else anchor + delta
+        pos = max(0, min(total - 1, pos))
+        rid = self._rid_at(pos)
+        self._selection = {rid}
+        self._sel_anchor = rid
+        self.see_rid(rid)
+        self._apply_selection()
+        try:
+            super().focus(str(rid))
+        except tk.TclError:
+            pass
+        return "break"
 
+    # ----- model notifications -----
+    def _on_model_change(self, kind, rids, info):
+        if kind == "reset":
+            if self._filter is not None:
+                self._filter = []  # old rids; the owner sets a new filter
+                self._filter_pos = None
+            self._top = 0
+            self._selection.clear()
+            self._sel_anchor = None
+            self.last_anchor = (self.last_anchor[0], None)
+            self._shown = None
+            self._refill()
+        elif kind == "insert":
+            self._shown = None
+            self._refill()
+        elif kind == "delete":
+            gone = set(rids)
+            self._selection -= gone
+            if self._sel_anchor in gone:
+                self._sel_anchor = None
+            if self.last_anchor[1] in gone:
+                self.last_anchor = (self.last_anchor[0], None)
+            if self._edit_widget is not None and self._edit_row in gone:
+                self._end_edit_cell(False)
+            if self._filter is not None:
+                self._filter = [rid for rid in self._filter if rid not in gone]
+                self._filter_pos = None
+            self._shown = None
+            self._refill()
+        elif kind == "update":
+            for rid in self._shown_set.intersection(rids):
+                self.item(str(rid), values=self.model.row(rid), tags=self._row_tags(rid))
+
+    # ----- mouse / editing -----
     def _on_single_click(self, event):
         region = self.identify("region", event.x, event.y)
         row_id = self.identify_row(event.y)
         col_id = self.identify_column(event.x)
-        if region == "cell" and row_id and col_id:
-            self.last_anchor = (col_id, row_id)
         if self._edit_widget is not None:
             self._end_edit_cell(save=True)
+        if region not in ("cell", "tree") or not row_id:
+            return None
+        rid = self.rid_of(row_id)
+        if col_id:
+            self.last_anchor = (col_id, rid)
+        if event.state & 0x0001 and self._sel_anchor is not None and self._pos_of(self._sel_anchor) is not None:
+            # Shift: range by model position, including rows scrolled out of view
+            a, b = sorted((self._pos_of(self._sel_anchor), self._pos_of(rid)))
+            self._selection = {self._rid_at(pos) for pos in range(a, b + 1)}
+        elif event.state & 0x0004:
+            self._selection ^= {rid}
+            self._sel_anchor = rid
+        else:
+            self._selection = {rid}
+            self._sel_anchor = rid
+        self._apply_selection()
+        super().focus(row_id)
+        self.focus_set()
+        return "break"
 
     def _begin_edit_cell(self, event):
         region = self.identify("region", event.x, event.y)
@@ -49,7 +3078,8 @@ class EditableTreeview(ttk.Treeview):
         col_id = self.identify_column(event.x)
         if not row_id or not col_id:
             return
-        self.last_anchor = (col_id, row_id)
+        rid = self.rid_of(row_id)
+        self.last_anchor = (col_id, rid)
         col_index = int(col_id[1:]) - 1
         if COLUMNS[col_index] == "Scan":
             return
@@ -57,9 +3087,9 @@ class EditableTreeview(ttk.Treeview):
         if not bbox:
             return
         x, y, w, h = bbox
-        value = self.set(row_id, col_id)
-        self._edit_row = row_id
-        self._edit_col = col_id
+        value = self.model.get(rid, col_index)
+        self._edit_row = rid
+        self._edit_col = col_index
         self._edit_widget = tk.Entry(self, borderwidth=1, bg="white", fg="black")
         self._edit_widget.insert(0, value)
         self._edit_widget.select_range(0, tk.END)
@@ -73,16 +3103,17 @@ class EditableTreeview(ttk.Treeview):
         if self._edit_widget is None:
             return
         new_value = self._edit_widget.get()
-        if save:
-            self.set(self._edit_row, self._edit_col, new_value)
+        # destroy first: FocusOut fires again while the widget goes away
+        widget, self._edit_widget = self._edit_widget, None
+        if save and self._edit_row in self.model:
+            self.model.set(self._edit_row, self._edit_col, new_value)
             root = self._root()
             if hasattr(root, "autosave"):
                 try:
                     root.autosave()
                 except Exception:
                     pass
-        self._edit_widget.destroy()
-        self._edit_widget = None
+        widget.destroy()
         self._edit_row = None
         self._edit_col = None
 
@@ -111,21 +3142,67 @@ class App(tk.Tk):
         self.auto_scan = tk.BooleanVar(value=True)
 
         self._load_settings()
-        self._scan_debounce_id = None
+        self._scan_assembler = ScanAssembler()
+        self._scan_idle_id = None
+        self._scan_queue = collections.deque()  # (code, timestamp, station, future)
+        self._scan_inbox = queue.Queue()  # filled by ScanServer's thread
+        self.scan_server = None
+        self._scan_inbox_after_id = None
+        self._scan_drain_id = None
+        self.scan_events = ScanEventLog(SCAN_EVENTS_PATH)
+        self.scan_stats = ScanStats()
+        self.archive = MonthArchive(ARCHIVE_DIR)
+        self.model = TableModel()
+        self.model.subscribe(self._journal_model_change)
+        self.model.subscribe(self._on_model_change_recalc)
+        self.search = SearchIndex(self.model)
+        self.summary = CostSummary(self.model)
+        self._summary_win = None
+        self.model.subscribe(self._on_model_change_filter)
+        self._filter_after_id = None
+        self._filter_key = None  # (query, scan choice) of the filter on screen
+        self._merge = None
+        self._merge_dirty = False
+        self._merge_started = None
+        self.model.subscribe(self._on_model_change_merge)
+        self.journal = self._open_session_store()
+        self._journal_pending = []
+        self.metrics = OpMetrics(METRICS_PATH)
+        self._profile_next = False
+        self._import_started = None
+        self._barcode_export_started = None
+        self._label_sheet_started = None
+        self.autosave_writer = BackgroundWriter(self._write_autosave_snapshot)
+        self.session_cache_writer = BackgroundWriter(self._write_session_cache, name="session-cache")
+        self._scan_ready = False
+        self._autosave_after_id = None
+        self._import = None
+        self._import_previous = None
+        self._import_on_done = None
+        self._autosave_deferred = False
+        self._barcode_export = None
+        self._label_sheet = None
         self._build_toolbar()
         self._build_table()
         self._build_scan_panel()
         self._build_statusbar()
 
+        # the session streams in after the window is up; scans queue until it is loaded
         self._load_autosave_or_init()
+        threading.Thread(target=prune_barcode_cache, name="barcode-cache-prune", daemon=True).start()
+        if self.settings.get("scan_server", {}).get("enabled"):
+            self.start_scan_server()
+        self.after_idle(lambda: self._record_op("startup", time.perf_counter() - PROCESS_STARTED))
+        self._refresh_scan_stats()
 
         # Shortcuts
         self.bind_all("<Control-s>", lambda e: self.save_csv())
         self.bind_all("<Control-o>", lambda e: self.load_csv())
         self.bind_all("<Control-n>", lambda e: self.add_row_and_save())
         self.bind_all("<Delete>", lambda e: self.delete_selected_and_save())
-        self.bind_all("<Control-v>", lambda e: self.paste_from_clipboard())
-        self.bind_all("<Command-v>", lambda e: self.paste_from_clipboard())
+        self.bind_all("<Control-v>", self._on_paste_key)
+        self.bind_all("<Command-v>", self._on_paste_key)
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
 
         # ---------- Settings (persist last export folder) ----------
     def _load_settings(self):
@@ -136,40 +3213,281 @@ class App(tk.Tk):
                 with open(SETTINGS_PATH, 'r', encoding='utf-8') as f:
                     self.settings = json.load(f) or {}
         except Exception:
-            self.settings = {}
+            self.settings = {}
+
+    def _save_settings(self):
+        try:
+            import json
+            with open(SETTINGS_PATH, 'w', encoding='utf-8') as f:
+                json.dump(self.settings, f, ensure_ascii=False, indent=2)
+        except Exception:
+            pass
+
+    # ---------- Auto-Scan Helpers ----------
+    def _on_scan_key(self, event):
+        if event.keysym in SCAN_TERMINATORS:
+            self._cancel_scan_idle()
+            self._queue_scan(self._scan_assembler.terminate(self.scan_var.get()))
+            self.scan_var.set("")
+            return "break"
+        if not self.auto_scan.get():
+            return None
+        if not event.char:
+            return None  # Shift, Ctrl, arrows, ...
+        if not event.char.isprintable():
+            self._scan_assembler.edit()  # backspace, Ctrl+V, ...
+            return None
+        t_ms = event.time if event.time else int(time.monotonic() * 1000)
+        done = self._scan_assembler.feed(event.char, t_ms)
+        if done is not None:
+            # the box holds the finished code; this character starts the next one
+            self._queue_scan(done)
+            self.scan_var.set("")
+        self._cancel_scan_idle()
+        self._scan_idle_id = self.after(SCAN_MAX_GAP_MS * 2, self._on_scan_idle)
+        return None
+
+    def _cancel_scan_idle(self):
+        if self._scan_idle_id is not None:
+            try:
+                self.after_cancel(self._scan_idle_id)
+            except Exception:
+                pass
+            self._scan_idle_id = None
+
+    def _on_scan_idle(self):
+        self._scan_idle_id = None
+        # pending key events are handled before timers, so no key came in since
+        code = self._scan_assembler.flush()
+        if code is not None:
+            self.scan_var.set("")
+            self._queue_scan(code)
+
+    def _queue_scan(self, code):
+        if not code:
+            self._set_status("ไม่มีข้อมูลที่สแกน")
+            return
+        # the time the item was scanned, not the time the queue gets to it
+        self._scan_queue.append((code, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), None, None))
+        if self._scan_drain_id is None:
+            self._scan_drain_id = self.after_idle(self._drain_scans)
+
+    def _drain_scans(self):
+        self._scan_drain_id = None
+        if self._import is not None or self._merge is not None:
+            # apply scans to the whole sheet, not a half-loaded one (or one being merged)
+            self._set_status(f"รอโหลดข้อมูลเสร็จ มีสแกนรอ {len(self._scan_queue):,} รายการ")
+            self._scan_drain_id = self.after(100, self._drain_scans)
+            return
+        if not self._scan_queue:
+            return
+        results = []
+        events = []
+        local = False
+        with self._timed("scan") as m:
+            while self._scan_queue and len(results) < SCAN_BATCH_MAX:
+                code, ts, station, reply = self._scan_queue.popleft()
+                result = self.model.apply_scan(code, ts)
+                if result.outcome == "not_found":
+                    result = self._archived_scan(result)
+                results.append(result)
+                events.append((time.time() * 1000, result.outcome, station, result.code))
+                self._log_scan(result, station)
+                if reply is not None:
+                    try:
+                        reply.set_result(result)
+                    except Exception:
+                        pass  # the client went away
+                local = local or station is None
+            m["rows"] = len(results)
+            m["ok"] = sum(r.outcome == "ok" for r in results)
+            self._record_scan_events(events)
+        last = results[-1]
+        self._set_status(self._scan_status(last) + (f" (รอ {len(self._scan_queue):,})" if self._scan_queue else ""))
+        if any(r.outcome != "ok" for r in results):
+            self.bell()
+        if any(r.outcome == "ok" for r in results):
+            self.autosave()
+            if last.outcome == "ok":
+                self.tree.see_rid(last.rid)
+        if self._scan_queue:
+            self._scan_drain_id = self.after(1, self._drain_scans)
+        if local:
+            self._maybe_focus_scan()
+
+    # ---------- Scan event log ----------
+    def _record_scan_events(self, events):
+        try:
+            self.scan_events.append(events)
+        except Exception:
+            pass  # history is a record, not a reason to drop the scan
+        for ts, kind, _, _ in events:
+            self.scan_stats.add(ts / 1000, kind)
+        self._refresh_scan_stats(schedule=False)
 
-    def _save_settings(self):
+    def _refresh_scan_stats(self, schedule=True):
+        rates, dupes, misses = self.scan_stats.snapshot(time.time())
+        text = "สแกน/นาที " + " · ".join(f"{m} นาที: {r:,.1f}" for m, r in rates.items())
+        text += f" | ซ้ำ {dupes:.1%} | ไม่พบ {misses:.1%}"
         try:
-            import json
-            with open(SETTINGS_PATH, 'w', encoding='utf-8') as f:
-                json.dump(self.settings, f, ensure_ascii=False, indent=2)
+            self.scan_stats_var.set(text)
         except Exception:
             pass
+        if schedule:
+            self.after(SCAN_STATS_REFRESH_MS, self._refresh_scan_stats)
 
-    # ---------- Auto-Scan Helpers ----------
-    def _on_scan_var_write(self):
-        # Debounce rapid key events from barcode scanner
-        if not getattr(self, 'auto_scan', tk.BooleanVar(value=True)).get():
-            return
-        # cancel pending timer
-        if getattr(self, '_scan_debounce_id', None):
+    def show_scan_history(self):
+        win = tk.Toplevel(self)
+        win.title("ประวัติการสแกน")
+        win.geometry("760x480")
+        bar = tk.Frame(win, padx=6, pady=4)
+        bar.pack(side=tk.TOP, fill=tk.X)
+        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        start_var = tk.StringVar(value=f"{today} 00:00")
+        end_var = tk.StringVar(value=datetime.datetime.now().strftime("%Y-%m-%d %H:%M"))
+        code_var = tk.StringVar()
+        kind_choices = ["ทั้งหมด"] + [SCAN_EVENT_LABELS[k] for k in SCAN_EVENT_KINDS]
+        kind_var = tk.StringVar(value=kind_choices[0])
+        for label, var, width in (("ตั้งแต่", start_var, 17), ("ถึง", end_var, 17), ("บาร์โค้ด", code_var, 22)):
+            ttk.Label(bar, text=label).pack(side=tk.LEFT, padx=2)
+            ttk.Entry(bar, width=width, textvariable=var).pack(side=tk.LEFT, padx=2)
+        ttk.Combobox(bar, width=12, state="readonly", values=kind_choices, textvariable=kind_var).pack(side=tk.LEFT, padx=2)
+        columns = (("time", "เวลา", 150), ("kind", "ผล", 90), ("station", "สถานี", 120), ("barcode", "บาร์โค้ด", 220))
+        tree = ttk.Treeview(win, columns=[c for c, _, _ in columns], show="headings")
+        for col, title, width in columns:
+            tree.heading(col, text=title)
+            tree.column(col, width=width, anchor="w")
+        summary_var = tk.StringVar()
+        ttk.Label(win, textvariable=summary_var).pack(side=tk.BOTTOM, fill=tk.X, padx=6, pady=4)
+        tree.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=6)
+        shown = []
+
+        def query():
+            start = _parse_event_time(start_var.get())
+            end = _parse_event_time(end_var.get(), end=True)
+            if start is None or end is None:
+                summary_var.set("รูปแบบเวลา: YYYY-MM-DD HH:MM หรือ HH:MM (วันนี้)")
+                return
+            kinds = [k for k in SCAN_EVENT_KINDS if SCAN_EVENT_LABELS[k] == kind_var.get()] or None
+            code = code_var.get().strip() or None
+            with self._timed("scan_history") as m:
+                events = self.scan_events.range(start, end, kinds=kinds, barcode=code, limit=SCAN_HISTORY_LIMIT)
+                counts = self.scan_events.counts(start, end, barcode=code)
+                m["rows"] = len(events)
+            shown[:] = events
+            tree.delete(*tree.get_children())
+            for ts, kind, station, barcode in events:
+                when = datetime.datetime.fromtimestamp(ts / 1000).strftime("%Y-%m-%d %H:%M:%S")
+                tree.insert("", tk.END, values=(when, SCAN_EVENT_LABELS[kind], station or "เครื่องนี้", barcode))
+            scans = sum(n for k, n in counts.items() if k != "clear")
+            minutes = max((end - start) / 60000, 1)
+            parts = [f"{SCAN_EVENT_LABELS[k]} {counts[k]:,}" for k in SCAN_EVENT_KINDS if counts.get(k)]
+            text = f"ทั้งหมด {sum(counts.values()):,} เหตุการณ์ ({', '.join(parts) or '-'}), เฉลี่ย {scans / minutes:,.2f} สแกน/นาที"
+            if len(events) == SCAN_HISTORY_LIMIT:
+                text += f" แสดง {SCAN_HISTORY_LIMIT:,} รายการแรก"
+            summary_var.set(text)
+
+        def export():
+            if not shown:
+                return
+            path = filedialog.asksaveasfilename(parent=win, title="บันทึกประวัติการสแกน", defaultextension=".csv",
+                                                filetypes=[("CSV files", "*.csv")])
+            if not path:
+                return
             try:
-                self.after_cancel(self._scan_debounce_id)
-            except Exception:
-                pass
-        # schedule a short delay; if input stays stable, fire scan
-        self._scan_debounce_id = self.after(150, self._auto_scan_fire)
+                with open(path, "w", newline="", encoding="utf-8-sig") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(["เวลา", "ผล", "สถานี", "บาร์โค้ด"])
+                    for ts, kind, station, barcode in shown:
+                        writer.writerow([datetime.datetime.fromtimestamp(ts / 1000).isoformat(sep=" ", timespec="milliseconds"),
+                                         kind, station, barcode])
+            except Exception as e:
+                messagebox.showerror("ผิดพลาด", str(e), parent=win)
 
-    def _auto_scan_fire(self):
+        ttk.Button(bar, text="ค้นหา", command=query).pack(side=tk.LEFT, padx=4)
+        ttk.Button(bar, text="Export CSV", command=export).pack(side=tk.LEFT, padx=2)
+        query()
+
+    def _archived_scan(self, result):
         try:
-            data = self.scan_var.get().strip()
+            hits = self.archive.lookup(result.code)
         except Exception:
-            data = self.scan_entry.get().strip()
-        if not data:
+            hits = []
+        if not hits:
+            return result
+        month, scan = hits[-1]
+        return ScanResult("archived", result.code, None, scan, len(hits), month)
+
+    def _scan_status(self, result):
+        dup_note = f" (บาร์โค้ดนี้ซ้ำ {result.matches} แถว)" if result.matches > 1 else ""
+        if result.outcome == "ok":
+            return f"สแกนสำเร็จ: {result.code} @ {result.timestamp}" + dup_note
+        if result.outcome == "duplicate":
+            return f"สแกนซ้ำ: {result.code} (สแกนไปแล้วเมื่อ {result.timestamp})" + dup_note
+        if result.outcome == "archived":
+            when = f" สแกนเมื่อ {result.timestamp}" if result.timestamp else " ยังไม่ได้สแกน"
+            return f"บาร์โค้ด {result.code} อยู่ในรอบเดือน {result.month} ที่ปิดแล้ว{when}"
+        return f"ไม่พบบาร์โค้ด: {result.code}"
+
+    def _log_scan(self, result, station=None):
+        log = self.scan_log
+        where = f"[{station}] " if station else ""
+        log.insert(0, f"{datetime.datetime.now():%H:%M:%S}  {where}{self._scan_status(result)}")
+        fg, bg = {"ok": ("#006400", "white"), "duplicate": ("black", "#ffd27f"),
+                  "archived": ("black", "#b8d4f0")}.get(result.outcome, ("white", "#c00000"))
+        log.itemconfigure(0, foreground=fg, background=bg)
+        if log.size() > SCAN_LOG_LINES:
+            log.delete(SCAN_LOG_LINES, tk.END)
+
+    # ---------- Network scans ----------
+    def start_scan_server(self):
+        if self.scan_server is not None:
+            return
+        cfg = self.settings.get("scan_server", {})
+        try:
+            self.scan_server = ScanServer(self._scan_inbox, host=cfg.get("host", "127.0.0.1"),
+                                          tcp_port=cfg.get("tcp_port", SCAN_SERVER_TCP_PORT),
+                                          http_port=cfg.get("http_port", SCAN_SERVER_HTTP_PORT)).start()
+        except Exception as e:
+            self.scan_server = None
+            self.scan_server_var.set(False)
+            self._set_status(f"เปิดรับสแกนจากเครือข่ายไม่สำเร็จ: {e}")
             return
-        # simple heuristic: treat as scan if length >= 4
-        if len(data) >= 4:
-            self.process_scan_and_save()
+        self.scan_server_var.set(True)
+        where = ", ".join(f"{kind.upper()} {host}:{port}" for kind, (host, port) in self.scan_server.addresses.items())
+        self._set_status(f"รับสแกนจากเครือข่ายที่ {where}")
+        if self._scan_inbox_after_id is None:
+            self._poll_scan_inbox()
+
+    def stop_scan_server(self):
+        server, self.scan_server = self.scan_server, None
+        if server is not None:
+            server.stop()
+            self._set_status("ปิดการรับสแกนจากเครือข่ายแล้ว")
+
+    def _on_scan_server_toggle(self):
+        if self.scan_server_var.get():
+            self.start_scan_server()
+        else:
+            self.stop_scan_server()
+        cfg = self.settings.setdefault("scan_server", {})
+        cfg["enabled"] = self.scan_server is not None
+        self._save_settings()
+
+    def _poll_scan_inbox(self):
+        # hand network scans to the same queue as the scan box
+        self._scan_inbox_after_id = None
+        moved = 0
+        while True:
+            try:
+                self._scan_queue.append(self._scan_inbox.get_nowait())
+            except queue.Empty:
+                break
+            moved += 1
+        if moved and self._scan_drain_id is None:
+            self._scan_drain_id = self.after_idle(self._drain_scans)
+        if self.scan_server is not None:
+            self._scan_inbox_after_id = self.after(SCAN_SERVER_POLL_MS, self._poll_scan_inbox)
 
 # ---------- UI ----------
     def _build_toolbar(self):
@@ -181,21 +3499,43 @@ class App(tk.Tk):
 
         ttk.Button(bar, text="Load CSV", command=self.load_csv).pack(side=tk.LEFT, padx=8)
         ttk.Button(bar, text="Save CSV", command=self.save_csv).pack(side=tk.LEFT, padx=2)
+        ttk.Button(bar, text="รวมไฟล์ CSV", command=self.merge_csv_files).pack(side=tk.LEFT, padx=2)
         ttk.Button(bar, text="Paste", command=self.paste_from_clipboard).pack(side=tk.LEFT, padx=8)
 
         ttk.Button(bar, text="Gen Barcode", command=self.generate_barcode_for_selected_or_empty_and_save).pack(side=tk.LEFT, padx=8)
+        self.barcode_sequence = tk.BooleanVar(value=self._barcode_mode() == "sequence")
+        ttk.Checkbutton(bar, text="เลขเรียง", variable=self.barcode_sequence, command=self._on_barcode_mode_change).pack(side=tk.LEFT, padx=2)
         ttk.Button(bar, text="Recalc", command=self.recalc_all_and_save).pack(side=tk.LEFT, padx=2)
         ttk.Button(bar, text="Clear Scan", command=self.clear_scan_selected_and_save).pack(side=tk.LEFT, padx=8)
 
         ttk.Button(bar, text="Export Barcodes (PNG)", command=lambda: self.export_barcodes_png(selected_only=True)).pack(side=tk.LEFT, padx=8)
+        ttk.Button(bar, text="พิมพ์ฉลาก", command=self.print_selected_barcodes).pack(side=tk.LEFT, padx=2)
+        self.label_template_var = tk.StringVar(value=self._label_template())
+        template_box = ttk.Combobox(bar, width=10, state="readonly", values=list(LABEL_TEMPLATES),
+                                    textvariable=self.label_template_var)
+        template_box.pack(side=tk.LEFT, padx=2)
+        template_box.bind("<<ComboboxSelected>>", self._on_label_template_change)
+
+        ttk.Label(bar, text="บันทึก:").pack(side=tk.LEFT, padx=(8, 2))
+        self.autosave_mode_var = tk.StringVar(value=AUTOSAVE_MODES[self._autosave_mode()])
+        autosave_box = ttk.Combobox(bar, width=8, state="readonly", values=list(AUTOSAVE_MODES.values()),
+                                    textvariable=self.autosave_mode_var)
+        autosave_box.pack(side=tk.LEFT, padx=2)
+        autosave_box.bind("<<ComboboxSelected>>", self._on_autosave_mode_change)
+
+        ttk.Button(bar, text="ปิดเดือนเก่า", command=self.close_old_months).pack(side=tk.LEFT, padx=8)
+        ttk.Button(bar, text="คลังรอบเดือน", command=self.show_month_archive).pack(side=tk.LEFT, padx=2)
+        ttk.Button(bar, text="สรุปต้นทุน", command=self.show_cost_summary).pack(side=tk.LEFT, padx=8)
+        ttk.Button(bar, text="ประวัติสแกน", command=self.show_scan_history).pack(side=tk.LEFT, padx=2)
 
     def _build_table(self):
         container = tk.Frame(self, bg="#c0c0c0")
         container.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-        self.tree = EditableTreeview(container, columns=COLUMNS, show="headings", selectmode="extended")
+        self.tree = EditableTreeview(container, model=self.model, columns=COLUMNS, show="headings", selectmode="extended")
         vsb = ttk.Scrollbar(container, orient="vertical", command=self.tree.yview)
         hsb = ttk.Scrollbar(container, orient="horizontal", command=self.tree.xview)
-        self.tree.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
+        self.tree.configure(xscrollcommand=hsb.set)
+        self.tree.set_yscroll(vsb.set)
         for col in COLUMNS:
             self.tree.heading(col, text=col)
             self.tree.column(col, width=150 if col == "ชื่อสินค้า" else 140, anchor="w")
@@ -211,18 +3551,40 @@ class App(tk.Tk):
         self.scan_var = tk.StringVar()
         self.scan_entry = ttk.Entry(pane, width=40, textvariable=self.scan_var)
         self.scan_entry.pack(side=tk.LEFT, padx=2)
-        self.scan_entry.bind("<Return>", lambda e: self.process_scan_and_save())
-        # Auto-Scan: trigger when input stops changing briefly
-        try:
-            self.scan_var.trace_add("write", lambda *args: self._on_scan_var_write())
-        except Exception:
-            pass
+        # Enter/Tab or the keystroke timing ends a code; codes go through a queue
+        self.scan_entry.bind("<KeyPress>", self._on_scan_key)
         ttk.Button(pane, text="Scan", command=self.process_scan_and_save).pack(side=tk.LEFT, padx=6)
+        # Filter: substring of item no./SKU/product name/barcode, plus the Scan state
+        ttk.Label(pane, text="ค้นหา:").pack(side=tk.LEFT, padx=6)
+        self.filter_var = tk.StringVar()
+        ttk.Entry(pane, width=24, textvariable=self.filter_var).pack(side=tk.LEFT, padx=2)
+        self.filter_scan_var = tk.StringVar(value=FILTER_SCAN_CHOICES[0])
+        ttk.Combobox(pane, width=12, state="readonly", values=FILTER_SCAN_CHOICES,
+                     textvariable=self.filter_scan_var).pack(side=tk.LEFT, padx=2)
+        self.filter_var.trace_add("write", lambda *args: self._schedule_filter())
+        self.filter_scan_var.trace_add("write", lambda *args: self._schedule_filter())
+        # non-modal log: newest first, green = ok, orange = already scanned,
+        # blue = in a closed month, red = not found
+        self.scan_server_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(pane, text="รับสแกนจากเครือข่าย", variable=self.scan_server_var,
+                        command=self._on_scan_server_toggle).pack(side=tk.LEFT, padx=6)
+        self.scan_stats_var = tk.StringVar()
+        ttk.Label(pane, textvariable=self.scan_stats_var).pack(side=tk.LEFT, padx=6)
+        self.scan_log = tk.Listbox(pane, height=4, activestyle="none", bg="white")
+        self.scan_log.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=6)
 
     def _build_statusbar(self):
         self.status = tk.StringVar(value="พร้อมใช้งาน")
-        bar = tk.Label(self, textvariable=self.status, anchor="w", bg="#808080", fg="black", relief=tk.SUNKEN)
-        bar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.statusbar = tk.Frame(self, bg="#808080")
+        self.statusbar.pack(side=tk.BOTTOM, fill=tk.X)
+        bar = tk.Label(self.statusbar, textvariable=self.status, anchor="w", bg="#808080", fg="black", relief=tk.SUNKEN)
+        bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.latency_label = tk.Label(self.statusbar, text="", anchor="e", bg="#808080", fg="black", relief=tk.SUNKEN)
+        self.latency_label.pack(side=tk.RIGHT)
+        self.profile_button = ttk.Button(self.statusbar, text="Profile", command=self.profile_next_action)
+        self.profile_button.pack(side=tk.RIGHT, padx=2)
+        # shown only while a cancellable import is running
+        self.import_cancel_button = ttk.Button(self.statusbar, text="ยกเลิกการโหลด", command=self.cancel_import)
 
     def _set_status(self, text: str):
         try:
@@ -230,29 +3592,362 @@ class App(tk.Tk):
         except Exception:
             pass
 
+    # ---------- Metrics / Profiling ----------
+    def _slow_op_ms(self):
+        try:
+            return float(self.settings.get("slow_op_ms", SLOW_OP_MS))
+        except (TypeError, ValueError):
+            return SLOW_OP_MS
+
+    def _record_op(self, op, seconds, **fields):
+        rec = self.metrics.record(op, seconds, **fields)
+        ms = rec["ms"]
+        rows = f" {fields['rows']:,} แถว" if fields.get("rows") else ""
+        slow = ms > self._slow_op_ms()
+        try:
+            self.latency_label.configure(text=f"{op}{rows}: {ms:,.0f} ms", fg="#a00000" if slow else "black")
+        except Exception:
+            pass
+        if slow:
+            self.after_idle(lambda: self._set_status(self.status.get() + f" [ช้า: {op} {ms:,.0f} ms]"))
+        return rec
+
+    @contextlib.contextmanager
+    def _timed(self, op, **fields):
+        # Times one UI-thread action; with profiling armed it also runs under cProfile
+        profiler = None
+        if self._profile_next:
+            self._profile_next = False
+            import cProfile
+            profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            yield fields
+        except Exception as e:
+            fields["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            self._record_op(op, time.perf_counter() - start, **fields)
+            if profiler is not None:
+                self._dump_profile(op, profiler)
+
+    def profile_next_action(self):
+        self._profile_next = True
+        self._set_status("จะบันทึกโปรไฟล์ของคำสั่งถัดไป (บันทึก/โหลด/วาง/คำนวณ/สแกน/สร้างบาร์โค้ด)")
+
+    def _dump_profile(self, op, profiler):
+        try:
+            import pstats
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            base = os.path.join(PROFILE_DIR, f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{op}")
+            profiler.dump_stats(base + ".prof")
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(30)
+            self.after_idle(lambda: self._set_status(f"บันทึกโปรไฟล์ {op} ไว้ที่ {base}.prof"))
+        except Exception as e:
+            msg = f"บันทึกโปรไฟล์ไม่สำเร็จ: {e}"  # e is unbound once the except block ends
+            self.after_idle(lambda: self._set_status(msg))
+
     # ---------- Autosave ----------
+    def _autosave_mode(self):
+        # one of AUTOSAVE_MODES; "journal" by default
+        mode = self.settings.get("autosave_mode", "journal")
+        return mode if mode in AUTOSAVE_MODES else "journal"
+
+    def _on_autosave_mode_change(self, event=None):
+        mode = {label: name for name, label in AUTOSAVE_MODES.items()}.get(self.autosave_mode_var.get(), "journal")
+        if mode == self._autosave_mode():
+            return
+        if self._import is not None or self._merge is not None:
+            self.autosave_mode_var.set(AUTOSAVE_MODES[self._autosave_mode()])
+            self._set_status("กำลังโหลดไฟล์อยู่ กรุณารอสักครู่")
+            return
+        # finish writing in the old mode, then save the whole table in the new one
+        self.flush_autosave()
+        self.settings["autosave_mode"] = mode
+        self.journal = self._open_session_store()
+        mode = self._autosave_mode()  # an unusable database falls back to the journal
+        self.autosave_mode_var.set(AUTOSAVE_MODES[mode])
+        self._save_settings()
+        if self.journal is not None:
+            self._journal_reset()
+        else:
+            self.autosave()
+        self._set_status(f"บันทึกอัตโนมัติแบบ {AUTOSAVE_MODES[mode]} แล้ว")
+
+    def _open_session_store(self):
+        mode = self._autosave_mode()
+        if mode == "sqlite":
+            try:
+                return SessionStore(SESSION_DB_PATH)
+            except Exception:
+                self.settings["autosave_mode"] = "journal"  # unusable database: fall back
+                mode = "journal"
+        return SessionJournal(AUTOSAVE_PATH) if mode == "journal" else None
+
     def autosave(self):
+        if self._import is not None:
+            # the table is still filling up; save once the import has finished
+            self._autosave_deferred = True
+            return
         try:
-            self._save_to_path(AUTOSAVE_PATH)
+            if self.journal is None:
+                # coalesce: one snapshot per AUTOSAVE_COALESCE_MS, written off the UI thread
+                if self._autosave_after_id is None:
+                    self._autosave_after_id = self.after(AUTOSAVE_COALESCE_MS, self._autosave_fire)
+                return
+            pending, self._journal_pending = self._journal_pending, []
+            if pending:
+                # bytes as in snapshot mode's "autosave_write", so the modes can be compared
+                with self.metrics.measure("autosave", rows=len(pending)) as m:
+                    m["bytes"] = self.journal.append(pending)
+            if self.journal.needs_compaction():
+                self.journal.compact(self._table_rows())
         except Exception:
             pass
 
-    def _load_autosave_or_init(self):
-        if os.path.exists(AUTOSAVE_PATH):
+    def _write_autosave_snapshot(self, table):
+        # worker thread: metrics file only, the status bar is left alone. table is a
+        # TableModel.frozen_copy(); its rows are built here rather than on the UI thread
+        rows = table.rows()
+        with self.metrics.measure("autosave_write", rows=len(rows)) as m:
+            write_sheet_csv(AUTOSAVE_PATH, rows)
+            m["bytes"] = os.path.getsize(AUTOSAVE_PATH)
+        self._write_session_cache((rows, _file_fingerprint(AUTOSAVE_PATH)))
+
+    def _write_session_cache(self, job):
+        rows, fingerprint = job
+        try:
+            write_session_cache(AUTOSAVE_PATH, rows, fingerprint)
+        except Exception:
+            pass  # only a startup speed-up; the CSV is what counts
+
+    def _autosave_fire(self):
+        self._autosave_after_id = None
+        try:
+            self.autosave_writer.submit(self.model.frozen_copy())
+        except Exception:
+            pass
+
+    def _save_now(self):
+        # Autosave and wait until it is on disk; False when the write failed
+        try:
+            if self.journal is None:
+                if self._autosave_after_id is not None:
+                    self.after_cancel(self._autosave_after_id)
+                self._autosave_fire()
+                self.autosave_writer.flush()
+                return self.autosave_writer.last_error is None
+            pending, self._journal_pending = self._journal_pending, []
+            if pending:
+                with self.metrics.measure("autosave", rows=len(pending)) as m:
+                    m["bytes"] = self.journal.append(pending)
+            self.journal.flush()
+            return True
+        except Exception:
+            return False
+
+    def flush_autosave(self):
+        # Write everything out now and wait for it (used on shutdown)
+        if self._autosave_after_id is not None:
             try:
-                self._load_from_path(AUTOSAVE_PATH)
-                self._set_status("โหลดข้อมูลจาก last_session.csv แล้ว")
-                return
+                self.after_cancel(self._autosave_after_id)
             except Exception:
                 pass
+            self._autosave_fire()
+        elif self.journal is not None:
+            self.autosave()
+        self.autosave_writer.flush()
+        self.session_cache_writer.flush()
+        if self.journal is not None:
+            self.journal.close()
+
+    def _journal_model_change(self, kind, rids, info):
+        if self.journal is None or self._import is not None:
+            return
+        if kind == "reset":
+            # records for the old table are meaningless now; loaders call _journal_reset()
+            self._journal_pending = []
+        elif kind == "insert":
+            self._journal_pending.append({"op": "ins", "i": info, "rows": self.model.rows(rids)})
+        elif kind == "delete":
+            self._journal_pending.append({"op": "del", "i": sorted(info, reverse=True)})
+        elif kind == "update":
+            cols = sorted(info)
+            for rid in rids:
+                self._journal_pending.append({
+                    "op": "set",
+                    "i": self.model.position(rid),
+                    "v": {str(c): self.model.get(rid, c) for c in cols},
+                })
+
+    def _journal_reset(self):
+        # Whole table replaced: drop pending records and compact straight away
+        if self.journal is None:
+            return
+        self._journal_pending = []
+        self.journal.compact(self._table_rows())
+
+    def _load_autosave_or_init(self):
+        if isinstance(self.journal, SessionStore) and self.journal.has_baseline():
+            if self._start_import(SESSION_DB_PATH, self._after_session_load, cancellable=False,
+                                  reader=SessionStoreImport):
+                return
+        elif os.path.exists(AUTOSAVE_PATH):
+            # also the way into a new SQLite store: the CSV session is copied over once loaded
+            # the session itself cannot be cancelled: there is no earlier table to go back to
+            if self._start_import(AUTOSAVE_PATH, self._after_session_load, cancellable=False,
+                                  reader=SessionCacheImport):
+                return
+        self._init_empty_session()
+        self._record_scan_ready()
+
+    def _init_empty_session(self):
         self.add_row()
-        self.autosave()
+        if self.journal is not None:
+            self._journal_reset()
+        else:
+            self.autosave()
+
+    def _record_scan_ready(self):
+        # time to first scan: from process start until queued scans can be applied
+        if self._scan_ready:
+            return
+        self._scan_ready = True
+        self._record_op("time_to_first_scan", time.perf_counter() - PROCESS_STARTED, rows=len(self.model),
+                        queued=len(self._scan_queue) or None)
+
+    def _after_session_load(self, error, cancelled):
+        if error is not None:
+            self._init_empty_session()
+            self._record_scan_ready()
+            return
+        recovered = 0
+        rebuilt = False
+        if self.journal is not None:
+            records = self.journal.unapplied_records()
+            if records:
+                rows = self.model.rows()
+                for rec in records:
+                    self.journal.apply(rows, rec)
+                self.model.load(rows)
+                recovered = len(records)
+            if recovered or self._autosave_deferred or not self.journal.has_baseline():
+                # fold recovered records (and edits made while loading) into a fresh snapshot
+                self._journal_reset()
+                rebuilt = True
+        elif self._autosave_deferred:
+            self.autosave()
+            rebuilt = True
+        if not rebuilt and not isinstance(self.journal, SessionStore) and not session_cache_valid(AUTOSAVE_PATH):
+            # parsed from CSV: leave a binary copy for the next start
+            self.session_cache_writer.submit((self._table_rows(), _file_fingerprint(AUTOSAVE_PATH)))
+        self._record_scan_ready()
+        if recovered:
+            self._set_status(f"กู้คืนการแก้ไขล่าสุด {recovered} รายการจาก journal แล้ว" + self._duplicate_note())
+        else:
+            name = os.path.basename(SESSION_DB_PATH if isinstance(self.journal, SessionStore) else AUTOSAVE_PATH)
+            self._set_status(f"โหลดข้อมูลจาก {name} แล้ว" + self._duplicate_note())
+
+    # ---------- Streaming import ----------
+    def _start_import(self, path: str, on_done, cancellable=True, reader=SheetImport):
+        # Load path into the table in batches; on_done(error, cancelled) runs at the end.
+        # A cancelled or failed import puts the previous table back.
+        if self._import is not None or self._merge is not None:
+            self._set_status("กำลังโหลดไฟล์อื่นอยู่ กรุณารอสักครู่")
+            return False
+        try:
+            imp = reader(path)
+        except Exception as e:
+            on_done(e, False)
+            return False
+        self._import_previous = self.model.rows() if cancellable else None
+        self._import_on_done = on_done
+        self._autosave_deferred = False
+        self._import = imp
+        self._import_started = time.perf_counter()
+        self.model.load([])
+        if cancellable:
+            self.import_cancel_button.pack(side=tk.RIGHT, padx=2)
+        imp.start()
+        self.after(IMPORT_POLL_MS, self._poll_import)
+        return True
+
+    def _poll_import(self):
+        imp = self._import
+        if imp is None:
+            return
+        if imp.snapshot is not None:
+            snapshot, imp.snapshot = imp.snapshot, None
+            self.model.load_snapshot(snapshot, getattr(imp, "barcodes", None))
+        rows = imp.take(IMPORT_ROWS_PER_TICK)
+        if rows:
+            self.model.append_rows(rows)
+        if imp.error is not None:
+            self._finish_import(error=imp.error)
+            return
+        if imp.done():
+            self._finish_import()
+            return
+        name = os.path.basename(imp.path)
+        if imp.total_bytes:
+            pct = min(100, int(imp.bytes_read * 100 / imp.total_bytes))
+            self._set_status(
+                f"กำลังโหลด {name}: {len(self.model):,} แถว "
+                f"({imp.bytes_read / 1048576:.1f}/{imp.total_bytes / 1048576:.1f} MB, {pct}%)"
+            )
+        else:
+            self._set_status(f"กำลังโหลด {name}: {len(self.model):,} แถว")
+        self.after(IMPORT_POLL_MS, self._poll_import)
+
+    def cancel_import(self):
+        if self._merge is not None:
+            self._merge.cancel()
+            return
+        if self._import is None or self._import_previous is None:
+            return
+        self._import.cancel()
+        self._finish_import(cancelled=True)
+
+    def _finish_import(self, error=None, cancelled=False):
+        imp, self._import = self._import, None
+        self._record_op("import", time.perf_counter() - self._import_started, rows=len(self.model),
+                        bytes=imp.bytes_read, file=os.path.basename(imp.path),
+                        cache=getattr(imp, "from_cache", None) or None,
+                        error=str(error) if error is not None else None, cancelled=cancelled or None)
+        previous, self._import_previous = self._import_previous, None
+        on_done, self._import_on_done = self._import_on_done, None
+        self.import_cancel_button.pack_forget()
+        if (error is not None or cancelled) and previous is not None:
+            self.model.load(previous)
+        if self.tree.filtered():
+            self._schedule_filter()
+        if on_done is not None:
+            on_done(error, cancelled)
+
+    def _on_close(self):
+        try:
+            self.stop_scan_server()
+            self.flush_autosave()
+        except Exception:
+            pass
+        self.archive.close()
+        self.scan_events.close()
+        self.destroy()
 
     # ---------- Data Ops ----------
-    def add_row(self):
+    @staticmethod
+    def _new_row_values():
         values = [""] * len(COLUMNS)
         values[0] = datetime.datetime.now().strftime("%Y-%m")
-        self.tree.insert("", "end", values=values)
+        return values
+
+    def add_row(self):
+        self.model.append_rows([self._new_row_values()])
         self._set_status("เพิ่มแถวใหม่แล้ว")
 
     def add_row_and_save(self):
@@ -260,12 +3955,11 @@ class App(tk.Tk):
         self.autosave()
 
     def delete_selected(self):
-        sel = self.tree.selection()
+        sel = self.tree.selected_rids()
         if not sel:
             self._set_status("ยังไม่ได้เลือกแถว")
             return
-        for iid in sel:
-            self.tree.delete(iid)
+        self.model.delete(sel)
         self._set_status(f"ลบ {len(sel)} แถวแล้ว")
 
     def delete_selected_and_save(self):
@@ -276,23 +3970,129 @@ class App(tk.Tk):
         path = filedialog.askopenfilename(title="เลือกไฟล์ CSV", filetypes=[("CSV files", "*.csv")])
         if not path:
             return
-        try:
-            self._load_from_path(path)
+        self._start_import(path, lambda error, cancelled: self._after_load_csv(path, error, cancelled))
+
+    def _after_load_csv(self, path, error, cancelled):
+        if error is not None:
+            self._set_status(f"โหลด {os.path.basename(path)} ไม่สำเร็จ")
+            messagebox.showerror("ผิดพลาด", str(error))
+            return
+        if cancelled:
+            self._set_status(f"ยกเลิกการโหลด {os.path.basename(path)} แล้ว (คืนข้อมูลเดิม)")
+            return
+        if self.journal is not None:
+            self._journal_reset()
+        else:
             self.autosave()
-            self._set_status(f"โหลดข้อมูลจาก {os.path.basename(path)} แล้ว")
-        except Exception as e:
-            messagebox.showerror("ผิดพลาด", str(e))
+        self._set_status(f"โหลดข้อมูลจาก {os.path.basename(path)} แล้ว" + self._duplicate_note())
 
     def _load_from_path(self, path: str):
-        with open(path, newline="", encoding="utf-8-sig") as f:
-            reader = csv.DictReader(f)
-            missing = [c for c in COLUMNS if c not in reader.fieldnames]
-            if missing:
-                raise ValueError("คอลัมน์หายไป: " + ", ".join(missing))
-            for iid in self.tree.get_children():
-                self.tree.delete(iid)
-            for row in reader:
-                self.tree.insert("", "end", values=[row.get(c, "") for c in COLUMNS])
+        with self._timed("load", bytes=os.path.getsize(path)) as m:
+            self.model.load(read_sheet_csv(path))
+            m["rows"] = len(self.model)
+
+    def _table_rows(self):
+        return self.model.rows()
+
+    # ---------- Merge import ----------
+    def merge_csv_files(self):
+        if self._import is not None or self._merge is not None:
+            self._set_status("กำลังโหลดไฟล์อยู่ กรุณารอสักครู่")
+            return
+        paths = filedialog.askopenfilenames(title="เลือกไฟล์ CSV ที่จะรวมเข้าตาราง", filetypes=[("CSV files", "*.csv")])
+        if not paths:
+            return
+        rules = self._ask_merge_rules()
+        if rules is None:
+            return
+        self._start_merge(list(paths), rules)
+
+    def _ask_merge_rules(self):
+        # Small modal dialog for the conflict rules; None when cancelled
+        current = merge_rules(self.settings.get("merge_rules"))
+        win = tk.Toplevel(self)
+        win.title("กติกาการรวมไฟล์")
+        win.transient(self)
+        fields = (("qty", "จำนวน (ชิ้น)", {"sum": "รวมจำนวน", "overwrite": "ใช้ค่าจากไฟล์", "keep": "คงค่าเดิม"}),
+                  ("price", "ราคา/ค่าส่ง", {"overwrite": "ใช้ค่าจากไฟล์", "keep": "คงค่าเดิม"}),
+                  ("scan", "Scan", {"keep": "คงเวลาสแกนเดิม", "overwrite": "ใช้ค่าจากไฟล์"}))
+        variables = {}
+        for row, (group, title, choices) in enumerate(fields):
+            ttk.Label(win, text=title).grid(row=row, column=0, sticky="w", padx=6, pady=4)
+            var = tk.StringVar(value=choices[current[group]])
+            ttk.Combobox(win, width=18, state="readonly", values=list(choices.values()),
+                         textvariable=var).grid(row=row, column=1, padx=6, pady=4)
+            variables[group] = (var, {label: choice for choice, label in choices.items()})
+        result = {}
+
+        def ok():
+            result.update((group, labels[var.get()]) for group, (var, labels) in variables.items())
+            win.destroy()
+
+        ttk.Button(win, text="รวมไฟล์", command=ok).grid(row=len(fields), column=0, padx=6, pady=6)
+        ttk.Button(win, text="ยกเลิก", command=win.destroy).grid(row=len(fields), column=1, padx=6, pady=6)
+        win.grab_set()
+        self.wait_window(win)
+        if not result:
+            return None
+        self.settings["merge_rules"] = result
+        self._save_settings()
+        return result
+
+    def _start_merge(self, paths, rules):
+        self._merge = SheetMerge.from_model(self.model, paths, rules).start()
+        self._merge_dirty = False
+        self._merge_started = time.perf_counter()
+        self.import_cancel_button.pack(side=tk.RIGHT, padx=2)
+        self.after(IMPORT_POLL_MS, self._poll_merge)
+
+    def _on_model_change_merge(self, kind, rids, info):
+        # the merge works on a snapshot; any change meanwhile means it has to run again
+        if self._merge is not None:
+            self._merge_dirty = True
+
+    def _poll_merge(self):
+        job = self._merge
+        if job is None:
+            return
+        if not job.finished:
+            mb = f" ({job.bytes_read / 1048576:.1f}/{job.total_bytes / 1048576:.1f} MB)" if job.total_bytes else ""
+            self._set_status(f"กำลังรวม {len(job.paths):,} ไฟล์: อ่านแล้ว {job.rows_read:,} แถว" + mb)
+            self.after(100, self._poll_merge)
+            return
+        self._merge = None
+        self.import_cancel_button.pack_forget()
+        if job.cancelled():
+            self._set_status("ยกเลิกการรวมไฟล์แล้ว (ตารางไม่เปลี่ยน)")
+            return
+        if job.error is not None:
+            self._set_status("รวมไฟล์ไม่สำเร็จ")
+            messagebox.showerror("ผิดพลาด", str(job.error))
+            return
+        if self._merge_dirty:
+            self._set_status("ตารางถูกแก้ไขระหว่างรวมไฟล์ กำลังรวมใหม่...")
+            self._start_merge(job.paths, job.rules)
+            return
+        updated, added = job.apply(self.model)
+        if added and self.settings.get("auto_recalc", True):
+            self.model.recalc(added)  # edited rows are recalculated by _on_model_change_recalc
+        counts = job.counts()
+        self._record_op("merge", time.perf_counter() - self._merge_started, rows=counts["rows_read"],
+                        bytes=job.bytes_read, files=len(job.paths), added=counts["added"],
+                        updated=counts["updated"], conflicts=counts["conflicts"])
+        self.autosave()
+        summary = (f"รวม {len(job.paths):,} ไฟล์ ({counts['rows_read']:,} แถว): เพิ่ม {counts['added']:,} แถว, "
+                   f"แก้ไข {counts['updated']:,} แถว, ขัดแย้ง {counts['conflicts']:,} แถว")
+        self._set_status(summary + self._duplicate_note())
+        if job.report and messagebox.askyesno("รายงานการรวมไฟล์", summary + "\n\nบันทึกรายงานความแตกต่างเป็น CSV?"):
+            path = filedialog.asksaveasfilename(title="บันทึกรายงานการรวมไฟล์", defaultextension=".csv",
+                                                filetypes=[("CSV files", "*.csv")])
+            if path:
+                try:
+                    write_merge_report(path, job.report)
+                    self._set_status(f"บันทึกรายงานไปที่ {os.path.basename(path)} แล้ว")
+                except Exception as e:
+                    messagebox.showerror("ผิดพลาด", str(e))
 
     def save_csv(self):
         path = filedialog.asksaveasfilename(title="บันทึกเป็น CSV", defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
@@ -305,157 +4105,345 @@ class App(tk.Tk):
             messagebox.showerror("ผิดพลาด", str(e))
 
     def _save_to_path(self, path: str):
-        with open(path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=COLUMNS)
-            writer.writeheader()
-            for iid in self.tree.get_children():
-                values = self.tree.item(iid, "values")
-                row = {col: values[idx] for idx, col in enumerate(COLUMNS)}
-                writer.writerow(row)
+        with self._timed("save", rows=len(self.model)) as m:
+            write_sheet_csv(path, self._table_rows())
+            m["bytes"] = os.path.getsize(path)
+
+    def _duplicate_note(self):
+        dupes = self.model.duplicate_barcodes()
+        if not dupes:
+            return ""
+        return f" (พบบาร์โค้ดซ้ำ {len(dupes)} รายการ)"
 
     # ---------- Paste ----------
+    def _on_paste_key(self, event):
+        # Ctrl+V inside the scan box or a cell editor pastes text there, not into the table
+        if isinstance(event.widget, (tk.Entry, ttk.Entry)):
+            return
+        self.paste_from_clipboard()
+
     def paste_from_clipboard(self):
         try:
             raw = self.clipboard_get()
         except Exception:
             self._set_status("ไม่มีข้อมูลในคลิปบอร์ด")
             return
-        rows = [r for r in raw.splitlines() if r.strip() != ""]
-        data = [r.split("\t") for r in rows]
+        data = parse_clipboard_table(raw)
         if not data:
             self._set_status("รูปแบบข้อมูลว่าง")
             return
         col_id, row_id = self.tree.last_anchor
-        if not row_id:
-            kids = self.tree.get_children()
-            if kids:
-                row_id = kids[0]
-            else:
+        if row_id is None or row_id not in self.model:
+            if not len(self.model):
                 self.add_row()
-                kids = self.tree.get_children()
-                row_id = kids[0]
+            row_id = self.model.rid_at(0)
             col_id = "#1"
-        start_row_index = list(self.tree.get_children()).index(row_id)
+        start_row_index = self.model.position(row_id)
         start_col_index = int(col_id[1:]) - 1
-        needed_rows = start_row_index + len(data) - len(self.tree.get_children())
-        for _ in range(max(0, needed_rows)):
-            self.add_row()
-        all_iids = list(self.tree.get_children())
-        for r, row_vals in enumerate(data):
-            iid = all_iids[start_row_index + r]
-            cur = list(self.tree.item(iid, "values"))
-            for c, val in enumerate(row_vals):
-                idx = start_col_index + c
-                if 0 <= idx < len(COLUMNS) and COLUMNS[idx] != "Scan":
-                    cur[idx] = val
-            self.tree.item(iid, values=cur)
-        self._set_status(f"วางข้อมูลจาก Excel {len(data)} แถวแล้ว")
+        # ไม่เขียนทับคอลัมน์ Scan; แถวที่เกินท้ายตารางจะถูกเพิ่มในครั้งเดียว
+        with self._timed("paste", rows=len(data)):
+            _, added = self.model.paste_block(start_row_index, start_col_index, data, self._new_row_values())
+            # appended rows arrive as one "insert", which _on_model_change_recalc leaves alone
+            span = max(len(r) for r in data)
+            pasted_inputs = any(start_col_index <= col < start_col_index + span for col in COST_INPUT_COLUMNS)
+            result = None
+            if added and pasted_inputs and self.settings.get("auto_recalc", True):
+                result = self.model.recalc(added)
+        note = ""
+        if result is not None and result.errors:
+            note = " คำนวณต้นทุนไม่ได้" + self._recalc_error_note(result)
+        self._set_status(f"วางข้อมูลจาก Excel {len(data)} แถวแล้ว" + note + self._duplicate_note())
         self.autosave()
 
-    # ---------- Barcode Gen/Scan ----------
-    def _random_code(self, length=10):
-        alphabet = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
-        return "".join(random.choice(alphabet) for _ in range(length))
+    # ---------- Filter ----------
+    def _filter_active(self):
+        return bool(self.filter_var.get().strip()) or self.filter_scan_var.get() != FILTER_SCAN_CHOICES[0]
+
+    def _schedule_filter(self):
+        if self._filter_after_id is None:
+            self._filter_after_id = self.after_idle(self._apply_filter)
+
+    def _on_model_change_filter(self, kind, rids, info):
+        # keep the filtered view in step with loads, pastes, edits and scans
+        if not self.tree.filtered():
+            return
+        if kind == "update" and info.isdisjoint(SEARCH_COLUMNS):
+            # a scan only moves rows in or out when filtering on the Scan state
+            if SCAN_COL not in info or self.filter_scan_var.get() == FILTER_SCAN_CHOICES[0]:
+                return
+        self._schedule_filter()
+
+    def _apply_filter(self):
+        self._filter_after_id = None
+        if self._import is not None:
+            return  # _finish_import runs it again
+        if not self._filter_active():
+            self._filter_key = None
+            if self.tree.filtered():
+                self.tree.set_filter(None)
+                self._set_status(f"แสดงทั้งหมด {len(self.model):,} แถว")
+            return
+        query = self.filter_var.get()
+        key = (query, self.filter_scan_var.get())
+        keep_position = key == self._filter_key and self.tree.filtered()
+        self._filter_key = key
+        order = self.model.rids()
+        if query.strip():
+            found = self.search.matches(query)
+            if len(found) * 8 < len(order):
+                rids = sorted(found, key=self.model.position)
+            else:
+                rids = [rid for rid in order if rid in found]
+        else:
+            rids = order
+        scan_choice = self.filter_scan_var.get()
+        if scan_choice != FILTER_SCAN_CHOICES[0]:
+            want = scan_choice == FILTER_SCAN_CHOICES[1]
+            rids = [rid for rid in rids if bool(self.model.get(rid, SCAN_COL).strip()) == want]
+        self.tree.set_filter(rids, keep_position=keep_position)
+        self._set_status(f"กรองแล้ว: พบ {len(rids):,} จาก {len(self.model):,} แถว")
+
+    # ---------- Cost summary ----------
+    SUMMARY_FIELDS = (("rows", "แถว"), ("qty", "จำนวน (ชิ้น)"), ("cost", "ต้นทุนรวม (บาท)"),
+                      ("avg", "ต้นทุนเฉลี่ยต่อตัว (บาท)"), ("scanned", "สแกนแล้ว"), ("unscanned", "ยังไม่สแกน"))
+
+    @staticmethod
+    def _summary_values(line):
+        _, _, rows, qty, cost, avg, scanned, unscanned = line
+        qty_text = f"{qty:,.0f}" if float(qty).is_integer() else f"{qty:,.2f}"
+        return [f"{rows:,}", qty_text, f"{cost:,.2f}", f"{avg:,.2f}", f"{scanned:,}", f"{unscanned:,}"]
+
+    def show_cost_summary(self):
+        # Live totals per รอบเดือน (SKUs underneath), redrawn while the window is open
+        if self._summary_win is not None:
+            self._summary_win.lift()
+            return
+        win = self._summary_win = tk.Toplevel(self)
+        win.title("สรุปต้นทุนตามรอบเดือน / SKU")
+        win.geometry("900x480")
+        tree = ttk.Treeview(win, columns=[f for f, _ in self.SUMMARY_FIELDS], height=18)
+        tree.heading("#0", text="รอบเดือน / ชื่อSKU")
+        tree.column("#0", width=200)
+        for field, title in self.SUMMARY_FIELDS:
+            tree.heading(field, text=title)
+            tree.column(field, width=110, anchor="e")
+        vsb = ttk.Scrollbar(win, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=vsb.set)
+        buttons = tk.Frame(win, bg="#c0c0c0")
+        buttons.pack(side=tk.BOTTOM, fill=tk.X)
+        ttk.Button(buttons, text="Export CSV", command=self.export_cost_summary).pack(side=tk.LEFT, padx=6, pady=6)
+        ttk.Button(buttons, text="ปิด", command=self._close_cost_summary).pack(side=tk.RIGHT, padx=6, pady=6)
+        vsb.pack(side=tk.RIGHT, fill=tk.Y)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        # fires just before the item opens: draw its SKUs once it has
+        tree.bind("<<TreeviewOpen>>", lambda e: self.after_idle(self._draw_cost_summary))
+        win.protocol("WM_DELETE_WINDOW", self._close_cost_summary)
+        self._summary_tree = tree
+        self._summary_version = None
+        self._poll_cost_summary()
+
+    def _close_cost_summary(self):
+        if self._summary_win is not None:
+            self._summary_win.destroy()
+            self._summary_win = None
+
+    def _poll_cost_summary(self):
+        if self._summary_win is None:
+            return
+        if self.summary.version != self._summary_version:
+            self._draw_cost_summary()
+        self._summary_win.after(500, self._poll_cost_summary)
+
+    def _draw_cost_summary(self):
+        if self._summary_win is None:
+            return
+        self._summary_version = self.summary.version
+        tree = self._summary_tree
+        opened = {iid for iid in tree.get_children() if tree.item(iid, "open")}
+        top = tree.yview()[0]
+        tree.delete(*tree.get_children())
+        for line in self.summary.report():
+            month, sku = line[0], line[1]
+            parent = f"m:{month}"
+            if sku is None:
+                tree.insert("", tk.END, iid=parent, text=month or "(ไม่ระบุ)", values=self._summary_values(line),
+                            open=parent in opened)
+                if parent not in opened:
+                    tree.insert(parent, tk.END, text="...")  # expander; SKUs drawn once opened
+            elif parent in opened:
+                tree.insert(parent, tk.END, text=sku or "(ไม่ระบุ)", values=self._summary_values(line))
+        tree.yview_moveto(top)
+
+    def export_cost_summary(self):
+        path = filedialog.asksaveasfilename(title="บันทึกสรุปต้นทุน", defaultextension=".csv",
+                                            filetypes=[("CSV files", "*.csv")])
+        if not path:
+            return
+        try:
+            with open(path, "w", newline="", encoding="utf-8-sig") as f:
+                writer = csv.writer(f)
+                writer.writerow(["รอบเดือน", "ชื่อSKU"] + [title for _, title in self.SUMMARY_FIELDS])
+                for line in self.summary.report():
+                    month, sku, rows, qty, cost, avg, scanned, unscanned = line
+                    writer.writerow([month, "(รวมทั้งเดือน)" if sku is None else sku, rows, qty,
+                                     f"{cost:.2f}", f"{avg:.2f}", scanned, unscanned])
+            self._set_status(f"บันทึกสรุปต้นทุนไปที่ {os.path.basename(path)} แล้ว")
+        except Exception as e:
+            messagebox.showerror("ผิดพลาด", str(e))
+
+    # ---------- Month archive ----------
+    def close_old_months(self):
+        # Move every รอบเดือน before the current one out of the session into archive/
+        if self._import is not None or self._merge is not None:
+            self._set_status("กำลังโหลดไฟล์อยู่ กรุณารอสักครู่")
+            return
+        current = datetime.datetime.now().strftime("%Y-%m")
+        rids = self.model.rids()
+        old = [rid for rid, month in zip(rids, self.model.column(0)) if month and month < current]
+        if not old:
+            self._set_status("ไม่มีรอบเดือนเก่าให้ปิด")
+            return
+        if not messagebox.askyesno("ปิดเดือนเก่า", f"ย้าย {len(old):,} แถวของรอบเดือนก่อน {current} ไปเก็บในคลัง?"):
+            return
+        try:
+            with self._timed("close_months", rows=len(old)):
+                months = self.archive.close_months(self.model.rows(old))
+        except Exception as e:
+            messagebox.showerror("ผิดพลาด", str(e))
+            return
+        gone = set(old)
+        self.model.load(self.model.rows([rid for rid in rids if rid not in gone]))
+        if not len(self.model):
+            self.add_row()
+        if self.journal is not None:
+            self._journal_reset()
+        else:
+            self.autosave()
+        self._set_status(f"ปิดรอบเดือน {', '.join(months)} แล้ว (ย้าย {len(old):,} แถวไปคลัง)")
+
+    def reopen_month(self, month):
+        # a cancelled import would put the previous table back and drop the reopened rows
+        if self._import is not None or self._merge is not None:
+            self._set_status("กำลังโหลดไฟล์อยู่ กรุณารอสักครู่")
+            return
+        try:
+            rows = self.archive.read_month(month)
+        except Exception as e:
+            messagebox.showerror("ผิดพลาด", str(e))
+            return
+        self.model.append_rows(rows)
+        if not self._save_now():
+            messagebox.showerror("ผิดพลาด", f"บันทึกแถวของรอบเดือน {month} ไม่สำเร็จ เดือนนี้ยังเก็บอยู่ในคลัง")
+            return
+        try:
+            self.archive.drop_month(month)
+        except Exception as e:
+            messagebox.showerror("ผิดพลาด", str(e))
+            return
+        self._set_status(f"เปิดรอบเดือน {month} แล้ว ({len(rows):,} แถว)" + self._duplicate_note())
+
+    def show_month_archive(self):
+        win = tk.Toplevel(self)
+        win.title("คลังรอบเดือน")
+        fields = (("rows", "แถว"), ("scanned", "สแกนแล้ว"), ("qty", "จำนวน (ชิ้น)"),
+                  ("total_cost", "ต้นทุนรวม (บาท)"), ("closed_at", "ปิดเมื่อ"))
+        tree = ttk.Treeview(win, columns=[f for f, _ in fields], selectmode="browse", height=12)
+        tree.heading("#0", text="รอบเดือน")
+        for field, title in fields:
+            tree.heading(field, text=title)
+            tree.column(field, width=120, anchor="e" if field != "closed_at" else "w")
+        for month, summary in sorted(self.archive.summaries().items(), reverse=True):
+            tree.insert("", tk.END, iid=month, text=month, values=[
+                f"{summary.get('rows', 0):,}", f"{summary.get('scanned', 0):,}",
+                f"{summary.get('qty', 0):,.0f}", f"{summary.get('total_cost', 0):,.2f}",
+                summary.get("closed_at", "")])
+        tree.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=6, pady=6)
+
+        def reopen():
+            sel = tree.selection()
+            if sel:
+                win.destroy()
+                self.reopen_month(sel[0])
 
+        ttk.Button(win, text="เปิดเดือนนี้กลับมาแก้ไข", command=reopen).pack(side=tk.LEFT, padx=6, pady=6)
+        ttk.Button(win, text="ปิด", command=win.destroy).pack(side=tk.RIGHT, padx=6, pady=6)
+
+    # ---------- Barcode Gen/Scan ----------
     def generate_barcode_for_selected_or_empty(self):
-        sel = self.tree.selection()
-        count = 0
-        targets = sel if sel else self.tree.get_children()
-        for iid in targets:
-            values = list(self.tree.item(iid, "values"))
-            barcode_idx = COLUMNS.index("Barcode")
-            if values[barcode_idx] and not sel:
-                continue
-            sku = values[COLUMNS.index("ชื่อSKU")] or values[COLUMNS.index("หมายเลขรายการ")]
-            prefix = (sku or "ITEM").replace(" ", "").upper()
-            code_core = datetime.datetime.now().strftime("%Y%m") + "-" + self._random_code(6)
-            gen_code = f"{prefix}-{code_core}"
-            values[barcode_idx] = gen_code
-            self.tree.item(iid, values=values)
-            count += 1
-        self._set_status(f"สร้างบาร์โค้ด {count} รายการแล้ว")
+        # selected rows always get a new code, otherwise only rows without one
+        sel = self.tree.selected_rids()
+        with self._timed("generate_barcodes", mode=self._barcode_mode()) as m:
+            result = self.model.assign_barcodes(sel or None, overwrite=bool(sel), mode=self._barcode_mode(),
+                                                reserved=self.archive.codes())
+            m["rows"] = result.generated
+        note = f" (ข้าม {result.skipped:,} แถวที่มีบาร์โค้ดแล้ว)" if result.skipped else ""
+        self._set_status(f"สร้างบาร์โค้ด {result.generated:,} รายการแล้ว" + note + self._duplicate_note())
+
+    def _barcode_mode(self):
+        mode = self.settings.get("barcode_mode", "random")
+        return mode if mode in BARCODE_MODES else "random"
+
+    def _on_barcode_mode_change(self):
+        self.settings["barcode_mode"] = "sequence" if self.barcode_sequence.get() else "random"
+        self._save_settings()
 
     def generate_barcode_for_selected_or_empty_and_save(self):
         self.generate_barcode_for_selected_or_empty()
         self.autosave()
 
     def process_scan(self):
-        data = self.scan_entry.get().strip()
-        if not data:
-            self._set_status("ไม่มีข้อมูลที่สแกน")
-            self.scan_var.set("")
-            self._maybe_focus_scan()
-            return
-        barcode_idx = COLUMNS.index("Barcode")
-        scan_idx = COLUMNS.index("Scan")
-        # ค้นหาแถวที่ barcode ตรงกับที่สแกน
-        for iid in self.tree.get_children():
-            values = list(self.tree.item(iid, "values"))
-            if str(values[barcode_idx]).strip() == data:
-                # ถ้าเคยสแกนแล้ว ให้เตือนและไม่เขียนทับ
-                if str(values[scan_idx]).strip():
-                    messagebox.showwarning("แจ้งเตือน", "สแกนไปแล้ว")
-                    self._set_status(f"สแกนซ้ำ: {data}")
-                    self._maybe_focus_scan()
-                    return
-                # ใส่เวลาที่มนุษย์อ่านได้แทนคำว่า pass
-                ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                values[scan_idx] = ts
-                self.tree.item(iid, values=values)
-                self._set_status(f"สแกนสำเร็จ: {data} @ {ts}")
-                self.scan_var.set("")
-                self._maybe_focus_scan()
-                return
-        # ถ้าไม่พบบาร์โค้ดในตาราง
-        messagebox.showwarning("ไม่พบ", f"ไม่พบบาร์โค้ด: {data}")
-        self._set_status("ไม่พบบาร์โค้ดในตาราง")
+        self._queue_scan(self._scan_assembler.terminate(self.scan_entry.get()))
         self.scan_var.set("")
         self._maybe_focus_scan()
-        return
 
     def process_scan_and_save(self):
+        # autosave happens once per processed batch
         self.process_scan()
-        self.autosave()
 
     def _maybe_focus_scan(self):
         if self.auto_scan.get():
             self.scan_entry.focus_set()
 
     def recalc_all(self):
-        n = 0
-        for iid in self.tree.get_children():
-            if self._recalc_row(iid):
-                n += 1
-        self._set_status(f"คำนวณต้นทุนทั้งหมด {n} แถวแล้ว")
+        with self._timed("recalc", rows=len(self.model)):
+            result = self.model.recalc()
+        self._set_status(f"คำนวณต้นทุนทั้งหมด {result.computed:,} แถวแล้ว" + self._recalc_error_note(result))
 
     def recalc_all_and_save(self):
         self.recalc_all()
         self.autosave()
 
-    def _recalc_row(self, iid):
-        values = list(self.tree.item(iid, "values"))
-        try:
-            qty = float(values[COLUMNS.index("จำนวน (ชิ้น)")] or 0)
-            price = float(values[COLUMNS.index("ราคาสินค้าต่อหน่วย (บาท)")] or 0)
-            ship = float(values[COLUMNS.index("ค่าส่งรวม (บาท)")] or 0)
-        except ValueError:
-            return False
-        total_cost = qty * price + ship
-        unit_cost = total_cost / qty if qty else 0
-        values[COLUMNS.index("ต้นทุนรวม (บาท)")] = f"{total_cost:.2f}"
-        values[COLUMNS.index("ต้นทุนต่อตัว (บาท)")] = f"{unit_cost:.2f}"
-        self.tree.item(iid, values=values)
-        return True
+    def _recalc_row(self, rid):
+        return self.model.recalc([rid]).computed == 1
+
+    def _recalc_error_note(self, result):
+        if not result.errors:
+            return ""
+        rows = sorted({self.model.position(rid) + 1 for rid, _, _ in result.errors})
+        shown = ", ".join(str(n) for n in rows[:10]) + (" ..." if len(rows) > 10 else "")
+        return f" (ข้อมูลไม่ใช่ตัวเลข {len(rows):,} แถว: แถวที่ {shown})"
+
+    def _on_model_change_recalc(self, kind, rids, info):
+        # Incremental recalc: quantity/price/shipping edits recompute just those rows
+        if kind != "update" or not self.settings.get("auto_recalc", True):
+            return
+        if info.isdisjoint(COST_INPUT_COLUMNS):
+            return
+        result = self.model.recalc(rids)
+        if result.errors:
+            note = "คำนวณต้นทุนไม่ได้" + self._recalc_error_note(result)
+            # after the status message of the edit/paste that triggered this
+            self.after_idle(lambda: self._set_status(note))
 
     def clear_scan_selected(self):
-        sel = self.tree.selection()
+        sel = self.tree.selected_rids()
         if not sel:
             self._set_status("ยังไม่ได้เลือกแถว")
             return
-        for iid in sel:
-            values = list(self.tree.item(iid, "values"))
-            values[COLUMNS.index("Scan")] = ""
-            self.tree.item(iid, values=values)
+        now = time.time() * 1000
+        self._record_scan_events([(now, "clear", None, self.model.get(rid, BARCODE_COL).strip())
+                                  for rid in sel if self.model.get(rid, SCAN_COL)])
+        self.model.update_cells({rid: {SCAN_COL: ""} for rid in sel})
         self._set_status(f"เคลียร์ Scan ให้ {len(sel)} แถวแล้ว")
 
     def clear_scan_selected_and_save(self):
@@ -488,11 +4476,11 @@ class App(tk.Tk):
     def export_barcodes_png(self, selected_only=True):
         if not self._check_barcode_deps():
             return
-        import barcode  # type: ignore
-        from barcode.writer import ImageWriter  # type: ignore
+        if self._barcode_export is not None:
+            self._set_status("กำลังส่งออกบาร์โค้ดอยู่ กรุณารอสักครู่")
+            return
 
-        barcode_idx = COLUMNS.index("Barcode")
-        targets = self.tree.selection() if selected_only else self.tree.get_children()
+        targets = self.tree.selected_rids() if selected_only else self.model.rids()
         if not targets:
             self._set_status("ยังไม่ได้เลือกแถวสำหรับส่งออกบาร์โค้ด")
             return
@@ -510,22 +4498,37 @@ class App(tk.Tk):
             self._save_settings()
         except Exception:
             pass
-        count = 0
-        for iid in targets:
-            values = list(self.tree.item(iid, "values"))
-            data = str(values[barcode_idx]).strip()
-            if not data:
-                continue
-            try:
-                code = barcode.get("code128", data, writer=ImageWriter())
-                safe_name = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in data)
-                filepath = os.path.join(outdir, f"{safe_name}.png")
-                code.save(filepath, {"font_size": 12, "text_distance": 6, "module_height": 15})
-                count += 1
-            except Exception as e:
-                print("Barcode error:", e)
-                continue
-        self._set_status(f"ส่งออกบาร์โค้ดเป็น PNG {count} ไฟล์ ไปที่โฟลเดอร์ 'barcodes' แล้ว")
+        job = BarcodeExport([self.model.get(rid, BARCODE_COL).strip() for rid in targets], outdir)
+        if not job.total:
+            self._set_status("แถวที่เลือกยังไม่มีบาร์โค้ด")
+            return
+        self._barcode_export_started = time.perf_counter()
+        self._barcode_export = job.start()
+        self.after(100, self._poll_barcode_export)
+
+    def _poll_barcode_export(self):
+        job = self._barcode_export
+        if job is None:
+            return
+        if not job.finished:
+            self._set_status(f"กำลังส่งออกบาร์โค้ด {job.done_count:,}/{job.total:,} ไฟล์...")
+            self.after(100, self._poll_barcode_export)
+            return
+        self._barcode_export = None
+        count = job.rendered + job.reused
+        self._record_op("export_barcodes", time.perf_counter() - self._barcode_export_started,
+                        rows=count, rendered=job.rendered, failures=len(job.failures) or None)
+        summary = (f"ส่งออกบาร์โค้ดเป็น PNG {count:,} ไฟล์ ไปที่ {job.outdir} แล้ว "
+                   f"(สร้างใหม่ {job.rendered:,}, ใช้จากแคช {job.reused:,})")
+        if job.failures:
+            summary += f" ล้มเหลว {len(job.failures):,} ไฟล์"
+        self._set_status(summary)
+        if job.failures:
+            lines = [f"{data or '-'}: {msg}" for data, msg in job.failures[:20]]
+            if len(job.failures) > 20:
+                lines.append(f"... และอีก {len(job.failures) - 20:,} รายการ")
+            messagebox.showwarning("ส่งออกบาร์โค้ดไม่ครบ", summary + "\n\n" + "\n".join(lines))
+        outdir = job.outdir
         try:
             if sys.platform == "darwin":
                 os.system(f"open '{outdir}'")
@@ -537,41 +4540,304 @@ class App(tk.Tk):
             pass
 
     def print_selected_barcodes(self):
-        outdir = self._barcode_folder()
-        barcode_idx = COLUMNS.index("Barcode")
-        targets = self.tree.selection()
+        # One label sheet (PDF, N-up per settings "label_template") and one print job
+        if not self._check_barcode_deps():
+            return
+        if self._label_sheet is not None:
+            self._set_status("กำลังสร้างแผ่นฉลากอยู่ กรุณารอสักครู่")
+            return
+        targets = self.tree.selected_rids()
         if not targets:
             self._set_status("ยังไม่ได้เลือกแถวสำหรับพิมพ์บาร์โค้ด")
             return
-        files = []
-        for iid in targets:
-            values = list(self.tree.item(iid, "values"))
-            data = str(values[barcode_idx]).strip()
-            if not data:
-                continue
-            safe_name = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in data)
-            png_path = os.path.join(outdir, f"{safe_name}.png")
-            if os.path.exists(png_path):
-                files.append(png_path)
-        if not files:
-            self._set_status("ยังไม่มีไฟล์ PNG สำหรับแถวที่เลือก กรุณา Export ก่อน")
-            return
-        opened = 0
-        for fp in files:
+        labels = [(self.model.get(rid, BARCODE_COL).strip(), self.model.get(rid, COL["ชื่อSKU"]).strip(),
+                   self.model.get(rid, COL["ชื่อสินค้า"]).strip()) for rid in targets]
+        if not any(code for code, _, _ in labels):
+            self._set_status("แถวที่เลือกยังไม่มีบาร์โค้ด")
+            return
+        try:
+            path = new_label_sheet_path()
+        except OSError as e:
+            messagebox.showerror("ผิดพลาด", f"สร้างโฟลเดอร์แผ่นฉลากไม่สำเร็จ: {e}")
+            return
+        job = LabelSheet(labels, path, template=self._label_template())
+        self._label_sheet_started = time.perf_counter()
+        self._label_sheet = job.start()
+        self.after(100, self._poll_label_sheet)
+
+    def _label_template(self):
+        name = self.settings.get("label_template", LABEL_DEFAULT_TEMPLATE)
+        return name if name in LABEL_TEMPLATES else LABEL_DEFAULT_TEMPLATE
+
+    def _on_label_template_change(self, event=None):
+        self.settings["label_template"] = self.label_template_var.get()
+        self._save_settings()
+
+    def _poll_label_sheet(self):
+        job = self._label_sheet
+        if job is None:
+            return
+        if not job.finished:
+            self._set_status(f"กำลังสร้างแผ่นฉลาก {job.done_count:,}/{job.total:,} ดวง...")
+            self.after(100, self._poll_label_sheet)
+            return
+        self._label_sheet = None
+        size = os.path.getsize(job.path) if os.path.exists(job.path) else None
+        self._record_op("label_sheet", time.perf_counter() - self._label_sheet_started, rows=job.total,
+                        bytes=size, pages=job.pages, failures=len(job.failures) or None,
+                        error=str(job.error) if job.error is not None else None)
+        if job.error is not None:
+            messagebox.showerror("ผิดพลาด", f"สร้างแผ่นฉลากไม่สำเร็จ: {job.error}")
+            return
+        summary = f"ส่งพิมพ์ฉลาก {job.total - len(job.failures):,} ดวง ({job.pages:,} หน้า) เป็นงานพิมพ์เดียวแล้ว"
+        if job.failures:
+            summary += f" ล้มเหลว {len(job.failures):,} ดวง"
+        try:
+            print_document(job.path)
+        except Exception as e:
+            # no print command (or it refused): open the sheet once so it can be printed by hand
+            summary = f"พิมพ์โดยตรงไม่ได้ ({e}) เปิดแผ่นฉลาก {job.path} แทน"
             try:
-                if sys.platform == "darwin":
-                    os.system(f"open -a Preview '{fp}'")
-                elif os.name == "nt":
-                    os.startfile(fp, "print")  # type: ignore
+                if os.name == "nt":
+                    os.startfile(job.path)  # type: ignore
+                elif sys.platform == "darwin":
+                    os.system(f"open '{job.path}'")
                 else:
-                    os.system(f"xdg-open '{fp}'")
-                opened += 1
+                    os.system(f"xdg-open '{job.path}'")
             except Exception:
+                pass
+        self._set_status(summary)
+        if job.failures:
+            lines = [f"{data}: {msg}" for data, msg in job.failures[:20]]
+            messagebox.showwarning("สร้างฉลากไม่ครบ", summary + "\n\n" + "\n".join(lines))
+
+
+# ---------- Headless batch mode ----------
+def recalc_values(values):
+    # TableModel.recalc for a single streamed row (list of texts); False if an input
+    # is not a number
+    nums = []
+    for col in COST_INPUT_COLUMNS:
+        value, _ = _encode_number(values[col])
+        if value != value:
+            return False
+        nums.append(value)
+    qty, price, ship = nums
+    total_cost = qty * price + ship
+    unit_cost = total_cost / qty if qty else 0
+    values[TOTAL_COST_COL] = f"{total_cost:.2f}"
+    values[UNIT_COST_COL] = f"{unit_cost:.2f}"
+    return True
+
+
+def read_scan_log(path: str):
+    # Scanner log: one scan per line, "barcode" or "barcode<TAB>timestamp".
+    # Returns {barcode: [timestamp or None, ...]} in scan order.
+    scans = {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for line in f:
+            fields = line.rstrip("\r\n").split("\t")
+            code = fields[0].strip()
+            if not code:
                 continue
-        self._set_status(f"เปิดไฟล์ {opened} รายการเพื่อพิมพ์แล้ว")
+            ts = fields[1].strip() if len(fields) > 1 and fields[1].strip() else None
+            scans.setdefault(code, []).append(ts)
+    return scans
+
+
+def run_batch(sheet_path, out_path, scans_path=None, png_dir=None, generate=True, recalc=True,
+              barcode_mode="random", sample_limit=100):
+    # Stream sheet_path -> out_path row by row: recalc costs, fill empty barcodes and apply
+    # the scanner log with the scan-box rules. Memory is bounded by the number of
+    # distinct scanned barcodes, not by the sheet size: the barcodes new ones must not
+    # repeat live in a temporary SQLite file.
+    scans = read_scan_log(scans_path) if scans_path else {}
+    summary = {
+        "sheet": sheet_path, "output": out_path, "rows": 0,
+        "scans": sum(len(v) for v in scans.values()),
+        "scanned": 0, "duplicate": 0, "not_found": 0,
+        "generated": 0, "recalc_errors": 0, "errors": [],
+        "duplicate_codes": [], "not_found_codes": [],
+    }
+    seen_codes = set()  # scanned barcodes whose first row has been reached
+    used = codes_dir = None
+    png_chunk = []
+    png = {"rendered": 0, "reused": 0, "failed": 0, "failures": []}
+
+    def flush_png():
+        if not png_chunk:
+            return
+        job = BarcodeExport(png_chunk, png_dir)
+        job.run()
+        png["rendered"] += job.rendered
+        png["reused"] += job.reused
+        png["failed"] += len(job.failures)
+        room = sample_limit - len(png["failures"])
+        png["failures"].extend({"barcode": d, "error": m} for d, m in job.failures[:max(0, room)])
+        png_chunk.clear()
+
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    try:
+        if generate:
+            # first pass: every code already in the sheet, so a new one never repeats a
+            # code further down (plus the scanner log's codes)
+            import tempfile
+            codes_dir = tempfile.mkdtemp(prefix="batch-codes-")
+            used = BarcodeDiskSet(os.path.join(codes_dir, "codes.sqlite3"))
+            with open(sheet_path, newline="", encoding="utf-8-sig") as src:
+                reader = csv.reader(src)
+                header = next(reader, None) or []
+                if COLUMNS[BARCODE_COL] in header:  # otherwise the second pass reports it
+                    i = header.index(COLUMNS[BARCODE_COL])
+                    used.update(code for code in (rec[i].strip() for rec in reader if len(rec) > i) if code)
+            barcodes = BarcodeGenerator(scans, barcode_mode, used=used)
+        with open(sheet_path, newline="", encoding="utf-8-sig") as src, \
+                open(tmp_path, "w", newline="", encoding="utf-8") as dst:
+            writer = csv.writer(dst)
+            writer.writerow(COLUMNS)
+            for line_no, values in enumerate(iter_sheet_csv(src), start=2):
+                summary["rows"] += 1
+                if recalc and not recalc_values(values):
+                    summary["recalc_errors"] += 1
+                    if len(summary["errors"]) < sample_limit:
+                        nums = [(c, _encode_number(values[c])[0]) for c in COST_INPUT_COLUMNS]
+                        bad = [COLUMNS[c] for c, v in nums if v != v]
+                        summary["errors"].append({"line": line_no, "error": "not a number", "columns": bad})
+                code = values[BARCODE_COL].strip()
+                if not code and generate:
+                    prefix = barcode_prefix(values[COL["ชื่อSKU"]] or values[COL["หมายเลขรายการ"]])
+                    values[BARCODE_COL] = code = barcodes.next(prefix)
+                    summary["generated"] += 1
+                attempts = scans.get(code) if code else None
+                if attempts and code not in seen_codes:
+                    # first row with this barcode takes the scans, like process_scan
+                    seen_codes.add(code)
+                    if values[SCAN_COL].strip():
+                        dupes = len(attempts)
+                    else:
+                        values[SCAN_COL] = attempts[0] or datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                        summary["scanned"] += 1
+                        dupes = len(attempts) - 1
+                    if dupes:
+                        summary["duplicate"] += dupes
+                        if len(summary["duplicate_codes"]) < sample_limit:
+                            summary["duplicate_codes"].append(code)
+                writer.writerow(values)
+                if png_dir and code:
+                    png_chunk.append(code)
+                    if len(png_chunk) >= BATCH_PNG_CHUNK:
+                        flush_png()
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        if used is not None:
+            used.close()
+        if codes_dir is not None:
+            import shutil
+            shutil.rmtree(codes_dir, ignore_errors=True)
+    flush_png()
+    if png_dir:
+        # a long-running batch host may never open the window that prunes on startup
+        prune_barcode_cache()
+    for code, attempts in scans.items():
+        if code not in seen_codes:
+            summary["not_found"] += len(attempts)
+            if len(summary["not_found_codes"]) < sample_limit:
+                summary["not_found_codes"].append(code)
+    if png_dir:
+        summary["png"] = png
+    return summary
+
+
+def run_merge(sheet_path, sources, out_path, report_path=None, rules=None, recalc=True):
+    # Merge supplier CSVs into sheet_path (SheetMerge rules) and write the result to
+    # out_path, plus the diff report when report_path is given
+    model = TableModel()
+    model.load(read_sheet_csv(sheet_path))
+    job = SheetMerge.from_model(model, sources, rules)
+    job.run()
+    if job.error is not None:
+        raise job.error
+    updated, added = job.apply(model)
+    recalc_errors = len(model.recalc(updated + added).errors) if recalc else 0
+    write_sheet_csv(out_path, model.rows())
+    if report_path:
+        write_merge_report(report_path, job.report)
+    summary = {"sheet": sheet_path, "sources": list(sources), "output": out_path, "report": report_path,
+               "rules": job.rules, "rows": len(model), "recalc_errors": recalc_errors}
+    summary.update(job.counts())
+    return summary
+
+
+CLI_COMMANDS = ("batch", "merge")
+
+
+def cli_main(argv):
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(
+        prog="stock_cost_scanner",
+        description="Stock cost scanner (no arguments: open the window)",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    batch = sub.add_parser("batch", help="apply a scanner log to a sheet CSV without a display")
+    batch.add_argument("sheet", help="sheet CSV in the app's column layout")
+    batch.add_argument("-s", "--scans", help="scanner log: one barcode per line, optional <TAB>timestamp")
+    batch.add_argument("-o", "--out", required=True, help="result CSV (written atomically)")
+    batch.add_argument("--png-dir", help="also export barcode PNGs into this folder")
+    batch.add_argument("--summary", help="write the JSON summary here instead of stdout")
+    batch.add_argument("--no-generate", action="store_true", help="leave empty barcodes empty")
+    batch.add_argument("--barcode-mode", choices=BARCODE_MODES, default="random",
+                       help="new barcodes: random suffix or per-SKU sequence (default: %(default)s)")
+    batch.add_argument("--no-recalc", action="store_true", help="keep the cost columns as they are")
+    merge = sub.add_parser("merge", help="merge supplier CSVs into a sheet CSV (match on Barcode or month/item/SKU)")
+    merge.add_argument("sheet", help="sheet CSV in the app's column layout")
+    merge.add_argument("sources", nargs="+", help="supplier CSVs in the same layout, merged in order")
+    merge.add_argument("-o", "--out", required=True, help="result CSV (written atomically)")
+    merge.add_argument("--report", help="write the added/updated/conflict report CSV here")
+    merge.add_argument("--summary", help="write the JSON summary here instead of stdout")
+    for group, choices in MERGE_RULES.items():
+        merge.add_argument(f"--{group}", choices=choices, default=MERGE_DEFAULT_RULES[group],
+                           help=f"{group} rule (default: %(default)s)")
+    merge.add_argument("--no-recalc", action="store_true", help="keep the cost columns as they are")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "merge":
+            summary = run_merge(args.sheet, args.sources, args.out, report_path=args.report,
+                                rules={group: getattr(args, group) for group in MERGE_RULES},
+                                recalc=not args.no_recalc)
+        else:
+            summary = run_batch(args.sheet, args.out, scans_path=args.scans, png_dir=args.png_dir,
+                                generate=not args.no_generate, recalc=not args.no_recalc,
+                                barcode_mode=args.barcode_mode)
+        status = 0
+    except Exception as e:
+        summary = {"sheet": args.sheet, "fatal": f"{type(e).__name__}: {e}"}
+        status = 2
+    text = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    elif sys.stdout is not None:
+        print(text)
+    return status
 
 
 def main():
+    # the barcode export process pool re-imports this module in the packaged EXE
+    import multiprocessing
+    multiprocessing.freeze_support()
+    # only a subcommand goes to the CLI; anything else (a file dropped on the EXE,
+    # "Open with") still opens the window
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        sys.exit(cli_main(sys.argv[1:]))
     app = App()
     app.mainloop()
 
@@ -0,0 +1,67 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stock_cost_scanner as scs  # noqa: E402
+
+
+def make_row(month="2024-01", item="1001", sku="SKU-A", name="สินค้า", qty="2", price="10.50",
+             ship="3", barcode="", scan=""):
+    return [month, item, sku, name, qty, price, ship, "", "", barcode, scan]
+
+
+def random_rows(n, seed=1):
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        rows.append(make_row(
+            month=f"2024-{rnd.randint(1, 3):02d}",
+            item=str(1000 + i),
+            sku=rnd.choice(["SKU-A", "SKU-B", "sku-c", "Straße"]),
+            name=rnd.choice(["เสื้อ", "กางเกง", "Cap", "Bag"]) + str(rnd.randint(0, 9)),
+            qty=str(rnd.randint(0, 20)),
+            price=rnd.choice(["10", "10.50", "0.1", "abc", ""]),
+            ship=rnd.choice(["0", "5", "2.25"]),
+            barcode=rnd.choice(["", f"BC{i:05d}"]),
+            scan=rnd.choice(["", "2024-01-02 10:00:00"]),
+        ))
+    return rows
+
+
+def edit_randomly(model, rnd, steps):
+    # a mix of every kind of model change, for checking incrementally kept indexes
+    for _ in range(steps):
+        action = rnd.choice(["set", "insert", "delete", "paste", "scan", "recalc"])
+        rids = model.rids()
+        if action == "set" and rids:
+            rid = rnd.choice(rids)
+            col = rnd.choice([scs.ITEM_COL, scs.SKU_COL, scs.BARCODE_COL, scs.QTY_COL, 0, scs.TOTAL_COST_COL])
+            model.update_cells({rid: {col: rnd.choice(["", "ss", "X1", "5", "12.50", "2024-09"])}})
+        elif action == "insert":
+            model.insert_rows(rnd.randint(0, len(rids)), random_rows(rnd.randint(1, 4), rnd.random()))
+        elif action == "delete" and rids:
+            model.delete(rnd.sample(rids, min(len(rids), rnd.randint(1, 3))))
+        elif action == "paste":
+            model.paste_block(rnd.randint(0, len(rids)), scs.SKU_COL, [["SKU-Z", "Bag"], ["ß"]], make_row())
+        elif action == "scan" and rids:
+            model.apply_scan(model.get(rnd.choice(rids), scs.BARCODE_COL) or "none", "2024-05-05 05:05:05")
+        elif action == "recalc":
+            model.recalc()
+
+
+@pytest.fixture(autouse=True)
+def _isolated_paths(tmp_path, monkeypatch):
+    # nothing a test runs may write next to the module
+    monkeypatch.setattr(scs, "AUTOSAVE_PATH", str(tmp_path / "last_session.csv"))
+    monkeypatch.setattr(scs, "SETTINGS_PATH", str(tmp_path / "app_settings.json"))
+    monkeypatch.setattr(scs, "METRICS_PATH", str(tmp_path / "metrics.jsonl"))
+    monkeypatch.setattr(scs, "PROFILE_DIR", str(tmp_path / "profiles"))
+    monkeypatch.setattr(scs, "SESSION_DB_PATH", str(tmp_path / "last_session.sqlite3"))
+    monkeypatch.setattr(scs, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setattr(scs, "BARCODE_CACHE_DIR", str(tmp_path / "barcode_cache"))
+    monkeypatch.setattr(scs, "SCAN_EVENTS_PATH", str(tmp_path / "scan_events.sqlite3"))
+    monkeypatch.setattr(scs, "LABEL_SHEETS_DIR", str(tmp_path / "label_sheets"))
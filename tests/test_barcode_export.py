@@ -0,0 +1,19 @@
+import os
+import time
+
+import stock_cost_scanner as scs
+
+
+def test_prune_barcode_cache_drops_expired_then_oldest(tmp_path):
+    cache = tmp_path / "barcode_cache"
+    cache.mkdir()
+    now = time.time()
+    for i, age_days in enumerate((400, 30, 20, 10, 1)):
+        path = cache / f"{i}.png"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (now - age_days * 86400, now - age_days * 86400))
+    assert scs.prune_barcode_cache(str(cache), max_bytes=250, max_age_days=180) == 3
+    assert sorted(os.listdir(cache)) == ["3.png", "4.png"]
+    # under both caps: nothing goes
+    assert scs.prune_barcode_cache(str(cache), max_bytes=250, max_age_days=180) == 0
+    assert scs.prune_barcode_cache(str(tmp_path / "missing")) == 0
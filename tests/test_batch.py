@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+import stock_cost_scanner as scs
+from conftest import make_row
+
+
+def write(path, rows):
+    scs.write_sheet_csv(str(path), rows)
+    return str(path)
+
+
+def test_batch_applies_scans_barcodes_and_costs(tmp_path):
+    sheet = write(tmp_path / "sheet.csv", [
+        make_row(item="1", sku="A", qty="2", price="10", ship="1", barcode="B1"),
+        make_row(item="2", sku="B", qty="x", barcode="B2", scan="2024-01-01 08:00:00"),
+        make_row(item="3", sku="c c", barcode=""),
+    ])
+    scans = tmp_path / "scans.txt"
+    scans.write_text("B1\t2024-03-03 10:00:00\nB1\nB2\nMISSING\n\n", encoding="utf-8")
+    out, summary_path = tmp_path / "out.csv", tmp_path / "summary.json"
+    status = scs.cli_main(["batch", sheet, "-s", str(scans), "-o", str(out), "--summary", str(summary_path),
+                           "--barcode-mode", "sequence"])
+    assert status == 0
+    summary = json.loads(summary_path.read_text(encoding="utf-8"))
+    assert {k: summary[k] for k in ("rows", "scans", "scanned", "duplicate", "not_found", "generated",
+                                    "recalc_errors")} == {
+        "rows": 3, "scans": 4, "scanned": 1, "duplicate": 2, "not_found": 1, "generated": 1, "recalc_errors": 1}
+    assert summary["not_found_codes"] == ["MISSING"]
+    assert summary["errors"][0]["line"] == 3
+    rows = scs.read_sheet_csv(str(out))
+    assert rows[0][scs.SCAN_COL] == "2024-03-03 10:00:00"
+    assert rows[0][scs.TOTAL_COST_COL] == "21.00" and rows[0][scs.UNIT_COST_COL] == "10.50"
+    assert rows[1][scs.SCAN_COL] == "2024-01-01 08:00:00"
+    assert rows[2][scs.BARCODE_COL].startswith("CC")
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_batch_options_leave_the_sheet_alone(tmp_path, capsys):
+    rows = [make_row(barcode=""), make_row(barcode="B1")]
+    sheet = write(tmp_path / "sheet.csv", rows)
+    out = tmp_path / "out.csv"
+    assert scs.cli_main(["batch", sheet, "-o", str(out), "--no-generate", "--no-recalc"]) == 0
+    assert json.loads(capsys.readouterr().out)["generated"] == 0
+    assert scs.read_sheet_csv(str(out)) == rows
+
+
+def test_batch_reports_fatal_errors(tmp_path, capsys):
+    bad = tmp_path / "bad.csv"
+    bad.write_text("a,b\n1,2\n", encoding="utf-8")
+    assert scs.cli_main(["batch", str(bad), "-o", str(tmp_path / "out.csv")]) == 2
+    assert json.loads(capsys.readouterr().out)["fatal"].startswith("ValueError")
+    assert not (tmp_path / "out.csv").exists()
+
+
+
+def test_batch_memory_does_not_grow_with_the_sheet(tmp_path):
+    import sys
+    import tracemalloc
+    n = 20000
+    sheet = write(tmp_path / "big.csv", [make_row(item=str(i), sku=f"S{i % 7}", barcode=f"S{i % 7}-EXISTING-{i:06d}"
+                                                  if i % 2 else "") for i in range(n)])
+    out = tmp_path / "out.csv"
+    tracemalloc.start()
+    try:
+        summary = scs.run_batch(sheet, str(out), barcode_mode="sequence")
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    codes = scs.read_sheet_csv(str(out))
+    codes = [r[scs.BARCODE_COL] for r in codes]
+    assert summary["generated"] == n // 2
+    assert len(set(codes)) == n
+    # a set holding every barcode of the sheet would be bigger than the whole peak
+    as_set = set(codes)
+    assert peak < (sys.getsizeof(as_set) + sum(map(sys.getsizeof, as_set))) / 2
+
+
+def test_main_sends_only_subcommands_to_the_cli(monkeypatch, tmp_path):
+    opened = []
+
+    class FakeApp:
+        def mainloop(self):
+            opened.append(True)
+
+    monkeypatch.setattr(scs, "App", FakeApp)
+    monkeypatch.setattr(scs.sys, "argv", ["stock_cost_scanner.exe", str(tmp_path / "dropped.csv")])
+    scs.main()
+    assert opened == [True]
+
+    sheet = write(tmp_path / "sheet.csv", [make_row()])
+    monkeypatch.setattr(scs.sys, "argv", ["stock_cost_scanner.exe", "batch", sheet, "-o", str(tmp_path / "out.csv"),
+                                          "--summary", str(tmp_path / "summary.json")])
+    with pytest.raises(SystemExit) as exit_info:
+        scs.main()
+    assert exit_info.value.code == 0
+    assert opened == [True]
@@ -0,0 +1,40 @@
+import random
+
+import stock_cost_scanner as scs
+from conftest import edit_randomly, make_row, random_rows
+
+
+def full_report(model):
+    return scs.CostSummary(model).report()
+
+
+def test_summary_follows_edits():
+    rnd = random.Random(5)
+    model = scs.TableModel()
+    model.load(random_rows(100))
+    model.recalc()
+    summary = scs.CostSummary(model)
+    assert summary.report() == full_report(model)
+    for step in range(60):
+        version = summary.version
+        edit_randomly(model, rnd, 2)
+        assert summary.report() == full_report(model), step
+        assert summary.version >= version
+    model.load(random_rows(10, seed=9))
+    assert summary.report() == full_report(model)
+
+
+def test_summary_totals():
+    model = scs.TableModel()
+    model.load([make_row(month="2024-01", sku="A", qty="2", price="10", ship="1", scan="x"),
+                make_row(month="2024-01", sku="A", qty="1", price="5", ship="0"),
+                make_row(month="2024-01", sku="B", qty="4", price="abc"),
+                make_row(month="2024-02", sku="A", qty="0", price="1", ship="0")])
+    model.recalc()
+    assert scs.CostSummary(model).report() == [
+        ("2024-02", None, 1, 0.0, 0.0, 0.0, 0, 1),
+        ("2024-02", "A", 1, 0.0, 0.0, 0.0, 0, 1),
+        ("2024-01", None, 3, 7.0, 26.0, 26.0 / 7, 1, 2),
+        ("2024-01", "A", 2, 3.0, 26.0, 26.0 / 3, 1, 1),
+        ("2024-01", "B", 1, 4.0, 0.0, 0.0, 0, 1),
+    ]
@@ -0,0 +1,112 @@
+import os
+
+import stock_cost_scanner as scs
+from conftest import make_row, random_rows
+
+
+def snapshot_path(tmp_path):
+    return str(tmp_path / "last_session.csv")
+
+
+def test_records_replay_onto_the_snapshot(tmp_path):
+    path = snapshot_path(tmp_path)
+    rows = random_rows(20)
+    journal = scs.SessionJournal(path)
+    journal.compact([list(r) for r in rows], wait=True)
+    assert journal.has_baseline()
+
+    records = [
+        {"op": "set", "i": 3, "v": {str(scs.QTY_COL): "99"}},
+        {"op": "ins", "i": 0, "rows": [make_row(item="new")]},
+        {"op": "del", "i": [10, 5]},
+    ]
+    journal.append([dict(r) for r in records])
+    journal.close()
+    expected = [list(r) for r in rows]
+    for rec in records:
+        scs.SessionJournal.apply(expected, rec)
+
+    reopened = scs.SessionJournal(path)
+    replayed = scs.read_sheet_csv(path)
+    assert reopened.replay(replayed) == 3
+    assert replayed == expected
+    assert reopened.seq == 3
+    assert expected[4][scs.QTY_COL] == "99"
+    assert expected[0][scs.ITEM_COL] == "new"
+
+
+def test_compaction_folds_the_journal_into_the_snapshot(tmp_path):
+    path = snapshot_path(tmp_path)
+    journal = scs.SessionJournal(path)
+    journal.compact([make_row(item="0")], wait=True)
+    journal.append([{"op": "ins", "i": 1, "rows": [make_row(item="1")]}])
+    assert not journal.needs_compaction()
+    rows = [make_row(item="0"), make_row(item="1")]
+    journal.compact(rows, wait=True)
+    journal.append([{"op": "set", "i": 0, "v": {str(scs.ITEM_COL): "zero"}}])
+    journal.close()
+
+    assert len(journal._segments()) == 1  # the compacted segment is gone
+    reopened = scs.SessionJournal(path)
+    records = reopened.unapplied_records()
+    assert [r["s"] for r in records] == [2]
+    snap = scs.read_sheet_csv(path)
+    assert snap == rows
+    for rec in records:
+        reopened.apply(snap, rec)
+    assert [r[scs.ITEM_COL] for r in snap] == ["zero", "1"]
+    # the session cache written with the snapshot matches the CSV
+    assert scs.session_cache_valid(path)
+
+
+def test_new_records_continue_the_sequence(tmp_path):
+    path = snapshot_path(tmp_path)
+    journal = scs.SessionJournal(path)
+    journal.compact([make_row()], wait=True)
+    journal.append([{"op": "set", "i": 0, "v": {"0": "a"}}, {"op": "set", "i": 0, "v": {"0": "b"}}])
+    journal.close()
+    reopened = scs.SessionJournal(path)
+    reopened.unapplied_records()
+    reopened.append([{"op": "set", "i": 0, "v": {"0": "c"}}])
+    reopened.close()
+    assert [r["s"] for r in scs.SessionJournal(path).unapplied_records()] == [1, 2, 3]
+
+
+def test_torn_tail_is_ignored(tmp_path):
+    path = snapshot_path(tmp_path)
+    journal = scs.SessionJournal(path)
+    journal.compact([make_row()], wait=True)
+    journal.append([{"op": "set", "i": 0, "v": {"0": "a"}}])
+    journal.close()
+    with open(journal._segments()[-1], "a", encoding="utf-8") as f:
+        f.write('{"op":"set","i":0,"v":{"0":"b"')
+    assert [r["v"] for r in scs.SessionJournal(path).unapplied_records()] == [{"0": "a"}]
+
+
+def test_snapshot_changed_elsewhere_has_no_baseline(tmp_path):
+    path = snapshot_path(tmp_path)
+    journal = scs.SessionJournal(path)
+    journal.compact([make_row()], wait=True)
+    journal.append([{"op": "set", "i": 0, "v": {"0": "a"}}])
+    journal.close()
+    scs.write_sheet_csv(path, [make_row(), make_row(item="edited by hand")])
+    os.utime(path, ns=(1, 1))
+    reopened = scs.SessionJournal(path)
+    assert not reopened.has_baseline()
+    assert reopened.unapplied_records() == []
+
+
+def test_append_reports_the_bytes_written(tmp_path):
+    path = snapshot_path(tmp_path)
+    journal = scs.SessionJournal(path)
+    journal.compact([make_row()], wait=True)
+    assert journal.append([]) == 0
+    size = journal.append([{"op": "set", "i": 0, "v": {"3": "ชื่อ"}}])
+    journal.close()
+    assert size == os.path.getsize(journal._segments()[-1]) > 0
+
+    store = scs.SessionStore(str(tmp_path / "session.sqlite3"))
+    assert store.append([{"op": "ins", "i": 0, "rows": [make_row(name="ab")]}]) == \
+        sum(len(t.encode("utf-8")) for t in make_row(name="ab"))
+    assert store.append([{"op": "set", "i": 0, "v": {"3": "ชื่อ"}}]) == len("ชื่อ".encode("utf-8"))
+    store.close()
@@ -0,0 +1,32 @@
+import os
+
+import stock_cost_scanner as scs
+
+
+def test_new_label_sheet_path_keeps_only_the_newest_sheets(tmp_path):
+    folder = tmp_path / "label_sheets"
+    folder.mkdir()
+    for i in range(12):
+        (folder / f"labels-20240101-0000{i:02d}-000000.pdf").write_bytes(b"%PDF")
+    (folder / "notes.txt").write_text("kept", encoding="utf-8")
+    path = scs.new_label_sheet_path(keep=3)
+    assert os.path.dirname(path) == str(folder)
+    assert os.path.basename(path).startswith("labels-") and path.endswith(".pdf")
+    assert sorted(os.listdir(folder)) == ["labels-20240101-000010-000000.pdf",
+                                          "labels-20240101-000011-000000.pdf", "notes.txt"]
+    # the new sheet sorts after the old ones, so it is never the one pruned next
+    assert os.path.basename(path) > "labels-20240101-000011-000000.pdf"
+
+
+def test_label_font_falls_back_on_old_pillow(monkeypatch):
+    from PIL import ImageFont
+    real = ImageFont.load_default
+
+    def old_load_default(*args, **kwargs):
+        if args or kwargs:
+            raise TypeError("load_default() takes 0 positional arguments")
+        return real()
+
+    monkeypatch.setattr(scs, "LABEL_FONTS", ("no-such-font.ttf",))
+    monkeypatch.setattr(ImageFont, "load_default", old_load_default)
+    assert scs._label_font(40) is not None
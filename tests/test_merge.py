@@ -0,0 +1,114 @@
+import csv
+import json
+
+import pytest
+
+import stock_cost_scanner as scs
+from conftest import make_row
+
+QTY, PRICE, SCAN = scs.QTY_COL, scs.PRICE_COL, scs.SCAN_COL
+
+
+def write(path, rows):
+    scs.write_sheet_csv(str(path), rows)
+    return str(path)
+
+
+def run(model, paths, rules=None):
+    job = scs.SheetMerge.from_model(model, paths, rules)
+    job.run()
+    assert job.error is None
+    return job
+
+
+@pytest.fixture
+def model():
+    model = scs.TableModel()
+    model.load([
+        make_row(item="1", sku="A", qty="2", price="10", barcode="B1"),
+        make_row(item="2", sku="B", qty="3", price="20", scan="2024-01-01 08:00:00"),
+        make_row(item="3", sku="C", qty="1", barcode="DUP"),
+        make_row(item="4", sku="C", qty="1", barcode="DUP"),
+    ])
+    return model
+
+
+def test_default_rules(model, tmp_path):
+    source = write(tmp_path / "supplier.csv", [
+        make_row(item="x", sku="x", qty="5", price="11", barcode="B1"),      # by barcode
+        make_row(item="2", sku="B", qty="1", name="อื่น", scan="2024-02-02 09:00:00"),  # by month/item/SKU
+        make_row(item="9", sku="N", qty="7", barcode="NEW"),                 # added
+        make_row(item="9", sku="N", qty="1", barcode="NEW"),                 # merges into the added row
+        make_row(barcode="DUP"),                                             # ambiguous
+    ])
+    job = run(model, [source])
+    updated, added = job.apply(model)
+    rows = model.rows()
+    assert rows[0][QTY] == "7" and rows[0][PRICE] == "11"
+    assert rows[0][scs.ITEM_COL] == "1"  # other cells keep the sheet's value
+    assert rows[1][QTY] == "4" and rows[1][PRICE] == "10.50"
+    # a different name and an existing Scan are conflicts: the sheet keeps both
+    assert rows[1][scs.COL["ชื่อสินค้า"]] == "สินค้า"
+    assert rows[1][SCAN] == "2024-01-01 08:00:00"
+    assert len(rows) == 5 and rows[4][QTY] == "8"
+    assert updated == model.rids()[:2] and added == model.rids()[4:]
+    assert job.counts() == {"rows_read": 5, "added": 1, "updated": 2, "conflicts": 3}
+    kinds = [r[0] for r in job.report]
+    assert kinds.count("เพิ่ม") == 1 and kinds.count("ขัดแย้ง") == 5  # one line per conflicting cell
+
+
+def test_overwrite_and_keep_rules(model, tmp_path):
+    source = write(tmp_path / "s.csv", [
+        make_row(item="1", sku="A", qty="5", price="11", barcode="B1"),
+        make_row(item="2", sku="B", qty="9", scan="2024-02-02 09:00:00"),
+    ])
+    job = run(model, [source], {"qty": "overwrite", "price": "keep", "scan": "overwrite", "bogus": "x"})
+    assert job.rules == {"qty": "overwrite", "price": "keep", "scan": "overwrite"}
+    job.apply(model)
+    rows = model.rows()
+    assert rows[0][QTY] == "5" and rows[0][PRICE] == "10"
+    assert rows[1][QTY] == "9" and rows[1][SCAN] == "2024-02-02 09:00:00"
+
+
+def test_sources_merge_in_order(model, tmp_path):
+    first = write(tmp_path / "a.csv", [make_row(item="1", sku="A", qty="1", barcode="B1")])
+    second = write(tmp_path / "b.csv", [make_row(item="1", sku="A", qty="1.5", barcode="B1")])
+    job = run(model, [first, second])
+    job.apply(model)
+    assert model.rows()[0][QTY] == "4.50"
+    assert job.bytes_read == job.total_bytes
+
+
+def test_merge_cells_sum_needs_numbers():
+    plan = scs.merge_plan(scs.merge_rules())
+    changes, conflicts = scs.merge_cells(make_row(qty="many"), make_row(qty="2"), plan)
+    assert QTY not in changes
+    assert (QTY, "many", "2") in conflicts
+
+
+def test_write_merge_report(model, tmp_path):
+    source = write(tmp_path / "s.csv", [make_row(item="1", sku="A", qty="5", barcode="B1")])
+    job = run(model, [source])
+    path = scs.write_merge_report(str(tmp_path / "report.csv"), job.report)
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        lines = list(csv.reader(f))
+    assert tuple(lines[0]) == scs.MERGE_REPORT_COLUMNS
+    assert lines[1][0] == "แก้ไข" and lines[1][5] == scs.COLUMNS[QTY]
+
+
+def test_merge_command(tmp_path):
+    sheet = write(tmp_path / "sheet.csv", [make_row(item="1", sku="A", qty="2", price="10", ship="0", barcode="B1")])
+    first = write(tmp_path / "a.csv", [make_row(item="1", sku="A", qty="3", price="12", ship="0", barcode="B1")])
+    second = write(tmp_path / "b.csv", [make_row(item="7", sku="N", qty="1", price="5", ship="1", barcode="B7")])
+    out, report, summary_path = tmp_path / "out.csv", tmp_path / "report.csv", tmp_path / "summary.json"
+    status = scs.cli_main(["merge", sheet, first, second, "-o", str(out), "--report", str(report),
+                           "--summary", str(summary_path), "--qty", "overwrite", "--price", "keep"])
+    assert status == 0
+    summary = json.loads(summary_path.read_text(encoding="utf-8"))
+    assert summary["rules"] == {"qty": "overwrite", "price": "keep", "scan": "keep"}
+    assert (summary["rows"], summary["added"], summary["updated"], summary["conflicts"]) == (2, 1, 1, 1)
+    rows = scs.read_sheet_csv(str(out))
+    assert rows[0][scs.QTY_COL] == "3" and rows[0][scs.PRICE_COL] == "10"
+    assert rows[0][scs.TOTAL_COST_COL] == "30.00"
+    assert rows[1][scs.BARCODE_COL] == "B7" and rows[1][scs.TOTAL_COST_COL] == "6.00"
+    assert report.exists()
@@ -0,0 +1,34 @@
+import os
+
+import stock_cost_scanner as scs
+from conftest import make_row
+
+
+def test_reopening_reads_first_and_drops_the_shard_separately(tmp_path):
+    archive = scs.MonthArchive(str(tmp_path / "archive"))
+    rows = [make_row(month="2024-01", barcode="A", scan="2024-01-05 10:00:00"), make_row(month="2024-02", barcode="B")]
+    assert archive.close_months(rows) == ["2024-01", "2024-02"]
+    assert archive.months() == ["2024-01", "2024-02"]
+    assert archive.lookup("A") == [("2024-01", "2024-01-05 10:00:00")]
+
+    assert archive.read_month("2024-01") == rows[:1]
+    # reading alone changes nothing: the rows are only dropped once the session has them
+    assert archive.months() == ["2024-01", "2024-02"]
+    assert os.path.exists(archive._shard_path("2024-01"))
+
+    archive.drop_month("2024-01")
+    assert archive.months() == ["2024-02"]
+    assert archive.lookup("A") == []
+    assert archive.codes() == {"B"}
+    assert not os.path.exists(archive._shard_path("2024-01"))
+    archive.close()
+
+
+def test_closing_a_month_again_appends_to_its_shard(tmp_path):
+    archive = scs.MonthArchive(str(tmp_path / "archive"))
+    archive.close_months([make_row(month="2024-01", item="1", barcode="A")])
+    archive.close_months([make_row(month="2024-01", item="2", barcode="B")])
+    assert [r[scs.ITEM_COL] for r in archive.read_month("2024-01")] == ["1", "2"]
+    assert archive.summaries()["2024-01"]["rows"] == 2
+    assert archive.codes() == {"A", "B"}
+    archive.close()
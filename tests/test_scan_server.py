@@ -0,0 +1,111 @@
+import json
+import queue
+import socket
+import threading
+
+import pytest
+
+import stock_cost_scanner as scs
+from conftest import make_row
+
+
+@pytest.fixture
+def server():
+    model = scs.TableModel()
+    model.load([make_row(barcode="A1"), make_row(barcode="B2", scan="2024-01-01 08:00:00")])
+    inbox = queue.Queue()
+    stations = []
+
+    def drain():
+        # stands in for the window's inbox poll: table writes on one thread
+        while True:
+            item = inbox.get()
+            if item is None:
+                return
+            code, ts, station, future = item
+            stations.append(station)
+            future.set_result(model.apply_scan(code, ts))
+
+    worker = threading.Thread(target=drain, daemon=True)
+    worker.start()
+    srv = scs.ScanServer(inbox, tcp_port=0, http_port=0).start()
+    srv.model, srv.stations = model, stations
+    yield srv
+    srv.stop()
+    inbox.put(None)
+    worker.join(5)
+
+
+def connect(srv, kind):
+    return socket.create_connection(srv.addresses[kind], timeout=5)
+
+
+def read_lines(sock, count):
+    data = b""
+    while data.count(b"\n") < count:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return data.decode("utf-8").splitlines()
+
+
+def http(srv, request):
+    with connect(srv, "http") as sock:
+        sock.sendall(request.encode("utf-8"))
+        data = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    head, _, body = data.partition(b"\r\n\r\n")
+    return head.decode("latin-1").split("\r\n")[0], json.loads(body.decode("utf-8"))
+
+
+def test_tcp_pipelined_replies_come_back_in_order(server):
+    with connect(server, "tcp") as sock:
+        sock.sendall(b"A1\tdock\nA1\nNOPE\n\nB2\r\n")
+        lines = read_lines(sock, 5)
+    assert lines[0].startswith("OK ")
+    assert lines[1] == "DUPLICATE " + lines[0][3:]
+    assert lines[2:] == ["NOT_FOUND", "ERROR empty barcode", "DUPLICATE 2024-01-01 08:00:00"]
+    assert server.stations[0] == "dock"
+    assert server.received == 4
+
+
+def test_tcp_line_too_long_is_answered_and_skipped(server):
+    with connect(server, "tcp") as sock:
+        sock.sendall(b"X" * (200 * 1024) + b"\nA1\n")
+        lines = read_lines(sock, 2)
+    assert lines[0] == "ERROR line too long"
+    assert lines[1].startswith("OK ")
+    assert server.received == 1
+
+
+def test_tcp_last_line_without_newline(server):
+    with connect(server, "tcp") as sock:
+        sock.sendall(b"A1")
+        sock.shutdown(socket.SHUT_WR)
+        assert read_lines(sock, 1)[0].startswith("OK ")
+
+
+def test_http_get_and_post(server):
+    status, body = http(server, "GET /scan?code=A1&station=web HTTP/1.1\r\nHost: x\r\n\r\n")
+    assert status == "HTTP/1.1 200 OK"
+    assert body["results"][0]["outcome"] == "ok"
+    assert server.stations == ["web"]
+
+    payload = "A1\nNOPE\n"
+    status, body = http(server, f"POST /scan HTTP/1.1\r\nContent-Length: {len(payload)}\r\n\r\n{payload}")
+    assert status == "HTTP/1.1 200 OK"
+    assert [r["outcome"] for r in body["results"]] == ["duplicate", "not_found"]
+
+
+def test_http_errors(server):
+    assert http(server, "GET /other HTTP/1.1\r\n\r\n")[0] == "HTTP/1.1 404 Not Found"
+    assert http(server, "GET /scan HTTP/1.1\r\n\r\n")[0] == "HTTP/1.1 400 Bad Request"
+    assert http(server, "PUT /scan HTTP/1.1\r\n\r\n")[0] == "HTTP/1.1 405 Method Not Allowed"
+    status, _ = http(server, f"POST /scan HTTP/1.1\r\nContent-Length: {scs.SCAN_SERVER_MAX_BODY + 1}\r\n\r\n")
+    assert status == "HTTP/1.1 413 Payload Too Large"
+    assert server.received == 0
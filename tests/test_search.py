@@ -0,0 +1,32 @@
+import random
+
+import pytest
+
+import stock_cost_scanner as scs
+from conftest import edit_randomly, random_rows
+
+
+def brute_force(model, query):
+    q = query.strip().casefold()
+    if not q:
+        return set()
+    return {rid for rid in model.rids()
+            if any(q in model.get(rid, col).casefold() for col in scs.SEARCH_COLUMNS)}
+
+
+@pytest.mark.parametrize("query", ["", "sku", "SKU-A", "a", "ss", "STRASSE", "bc000", "เสื้อ", "10", "\x00", "zzz"])
+def test_search_matches_brute_force(query):
+    model = scs.TableModel()
+    model.load(random_rows(300))
+    assert scs.SearchIndex(model).matches(query) == brute_force(model, query)
+
+
+def test_search_follows_edits():
+    rnd = random.Random(3)
+    model = scs.TableModel()
+    model.load(random_rows(100))
+    index = scs.SearchIndex(model)
+    for step in range(40):
+        edit_randomly(model, rnd, 3)
+        for query in ("sku", "x1", "s", "bc00", "bag"):
+            assert index.matches(query) == brute_force(model, query), (step, query)
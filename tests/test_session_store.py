@@ -0,0 +1,53 @@
+import sqlite3
+
+import stock_cost_scanner as scs
+from conftest import make_row, random_rows
+
+
+def stored_rows(path):
+    db = sqlite3.connect(path)
+    try:
+        return [list(r) for r in db.execute(f"SELECT {', '.join(scs.SESSION_DB_FIELDS)} FROM rows ORDER BY ord")]
+    finally:
+        db.close()
+
+
+def test_records_appended_during_a_background_rewrite_land_after_it(tmp_path):
+    path = str(tmp_path / "session.sqlite3")
+    store = scs.SessionStore(path)
+    rows = random_rows(20000)
+    expected = [list(r) for r in rows]
+    store.compact(rows)
+    assert store.compacting()
+    records = [
+        {"op": "set", "i": 5, "v": {str(scs.QTY_COL): "77"}},
+        {"op": "ins", "i": 0, "rows": [make_row(item="first")]},
+        {"op": "del", "i": [100, 3]},
+        {"op": "ins", "i": 1, "rows": [make_row(item="a"), make_row(item="b")]},
+    ]
+    for rec in records:
+        store.append([rec])
+        scs.SessionJournal.apply(expected, rec)
+    store.close()
+    assert store._backlog == []
+    assert stored_rows(path) == expected
+
+    reopened = scs.SessionStore(path)
+    assert reopened.has_baseline()
+    reopened.append([{"op": "set", "i": 0, "v": {str(scs.ITEM_COL): "again"}}])
+    reopened.close()
+    assert stored_rows(path)[0][scs.ITEM_COL] == "again"
+
+
+def test_a_newer_compaction_replaces_the_backlog(tmp_path):
+    path = str(tmp_path / "session.sqlite3")
+    store = scs.SessionStore(path)
+    store.compact(random_rows(5000))
+    store.append([{"op": "ins", "i": 0, "rows": [make_row(item="lost on purpose")]}])
+    final = [make_row(item="1"), make_row(item="2")]
+    store.compact(final)
+    store.append([{"op": "set", "i": 1, "v": {str(scs.ITEM_COL): "two"}}])
+    store.flush()
+    assert not store.compacting()
+    store.close()
+    assert [r[scs.ITEM_COL] for r in stored_rows(path)] == ["1", "two"]
@@ -0,0 +1,160 @@
+import pytest
+
+import stock_cost_scanner as scs
+from conftest import make_row, random_rows
+
+QTY, PRICE, SHIP = scs.QTY_COL, scs.PRICE_COL, scs.SHIP_COL
+TOTAL, UNIT = scs.TOTAL_COST_COL, scs.UNIT_COST_COL
+
+
+def loaded(rows):
+    model = scs.TableModel()
+    model.load(rows)
+    events = []
+    model.subscribe(lambda kind, rids, info: events.append((kind, list(rids), info)))
+    return model, events
+
+
+def test_load_round_trips_cell_texts():
+    rows = random_rows(200) + [make_row(qty="1e3", price="007", ship="-0", barcode=" X ")]
+    model, _ = loaded(rows)
+    assert model.rows() == rows
+    assert len(model) == len(rows)
+
+
+def test_insert_and_delete_keep_order_and_reuse_slots():
+    model, events = loaded([make_row(item=str(i)) for i in range(5)])
+    first = model.rid_at(0)
+    rids = model.insert_rows(2, [make_row(item="a"), make_row(item="b")])
+    assert [r[scs.ITEM_COL] for r in model.rows()] == ["0", "1", "a", "b", "2", "3", "4"]
+    assert events[-1] == ("insert", rids, 2)
+    assert model.position(rids[1]) == 3
+
+    gone = model.delete([rids[0], first, first])
+    assert gone == [rids[0], first]
+    assert events[-1] == ("delete", gone, [2, 0])
+    assert [r[scs.ITEM_COL] for r in model.rows()] == ["1", "b", "2", "3", "4"]
+    assert first not in model
+
+    again = model.append_rows([make_row(item="c", barcode="NEW")])
+    assert again[0] in gone  # freed slots are handed out again, cleared
+    assert model.row(again[0]) == make_row(item="c", barcode="NEW")
+    assert model.find_barcode("NEW") == again
+
+
+def test_update_cells_sends_one_update():
+    model, events = loaded([make_row(barcode="A"), make_row(barcode="B")])
+    a, b = model.rids()
+    model.update_cells({a: {QTY: "5", scs.BARCODE_COL: "C"}, b: {PRICE: "x"}})
+    assert events == [("update", [a, b], {QTY, scs.BARCODE_COL, PRICE})]
+    assert model.get(a, QTY) == "5"
+    assert model.get(b, PRICE) == "x"
+    assert model.number(b, PRICE) != model.number(b, PRICE)
+    assert model.find_barcode("A") == []
+    assert model.find_barcode("C") == [a]
+
+
+def test_paste_block_updates_existing_rows_and_appends_the_rest():
+    model, events = loaded([make_row(item=str(i), scan="done") for i in range(3)])
+    template = make_row(month="T", item="", sku="", name="", qty="", price="", ship="")
+    data = [["9", "1.5"], ["8"], ["7", "2", "4", "", "", "S", "2024-01-01", "past the last column"]]
+    rids, added = model.paste_block(1, QTY, data, template)
+    assert rids == model.rids()[1:3]
+    assert [model.get(r, QTY) for r in model.rids()] == ["2", "9", "8", "7"]
+    assert model.get(rids[0], PRICE) == "1.5"
+    assert model.get(rids[1], PRICE) == "10.50"  # short row leaves the rest alone
+    assert model.row(added[0])[:8] == ["T", "", "", "", "7", "2", "4", ""]
+    assert model.get(added[0], scs.BARCODE_COL) == "S"
+    assert model.get(added[0], scs.SCAN_COL) == ""  # Scan is protected
+    assert [e[0] for e in events] == ["update", "insert"]
+    assert events[0][2] == {QTY, PRICE}
+
+
+def test_paste_block_skips_protected_scan_column():
+    model, _ = loaded([make_row(scan="")])
+    model.paste_block(0, scs.SCAN_COL, [["2024-01-01"]], make_row())
+    assert model.get(model.rid_at(0), scs.SCAN_COL) == ""
+
+
+@pytest.mark.parametrize("numpy_min", [1, 10 ** 9])
+def test_recalc_matches_the_formula(monkeypatch, numpy_min):
+    monkeypatch.setattr(scs, "RECALC_NUMPY_MIN_ROWS", numpy_min)
+    rows = random_rows(300, seed=7)
+    model, events = loaded(rows)
+    result = model.recalc()
+    bad = set()
+    for rid, row in zip(model.rids(), rows):
+        nums = [scs._encode_number(row[c])[0] for c in (QTY, PRICE, SHIP)]
+        if any(v != v for v in nums):
+            bad.add(rid)
+            assert model.get(rid, TOTAL) == ""
+            continue
+        qty, price, ship = nums
+        total = qty * price + ship
+        assert model.get(rid, TOTAL) == f"{round(total, 2):.2f}"
+        assert model.get(rid, UNIT) == f"{(round(total / qty, 2) if qty else 0.0):.2f}"
+    assert {rid for rid, _, _ in result.errors} == bad
+    assert result.computed == len(rows) - len(bad)
+    assert sorted(result.changed) == sorted(set(model.rids()) - bad)
+    assert events[-1][0] == "update" and events[-1][2] == {TOTAL, UNIT}
+
+    events.clear()
+    again = model.recalc()
+    assert again.changed == []
+    assert events == []
+
+
+def test_recalc_half_cent_rounding_is_the_same_on_both_engines(monkeypatch):
+    rows = [make_row(qty="1", price=f"{i / 1000:.3f}", ship="0") for i in range(0, 2000, 5)]
+    texts = []
+    for numpy_min in (1, 10 ** 9):
+        monkeypatch.setattr(scs, "RECALC_NUMPY_MIN_ROWS", numpy_min)
+        model, _ = loaded(rows)
+        model.recalc()
+        texts.append(model.column(TOTAL))
+    assert texts[0] == texts[1]
+
+
+def test_apply_scan_first_row_wins_and_never_overwrites():
+    model, _ = loaded([make_row(barcode="X"), make_row(barcode="X"), make_row(barcode="Y", scan="old")])
+    first = model.rid_at(0)
+    ok = model.apply_scan(" X ", "2024-02-02 09:00:00")
+    assert (ok.outcome, ok.rid, ok.matches) == ("ok", first, 2)
+    assert model.apply_scan("X").outcome == "duplicate"
+    assert model.apply_scan("Y").timestamp == "old"
+    assert model.apply_scan("Z").outcome == "not_found"
+
+
+@pytest.mark.parametrize("mode", scs.BARCODE_MODES)
+def test_assign_barcodes_fills_only_empty_cells_with_unique_codes(mode):
+    model, _ = loaded([make_row(sku="sku a", barcode="KEEP")] + [make_row(sku="sku a") for _ in range(50)])
+    result = model.assign_barcodes(mode=mode)
+    codes = model.column(scs.BARCODE_COL)
+    assert (result.generated, result.skipped) == (50, 1)
+    assert codes[0] == "KEEP"
+    assert len(set(codes)) == len(codes)
+    assert all(code.startswith("SKUA") for code in codes[1:])
+
+
+def test_assign_barcodes_skips_reserved_codes(tmp_path):
+    model, _ = loaded([make_row(sku="A") for _ in range(3)])
+    archive = scs.MonthArchive(str(tmp_path / "archive"))
+    assert archive.codes() == set()
+    assert not (tmp_path / "archive").exists()  # asking does not create the index
+    head = f"A-{scs.datetime.datetime.now():%Y%m}"
+    archive.close_months([make_row(month="2023-12", sku="A", barcode=f"{head}-000002")])
+    model.assign_barcodes(mode="sequence", reserved=archive.codes())
+    archive.close()
+    assert model.column(scs.BARCODE_COL) == [f"{head}-000003", f"{head}-000004", f"{head}-000005"]
+
+
+def test_frozen_copy_is_detached():
+    rows = random_rows(50) + [make_row(qty="lots")]
+    model, events = loaded(rows)
+    copy = model.frozen_copy()
+    model.update_cells({model.rid_at(0): {QTY: "1000", scs.ITEM_COL: "changed"}})
+    model.delete([model.rid_at(1)])
+    model.append_rows([make_row()])
+    assert copy.rows() == rows
+    assert copy.position(copy.rid_at(3)) == 3
+    assert [e[0] for e in events] == ["update", "delete", "insert"]  # the copy notifies nobody